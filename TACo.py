@@ -1,34 +1,83 @@
 import os
 import json
-from typing import Dict, List, Tuple
+import time
+import hashlib
+import getpass
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Set, Tuple, TypeVar
 from datetime import datetime
 from pathlib import Path
 
-import psutil
-
-from taco.DatabaseController import DatabaseController
+from taco.DatabaseController import DatabaseController, Reservation
+from taco.ConnectionProfile import ConnectionProfile, DEFAULT_PROFILE
 from taco.Testbench import Testbench
+from taco.TestbenchRegistry import TestbenchRegistry
+from taco.TestbenchIndex import TestbenchIndex
+from taco.SessionMonitor import SessionMonitor
+from taco.OfflineReplica import OfflineReplica
+from taco.SiteDatabases import SiteDatabases
+from taco.Metrics import Metrics, metrics
+
+
+T = TypeVar('T')
+LockSnapshot = Tuple[Dict[str, Tuple[str, datetime]], Dict[str, List[str]], Dict[str, Reservation]]     # Lock data, wait queues and next reservations
 
 
 class TestbenchAccessController():
     # SETTINGS_FILE = os.path.join(os.environ['LOCALAPPDATA'], '.taco')
     SETTINGS_FILE       = '.taco_settings'  # Settings file
+    REPLICA_FILE        = '.taco_replica'   # Local replica of the lock data, used while the database is unavailable
     LOCK_UPDATE_TIMER   = 10                # Time after which lock data is refreshed
+    LOCK_REFRESH_TIMER  = 30                # Time after which lock data is read even without changes, as expiring leases do not modify the database
+    LOCK_LEASE_TIME     = 60                # Time after which locks of remote desktop sessions expire unless renewed
+    HEARTBEAT_TIMER     = 20                # Time between two renewals of the leases held by this client
+    PROBE_TIMER         = 30                # Time between two reachability checks of all testbenches
+    SITE_POLL_TIMEOUT   = 2                 # Time a poll waits for the databases of other sites, later results are merged with the next poll
+    RESERVATION_NOTICE  = 4 * 3600          # Locks taken less than this before a reservation of another user are reported
     
 
     def __init__(self):
         self.database: DatabaseController = None
+        self.database_profile: str = DEFAULT_PROFILE
+        self.broker: str = ''                   # Address of the lock broker, empty for direct database access
+        self.offline_database: str = ''         # Database which became unavailable, empty while connected
+        self.slow_operation_ms: float = Metrics.SLOW_THRESHOLD * 1000     # Operations taking longer are logged, 0 disables the log
+        self.database_available: bool = False   # Set by check_database_available() once the unavailable database is back
 
-        self.username: str = os.getlogin()      # Default Username
+        self.username: str = self.default_username()
        
         self.testbenchJson: Path = Path()
-        self.testbenches: List[Testbench] = []
+        self.testbenches: TestbenchRegistry = TestbenchRegistry()
         self.tb_structure = []
+        self.testbenchJson_stamp: Tuple[int, int] = None    # Modification time and size of the loaded testbench file
+        self.testbenchJson_hash: str = None                 # Hash of the loaded content, to ignore touches without changes
+        self.__search_index: TestbenchIndex = None          # Built on the first search after the testbenches changed
+        self.__site_groups: Dict[str, Tuple[str]] = None    # Hostnames per site, built on first use after the testbenches or sites changed
+        self.__hostname_sites: Dict[str, str] = {}
         
         self.lock_cache: Dict[str, Tuple[str, datetime]] = {}
         self.lock_cache_time: datetime = datetime.min
+        self.polled_hostnames: Tuple[str] = ()
+        self.__lock_read: float = None                  # Monotonic time of the last poll reading the lock data regardless of changes
+        self.queue_cache: Dict[str, List[str]] = {}     # Users waiting for the testbenches, keyed by hostname
+        self.reservation_cache: Dict[str, Reservation] = {}     # Current or next reservation of the testbenches, keyed by hostname
+        self.handovers: List[str] = []                  # Ids of testbenches handed over to this user since the last notification
+        self.handover_leases: Set[str] = set()          # Hostnames handed over to this user, whose leases are renewed by the heartbeat
+        self.conflicts: List[str] = []                  # Lock changes made offline which conflicted when reconciled
+        self.notices: List[str] = []                    # Locks refused by or colliding with reservations of other users, and lost leases
+
+        self.replica = OfflineReplica(self.REPLICA_FILE)
+        self.sites = SiteDatabases()                    # Databases of further sites, keyed by the site names used in the testbench file
         
-        self.subprocesses: Dict[int, int] = {}
+        self.sessions = SessionMonitor(self)
+
+        self.heartbeat: threading.Thread = None
+
+        self.__settings_batch: int = 0              # Nesting level of batch_settings()
+        self.__settings_dirty: bool = False         # Settings changed during a batch
+        self.__saved_settings: dict = None          # Content of the settings file, to skip writes without changes
         
         self.load_settings()
         
@@ -38,7 +87,13 @@ class TestbenchAccessController():
         try:
             return Path(self.database.dbFile)
         except AttributeError:
-            return Path()
+            return Path(self.offline_database)
+
+
+    @property
+    def offline(self) -> bool:
+        """True while the database is unavailable and the lock data is served from the local replica."""
+        return bool(self.offline_database)
         
         
     @property            
@@ -46,62 +101,440 @@ class TestbenchAccessController():
         return (datetime.now() - self.lock_cache_time).total_seconds()
 
 
+    @staticmethod
+    def default_username() -> str:
+        """Returns the login name, falling back to the user of the process if there is no controlling terminal."""
+        try:
+            return os.getlogin()
+        except OSError:
+            return getpass.getuser()
+
+
     def set_username(self, username) -> None:
         if username:
             self.username = username
         else:
-            self.username = os.getlogin()
+            self.username = self.default_username()
         self.save_settings()
 
 
-    def set_database(self, database) -> Tuple[bool, str]:
+    def set_slow_operation_ms(self, threshold: float) -> None:
+        """Sets the duration in ms above which operations are logged as slow, 0 disables the log."""
+        self.slow_operation_ms = max(float(threshold), 0.0)
+        metrics.slow_threshold = self.slow_operation_ms / 1000 if self.slow_operation_ms else None
+        self.save_settings()
+
+
+    def set_database(self, database, profile: str = None, allow_migration: bool = False) -> Tuple[bool, str]:
+        """Connects to the database and registers the testbenches. Databases of versions before the schema versioning
+        are refused unless allow_migration is set, as migrating them breaks the older clients sharing them.
+        """
         if not database:
             return (False, 'No database selected')
         
-        self.database = DatabaseController(database)
-        for tb in self.testbenches:
-            try:
-                self.database.add_testbench(tb.hostname)
-            except ValueError as err:
-                return (False, err)
+        try:
+            self.database = self.__connect(database, profile or self.database_profile, allow_migration)
+            self.database_profile = self.database.profile.name
+            self.register_testbenches(self.testbenches.hostnames)
+        except (ValueError, sqlite3.Error) as err:
+            return (False, err)
+        self.offline_database = ''
 
         self.save_settings()
         return (True, '')
     
 
+    def __connect(self, database: str, profile: str, allow_migration: bool = False) -> DatabaseController:
+        """Connects to the lock broker if configured, falling back to direct access of the database file."""
+        if self.broker:
+            from taco.BrokerClient import BrokerClient     # Imported on demand, as it loads asyncio
+            try:
+                return BrokerClient.from_address(self.broker)
+            except OSError:
+                pass    # Broker unavailable
+        return DatabaseController(database, ConnectionProfile.get(profile), allow_migration)
+
+
+    def attach_site(self, site: str, database: str) -> None:
+        """Attaches the lock database of a site. Testbenches with this site in the testbench file are locked in its database,
+        which is opened and polled in the background, so an unreachable site does not block the others.
+
+        Raises:
+            ValueError: Raised if the site name is empty.
+        """
+        self.sites.attach(site, os.path.abspath(database), self.database_profile)
+        self.__site_groups = None
+        self.save_settings()
+
+
+    def detach_site(self, site: str) -> None:
+        """Detaches the lock database of the site. Its testbenches are locked in the main database afterwards."""
+        self.sites.detach(site)
+        self.__site_groups = None
+        self.save_settings()
+
+
+    def get_site(self, hostname: str) -> str:
+        """Returns the attached site whose database holds the lock of the testbench, '' for the main database."""
+        self.__get_site_groups()
+        return self.__hostname_sites.get(hostname, '')
+
+
+    def __get_site_groups(self) -> Dict[str, Tuple[str]]:
+        """Returns the unique hostnames per site, '' for the main database. Testbenches of sites which are not attached
+        are locked in the main database, and a hostname belongs to the site of its first testbench.
+        """
+        groups = self.__site_groups
+        if groups is None:
+            sites: Dict[str, str] = {}
+            for testbench in self.testbenches:
+                sites.setdefault(testbench.hostname, testbench.site if testbench.site in self.sites else '')
+            hostnames: Dict[str, List[str]] = {'': []}
+            for hostname, site in sites.items():
+                hostnames.setdefault(site, []).append(hostname)
+            groups = {site: tuple(group) for site, group in hostnames.items()}
+            self.__hostname_sites, self.__site_groups = sites, groups
+        return groups
+
+
+    def go_offline(self, database: str = None) -> None:
+        """Switches to the local replica after the database became unavailable. The lock data of the last snapshot is
+        served from the cache, and lock changes are queued in the replica until the database is back.
+
+        Args:
+            database (str, optional): Path of the unavailable database. Defaults to the current database.
+        """
+        if database is None:
+            if self.database is None:
+                return
+            database = self.database.dbFile
+        self.offline_database = os.path.abspath(database)
+        self.database_available = False
+        self.database = None
+
+        if not any(lock_user for lock_user, _ in self.lock_cache.values()):
+            self.lock_cache.update(self.replica.load_snapshot(self.offline_database))     # Nothing read yet, e.g. at startup
+            for _, action, hostnames, _, _, expected in self.replica.get_intents(self.offline_database):
+                self.__apply_intent(action, hostnames)
+
+
+    def check_database_available(self) -> bool:
+        """Checks whether the unavailable database file is reachable again. Accessing an unavailable share may block
+        until the timeout of the file system, so this is meant to be called from a background thread.
+        """
+        self.database_available = self.offline and os.path.exists(self.offline_database)
+        return self.database_available
+
+
+    def reconnect(self) -> bool:
+        """Connects to the database again once check_database_available() succeeded, and reconciles the lock changes queued meanwhile.
+        Conflicting changes are added to the conflicts.
+
+        Returns:
+            bool: True if connected to the database.
+        """
+        if not self.offline:
+            return True
+        if not self.database_available:
+            return False
+
+        database = self.offline_database
+        success, _ = self.set_database(database, self.database_profile)
+        if success:
+            try:
+                self.reconcile(database)
+            except sqlite3.OperationalError as err:
+                if 'locked' in str(err):
+                    return True     # Remaining intents are reconciled with the next reconnect
+                self.go_offline(database)
+                return False
+        self.database_available = False
+        return success
+
+
+    def reconcile(self, databaseFile: str) -> List[str]:
+        """Applies the lock intents queued while the database was unavailable in the order they were made.
+        Locks taken by other users meanwhile are not overwritten, but reported as conflicts.
+
+        Returns:
+            List[str]: Descriptions of the conflicting intents.
+        """
+        conflicts = []
+        for id, action, hostnames, lock_user, lease, expected in self.replica.get_intents(databaseFile):
+            try:
+                if action == 'acquire':
+                    success, lockDict = self.database.try_acquire_multiple(hostnames, lock_user, lease)
+                    if not success:
+                        conflicts.append(self.__describe_refusal(hostnames, lock_user, lockDict))
+                elif action == 'release':
+                    lockDict = self.database.release_multiple(hostnames, lock_user)
+                else:
+                    # Removing a lock is only applied if the holder did not change meanwhile
+                    changed = self.database.unset_locks({hostname: expected.get(hostname, '') for hostname in hostnames})
+                    if changed:
+                        conflicts.append(f'Lock of {", ".join(changed)} was changed by another user while offline and is kept.')
+            except ValueError as err:
+                conflicts.append(str(err))      # Testbench removed meanwhile
+            self.replica.remove_intent(id)
+
+        self.conflicts += conflicts
+        self.polled_hostnames = ()      # Read the lock data again, including the own changes
+        return conflicts
+
+
+    def __describe_refusal(self, hostnames: Tuple[str], lock_user: str, lockDict: Dict[str, Tuple[str, datetime]]) -> str:
+        """Describes why the locks of the testbenches could not be acquired while reconciling, held by other users or reserved."""
+        holders = {hostname: lock_by for hostname, (lock_by, _) in lockDict.items() if lock_by not in ('', lock_user)}
+        if holders:
+            return f'Lock of {", ".join(holders)} was taken by {", ".join(set(holders.values()))} while offline.'
+
+        reservations = self.database.get_next_reservations(hostnames)
+        reserved = {hostname: reserved_by for hostname, (_, reserved_by, start, _) in reservations.items()
+                    if reserved_by != lock_user and start <= datetime.now()}
+        if reserved:
+            return f'Lock of {", ".join(reserved)} was refused while offline, it is reserved by {", ".join(set(reserved.values()))}.'
+        return f'Lock of {", ".join(hostnames)} was refused while offline.'
+
+
+    def pop_conflicts(self) -> List[str]:
+        """Returns the conflicts found by reconcile() since the last call."""
+        conflicts, self.conflicts = self.conflicts, []
+        return conflicts
+
+
+    def __write(self, action: str, hostnames: Tuple[str], lease: float, operation: Callable[[DatabaseController], T], database: DatabaseController = None) -> T:
+        """Runs the lock operation with the database owning the testbenches, or queues it as intent in the replica while
+        the main database is unavailable. Queued intents are applied to the lock cache right away.
+        Operations on the databases of other sites are not queued, they raise a ValueError while the site is unavailable.
+
+        Raises:
+            ValueError: Raised if no database is selected.
+
+        Returns:
+            T: Return value of the operation, or None if the intent was queued or refused by the cached lock data.
+        """
+        site = self.__get_database_site(hostnames)
+        if site:
+            return self.sites.run(site, operation)
+
+        if not self.offline:
+            try:
+                return operation(self.__get_database(database))
+            except sqlite3.OperationalError as err:
+                if 'locked' in str(err) or self.database is None:
+                    raise
+                self.go_offline()
+
+        expected = {hostname: self.lock_cache.get(hostname, ('',))[0] for hostname in hostnames}
+        if action == 'acquire' and any(lock_user not in ('', self.username) for lock_user in expected.values()):
+            return None     # Held by another user as far as known
+        self.replica.add_intent(self.offline_database, action, hostnames, self.username, lease, expected)
+        self.__apply_intent(action, hostnames)
+        return None
+
+
+    def __apply_intent(self, action: str, hostnames: Tuple[str]) -> None:
+        """Applies a lock intent to the lock cache, as it is expected to be applied to the database."""
+        now = datetime.now()
+        if action == 'acquire':
+            self.lock_cache.update((hostname, (self.username, now)) for hostname in hostnames)
+        else:
+            for hostname in hostnames:
+                if action == 'unset' or self.lock_cache.get(hostname, ('',))[0] == self.username:
+                    self.lock_cache[hostname] = ('', now)
+
+
+    def __get_database_site(self, hostnames: Tuple[str]) -> str:
+        """Returns the site whose database holds the locks of all given testbenches, '' for the main database.
+
+        Raises:
+            ValueError: Raised if the testbenches belong to different sites, as a transaction spans one database only.
+        """
+        sites = {self.get_site(hostname) for hostname in hostnames}
+        if len(sites) > 1:
+            raise ValueError(f'Testbenches "{list(hostnames)}" belong to different sites and cannot be changed together.')
+        return sites.pop() if sites else ''
+
+
+    def __run(self, hostname: str, operation: Callable[[DatabaseController], T], database: DatabaseController = None) -> T:
+        """Runs an operation which cannot be queued while the database is unavailable with the database owning the testbench.
+
+        Raises:
+            ValueError: Raised while the database owning the testbench is unavailable or if no database is selected.
+        """
+        site = self.get_site(hostname)
+        if site:
+            return self.sites.run(site, operation)
+        if self.offline:
+            raise ValueError(f'Database "{self.offline_database}" is unavailable.')
+        return operation(self.__get_database(database))
+
+
+    def __get_database(self, database: DatabaseController = None) -> DatabaseController:
+        """Returns the given connection or the one of the controller.
+
+        Raises:
+            ValueError: Raised if no database is selected.
+        """
+        database = database or self.database
+        if database is None:
+            raise ValueError('No database selected, please select a database file.')
+        return database
+
+
     def load_testbench_JSON(self, testbenchJson: str) -> bool:
+        """Loads the testbenches from the JSON file.
+
+        Raises:
+            ValueError: Raised if the file contains duplicate testbench ids. No testbenches are loaded in this case.
+        """
         self.testbenchJson = Path(testbenchJson)
-        self.testbenches = []
-        self.tb_structure = []
         try:
-            with open(testbenchJson, 'r') as f:
-                testbenchdata = json.load(f)
-        except (FileNotFoundError, PermissionError):
-            testbenchdata = {}
-        
-        for testbench_list in testbenchdata:
-            self.tb_structure.append({})
-            for hostname, data in testbench_list.items():
-                self.add_testbench(hostname, data)
+            testbenchdata = self.__read_testbench_JSON()
+            self.testbenches, self.tb_structure = self.parse_testbench_JSON(testbenchdata)
+        except ValueError:
+            self.testbenches, self.tb_structure = TestbenchRegistry(), []
+            raise
+        finally:
+            self.__search_index = None
+            self.__site_groups = None
+
+        for hostname in self.testbenches.hostnames:
+            self.lock_cache.setdefault(hostname, ('', datetime.now()))
+        self.register_testbenches(self.testbenches.hostnames)
 
         self.save_settings()
         return bool(testbenchdata)
 
 
+    def __read_testbench_JSON(self) -> list:
+        """Reads the testbench file and remembers its modification time and hash for read_changed_testbench_JSON()."""
+        try:
+            stat = self.testbenchJson.stat()
+            content = self.testbenchJson.read_bytes()
+        except OSError:
+            self.testbenchJson_stamp, self.testbenchJson_hash = None, None
+            return []   # Missing or unreadable file, or a directory
+
+        self.testbenchJson_stamp = (stat.st_mtime_ns, stat.st_size)
+        self.testbenchJson_hash = hashlib.sha1(content).hexdigest()
+        return json.loads(content)
+
+
+    def read_changed_testbench_JSON(self) -> list:
+        """Reads the testbench file if it was modified since it was loaded. Only the modification time and size are read,
+        the content is hashed only if these changed. A missing file is not reported, e.g. while it is being replaced.
+        Accessing the file may block on a network share, so this is meant to be called from a background thread.
+
+        Raises:
+            ValueError: Raised if the file is not valid JSON. It is read again once it changed.
+
+        Returns:
+            list: Content of the testbench file, or None if it did not change.
+        """
+        try:
+            stat = self.testbenchJson.stat()
+            stamp = (stat.st_mtime_ns, stat.st_size)
+            if stamp == self.testbenchJson_stamp:
+                return None
+            content = self.testbenchJson.read_bytes()
+        except OSError:
+            return None     # Written at the moment, checked again next time
+
+        content_hash = hashlib.sha1(content).hexdigest()
+        self.testbenchJson_stamp = stamp
+        if content_hash == self.testbenchJson_hash:
+            return None
+        self.testbenchJson_hash = content_hash
+        return json.loads(content)
+
+
+    def reload_testbench_JSON(self, testbenchdata: list = None, register: bool = True) -> Tuple[List[str], List[str], List[str]]:
+        """Applies the changes of the testbench file to the registry and the database, keeping all unchanged testbenches
+        and the lock cache. Testbenches moved to another parent are removed and added again.
+
+        Args:
+            testbenchdata (list, optional): Content of the testbench file read by read_changed_testbench_JSON(). Defaults to None, meaning the file is read if it changed.
+            register (bool, optional): Whether the added and changed testbenches are registered in the database. Defaults to True.
+
+        Raises:
+            ValueError: Raised if the file contains duplicate testbench ids. The loaded testbenches are kept in this case.
+
+        Returns:
+            Tuple[List[str], List[str], List[str]]: Ids of the removed, added and changed testbenches,
+            or None if the file did not change.
+        """
+        if testbenchdata is None:
+            testbenchdata = self.read_changed_testbench_JSON()
+            if testbenchdata is None:
+                return None
+
+        registry, structure = self.parse_testbench_JSON(testbenchdata)
+        ids_before = [testbench.id for testbench in self.testbenches]
+
+        for id in ids_before:
+            if id in self.testbenches and (id not in registry or registry.get_parent(id) != self.testbenches.get_parent(id)):
+                self.testbenches.remove(id)     # Also removes the children, which are added again if still present
+        removed = [id for id in ids_before if id not in self.testbenches]
+
+        added, changed = [], []
+        for testbench in registry:
+            if testbench.id not in self.testbenches:
+                self.testbenches.add(testbench, registry.get_parent(testbench.id))
+                added.append(testbench.id)
+            elif self.__testbench_data(testbench) != self.__testbench_data(self.get_testbench(testbench.id)):
+                self.testbenches.replace(testbench)
+                changed.append(testbench.id)
+        self.tb_structure = structure
+        self.__site_groups = None
+        if self.__search_index is not None:
+            for id in removed:
+                self.__search_index.remove(id)
+            for id in added + changed:
+                self.__search_index.add(self.get_testbench(id))
+
+        hostnames = tuple(dict.fromkeys(self.get_testbench(id).hostname for id in added + changed))
+        for hostname in hostnames:
+            self.lock_cache.setdefault(hostname, ('', datetime.now()))
+        if register:
+            self.register_testbenches(hostnames)
+        return (removed, added, changed)
+
+
+    @staticmethod
+    def __testbench_data(testbench: Testbench) -> Tuple[str, str, str]:
+        return (testbench.hostname, testbench.login_name, testbench.site)
+
+
+    @staticmethod
+    def parse_testbench_JSON(testbenchdata: list) -> Tuple[TestbenchRegistry, list]:
+        """Builds the registry and the block structure of the testbench file content.
+
+        Raises:
+            ValueError: Raised if the content contains duplicate testbench ids.
+        """
+        registry, structure = TestbenchRegistry(), []
+        for testbench_list in testbenchdata:
+            structure.append({})
+            for id, data in testbench_list.items():
+                TestbenchAccessController.__add_to_registry(registry, structure[-1], id, data)
+        return (registry, structure)
+
+
     def save_testbench_JSON(self, testbenchJson: str) -> bool:
-        def serialize_testbench(id: str, children: List[str] = None) -> Dict[str,str]:
+        def serialize_testbench(id: str, children: List[str] = None, parent: str = None) -> Dict[str,str]:
             data = {}
             tb = self.get_testbench(id)
             if tb.hostname != tb.id:
                 data['hostname'] = tb.hostname
             if tb.login_name: 
                 data['login_name'] = tb.login_name
+            if tb.site and (parent is None or tb.site != self.get_testbench(parent).site):
+                data['site'] = tb.site
             if children:
-                data['children'] = {child: serialize_testbench(child) for child in children}
+                data['children'] = {child: serialize_testbench(child, parent=id) for child in children}
             return data
         
-        self.testbenchJson = Path(testbenchJson)
-
         testbenchdata = []
         for tb_block in self.tb_structure:
             testbench_list = {}
@@ -114,101 +547,536 @@ class TestbenchAccessController():
                 json.dump(testbenchdata, f, indent=4)
         except (PermissionError):
             return False
-        
+
+        # Own changes must not trigger a reload
+        self.testbenchJson = Path(testbenchJson)
+        self.__read_testbench_JSON()
         return True
         
                 
-    def add_testbench(self, id: str, data: dict, isChild: bool = False) -> None:
+    def add_testbench(self, id: str, data: dict, parent: str = None) -> None:
+        """Adds the testbench and its children to the registry and registers them in the database in one transaction.
+
+        Raises:
+            ValueError: Raised if the id is already registered.
+        """
+        self.register_testbenches(tuple(self.__add_testbench(id, data, parent)))
+
+
+    def __add_testbench(self, id: str, data: dict, parent: str = None) -> List[str]:
+        """Adds the testbench and its children to the registry and returns their hostnames."""
+        if parent is None and not self.tb_structure:
+            self.tb_structure.append({})
+        hostnames = self.__add_to_registry(self.testbenches, self.tb_structure[-1], id, data, parent)
+        self.__search_index = None
+        self.__site_groups = None
+        for hostname in hostnames:
+            self.lock_cache.setdefault(hostname, ('', datetime.now()))
+        return hostnames
+
+
+    @staticmethod
+    def __add_to_registry(registry: TestbenchRegistry, tb_block: dict, id: str, data: dict, parent: str = None) -> List[str]:
+        """Adds the testbench and its children to the registry and the block of the structure, and returns their hostnames."""
         hostname    = data.get('hostname', id)
         login_name  = data.get('login_name', '')
-        self.testbenches.append(Testbench(id, hostname, login_name))
-        self.lock_cache[id] = ('', datetime.now())
-
-        if self.database is not None:
-            self.database.add_testbench(hostname)
+        site        = data.get('site', registry.get(parent).site if parent is not None else '')    # Inherited by the children
+        registry.add(Testbench(id, hostname, login_name, site), parent)
+        hostnames = [hostname]
 
-        if not isChild:
+        if parent is None:
             children    = data.get('children', {})
-            self.tb_structure[-1][id] = children.keys()
+            tb_block[id] = children.keys()
             for childname, childdata in children.items():
-                self.add_testbench(childname, childdata, isChild = True)
+                hostnames += TestbenchAccessController.__add_to_registry(registry, tb_block, childname, childdata, parent = id)
+
+        return hostnames
+
+
+    def register_testbenches(self, hostnames: Tuple[str]) -> List[str]:
+        """Adds the testbenches to the database, if one is attached, using a single transaction.
+        Testbenches of other sites are registered in their database by the next poll of the site.
+
+        Raises:
+            ValueError: Raised if the database is malformed.
+
+        Returns:
+            List[str]: Hostnames of the newly created testbenches.
+        """
+        if self.database is None:
+            return []
+        return self.database.add_testbenches(tuple(hostname for hostname in hostnames if not self.get_site(hostname)))
             
 
     def get_testbench(self, id: str) -> Testbench:
-        try:
-            return next(testbench for testbench in self.testbenches if testbench.id == id)
-        except StopIteration as err:
-            raise ValueError(err)
+        return self.testbenches.get(id)
+
+
+    @metrics.timed('taco.search_testbenches')
+    def search_testbenches(self, query: str) -> List[str]:
+        """Returns the ids of the testbenches whose id, hostname, login name or cached lock holder match the query,
+        best matches first. See TestbenchIndex.search() for the query syntax.
+        """
+        if self.__search_index is None:
+            self.__search_index = TestbenchIndex(self.testbenches)
+        self.__search_index.update_holders(self.lock_cache.copy())     # Copied, locks are also cached by background threads
+        return self.__search_index.search(query)
         
         
+    @metrics.timed('taco.update_locks')
     def update_locks(self) -> None:
         self.lock_cache_time = datetime.now()
-        if self.database is None:
+        if self.database is None and not self.sites:
             return
         
-        self.unlock_by_pid()
-        
-        hostnames = tuple(tb.hostname for tb in self.testbenches)
-        lockDict = self.database.get_lock_multiple(hostnames)
+        snapshot = self.poll_locks(self.database)
+        if snapshot is not None:
+            self.apply_locks(*snapshot)
+
+
+    @metrics.timed('taco.poll_locks')
+    def poll_locks(self, database: DatabaseController) -> LockSnapshot:
+        """Reads the lock data and wait queues of all testbenches. Does not modify the caches,
+        so it can be called from a background thread owning the given connection.
+        Testbenches whose lease expired while users are waiting are handed over to the first user of their queue.
+
+        The databases of other sites are polled concurrently by their own threads while the given database is read.
+        Sites which did not answer within the SITE_POLL_TIMEOUT keep their cached lock data and are merged
+        with a later poll, so a slow or unreachable site does not delay the others.
+
+        Returns None if neither the databases nor the list of testbenches changed since the last poll,
+        in which case only the change markers of the databases are read. As expiring leases do not modify the database,
+        the lock data is read every LOCK_REFRESH_TIMER anyway and, while the user is waiting for a testbench, on every poll.
+        """
+        started = time.monotonic()
+        refresh = self.__lock_read is None or started - self.__lock_read >= self.LOCK_REFRESH_TIMER
+        if refresh:
+            self.__lock_read = started
+        groups = self.__get_site_groups()
+        waiting = {hostname for hostname, users in self.queue_cache.copy().items() if self.username in users}
+        for site, hostnames in groups.items():
+            if site:
+                self.sites.submit(site, lambda database, site=site, hostnames=hostnames: self.__poll_site(database, site, hostnames, waiting, refresh))
+
+        snapshots: Dict[str, LockSnapshot] = {}
+        hostnames = groups['']
+        if database is not None and (refresh or database.has_changed() or hostnames != self.polled_hostnames or waiting.intersection(hostnames)):
+            snapshots[''] = self.__read_locks(database, hostnames)
+            self.polled_hostnames = hostnames
+            self.replica.save_snapshot(database.dbFile, snapshots[''][0])
+        if self.sites:
+            results = self.sites.collect(max(self.SITE_POLL_TIMEOUT - (time.monotonic() - started), 0))
+            snapshots.update((site, snapshot) for site, snapshot in results.items() if snapshot is not None)
+        if not snapshots:
+            return None
+        if len(groups) == 1:
+            return snapshots['']    # Single database
+
+        # Wait queues and reservations are replaced as a whole, so the cached ones of the sites not read are kept
+        queueDict = {hostname: users for hostname, users in self.queue_cache.copy().items() if self.get_site(hostname) not in snapshots}
+        reservationDict = {hostname: reservation for hostname, reservation in self.reservation_cache.copy().items() if self.get_site(hostname) not in snapshots}
+        lockDict: Dict[str, Tuple[str, datetime]] = {}
+        for locks, queues, reservations in snapshots.values():
+            lockDict.update(locks)
+            queueDict.update(queues)
+            reservationDict.update(reservations)
+        return (lockDict, queueDict, reservationDict)
+
+
+    def __poll_site(self, database: DatabaseController, site: str, hostnames: Tuple[str], waiting: Set[str], refresh: bool) -> LockSnapshot:
+        """Polls the database of another site, called by the thread of the site. Testbenches added since the last poll
+        are registered first. Returns None if the database did not change and no refresh is due.
+        """
+        if hostnames != self.sites.polled.get(site):
+            database.add_testbenches(hostnames)
+        elif not refresh and not database.has_changed() and not waiting.intersection(hostnames):
+            return None
+
+        snapshot = self.__read_locks(database, hostnames)
+        self.sites.polled[site] = hostnames
+        return snapshot
+
+
+    @staticmethod
+    def __read_locks(database: DatabaseController, hostnames: Tuple[str]) -> LockSnapshot:
+        """Reads the lock data, wait queues and next reservations of the testbenches, handing over stalled testbenches."""
+        lockDict = database.get_lock_multiple(hostnames)
+        queueDict = database.get_queue_multiple(hostnames)
+        stalled = tuple(hostname for hostname in queueDict if hostname in lockDict and not lockDict[hostname][0])
+        if stalled:
+            lockDict.update(database.hand_over(stalled))
+            queueDict = database.get_queue_multiple(hostnames)
+        return (lockDict, queueDict, database.get_next_reservations(hostnames))
+
+
+    def apply_locks(self, lockDict: Dict[str, Tuple[str, datetime]], queueDict: Dict[str, List[str]] = None,
+                    reservationDict: Dict[str, Reservation] = None) -> None:
+        """Updates the lock cache and, if given, the wait queues and reservations. Testbenches the user was waiting for
+        and now holds are added to the handovers, and their leases are renewed by the heartbeat while they are held.
+        """
         self.lock_cache.update(lockDict)
+        self.lock_cache_time = datetime.now()
+        self.handover_leases = {hostname for hostname in self.handover_leases if self.lock_cache.get(hostname, ('',))[0] == self.username}
+        if reservationDict is not None:
+            self.reservation_cache = reservationDict
+        if queueDict is None:
+            return
+
+        waiting = [hostname for hostname, users in self.queue_cache.items() if self.username in users]
+        self.queue_cache = {hostname: users for hostname, users in queueDict.items()}
+        for hostname in waiting:
+            if self.lock_cache.get(hostname, ('',))[0] == self.username and self.username not in self.queue_cache.get(hostname, []):
+                self.handovers += [testbench.id for testbench in self.testbenches.get_by_hostname(hostname)]
+                self.handover_leases = self.handover_leases | {hostname}
+                self.start_heartbeat()
+
+
+    def pop_handovers(self) -> List[str]:
+        """Returns the ids of the testbenches handed over to the user from their wait queue since the last call."""
+        handovers, self.handovers = self.handovers, []
+        return handovers
+
+
+    def pop_notices(self) -> List[str]:
+        """Returns the locks refused by or colliding with reservations of other users since the last call."""
+        notices, self.notices = self.notices, []
+        return notices
 
             
     def get_lock(self, id: str, forceRefresh: bool = False) -> Tuple[str, datetime]:
         if self.database is None:
-            return ('', datetime.now())
+            return self.get_cached_lock(id) if self.offline else ('', datetime.now())
         
         if not forceRefresh and self.lock_cache_age >= self.LOCK_UPDATE_TIMER:
             self.update_locks()
         
+        return self.get_cached_lock(id)
+
+
+    def get_cached_lock(self, id: str) -> Tuple[str, datetime]:
+        """Returns the lock data of the testbench from the cache without accessing the database."""
         hostname = self.get_testbench(id).hostname
-        return self.lock_cache[hostname]
+        return self.lock_cache.get(hostname, ('', datetime.now()))
+
+
+    def get_cached_reservation(self, id: str) -> Reservation:
+        """Returns the current or next reservation of the testbench from the cache, None if it is not reserved."""
+        reservation = self.reservation_cache.get(self.get_testbench(id).hostname)
+        if reservation is None or reservation[3] <= datetime.now():
+            return None     # Ended since the last poll
+        return reservation
+
+
+    def get_cached_queue(self, id: str) -> List[str]:
+        """Returns the users waiting for the testbench in queue order from the cache without accessing the database."""
+        hostname = self.get_testbench(id).hostname
+        return self.queue_cache.get(hostname, [])
  
     
-    def __set_lock(self, id: str, username: str) -> None:
+    def __set_lock(self, id: str, username: str, database: DatabaseController = None) -> None:
         hostname = self.get_testbench(id).hostname
+        self.__write('unset', (hostname,), None, lambda database: database.set_lock(hostname, username), database)
         self.lock_cache[hostname] = (username, datetime.now())
-        self.database.set_lock(hostname, username)
         
 
-    def set_lock(self, id: str) -> None:
-        return self.__set_lock(id, self.username)
+    def set_lock(self, id: str, database: DatabaseController = None, lease: float = None) -> bool:
+        """Acquires the lock of the testbench unless it is held by another user. The lock cache is updated with the current holder.
+
+        Args:
+            lease (float, optional): Lease time in seconds after which the lock expires unless renewed by the heartbeat. Defaults to None, meaning no expiry.
+
+        Returns:
+            bool: True if the lock is held by the current user afterwards.
+        """
+        hostname = self.get_testbench(id).hostname
+        result = self.__write('acquire', (hostname,), lease, lambda database: (database.try_acquire(hostname, self.username, lease),
+                                                                               database.get_next_reservations((hostname,))), database)
+        if result is None:
+            return self.lock_cache[hostname][0] == self.username    # Queued while offline
+        (success, lock_user, lock_time), reservationDict = result
+        self.lock_cache[hostname] = (lock_user, lock_time)
+        self.__check_reservations({hostname: success}, reservationDict)
+        return success
 
     
-    def unset_lock(self, id: str) -> None:
-        return self.__set_lock(id, '')
+    def unset_lock(self, id: str, database: DatabaseController = None) -> None:
+        """Removes the lock of the testbench regardless of its holder."""
+        return self.__set_lock(id, '', database)
+
+
+    def release_lock(self, id: str, database: DatabaseController = None) -> bool:
+        """Removes the lock of the testbench if it is held by the current user.
+
+        Returns:
+            bool: True if the testbench is free afterwards.
+        """
+        hostname = self.get_testbench(id).hostname
+        result = self.__write('release', (hostname,), None, lambda database: database.release(hostname, self.username), database)
+        if result is None:
+            return self.lock_cache[hostname][0] == ''   # Queued while offline
+        success, lock_user, lock_time = result
+        self.lock_cache[hostname] = (lock_user, lock_time)
+        return success
+
+
+    def release_locks(self, ids: List[str], database: DatabaseController = None) -> bool:
+        """Removes the locks of all given testbenches held by the current user in one transaction per site.
+        Testbenches with waiting users are handed over to the first user of their queue.
+
+        Returns:
+            bool: True if none of the testbenches is held by the current user afterwards.
+        """
+        hostnames = tuple({self.get_testbench(id).hostname for id in ids})
+        for group in self.__group_by_site(hostnames):
+            lockDict = self.__write('release', group, None, lambda database: database.release_multiple(group, self.username), database)
+            if lockDict is not None:
+                self.lock_cache.update(lockDict)
+        return not any(self.lock_cache.get(hostname, ('',))[0] == self.username for hostname in hostnames)
+
+
+    def enqueue_lock(self, id: str, database: DatabaseController = None) -> int:
+        """Acquires the lock of the testbench if possible, otherwise joins its wait queue.
+        The testbench is handed over once all users ahead in the queue got it, which is reported by pop_handovers().
+
+        Returns:
+            int: Position in the queue, 0 if the lock is held by the current user.
+        """
+        hostname = self.get_testbench(id).hostname
+        position, lock_user, lock_time = self.__run(hostname, lambda database: database.enqueue(hostname, self.username), database)
+        self.lock_cache[hostname] = (lock_user, lock_time)
+        if position and self.username not in self.queue_cache.get(hostname, []):
+            self.queue_cache[hostname] = self.queue_cache.get(hostname, []) + [self.username]
+        return position
+
+
+    def dequeue_lock(self, id: str, database: DatabaseController = None) -> bool:
+        """Leaves the wait queue of the testbench.
+
+        Returns:
+            bool: True if the user was waiting for the testbench.
+        """
+        hostname = self.get_testbench(id).hostname
+        dequeued = self.__run(hostname, lambda database: database.dequeue(hostname, self.username), database)
+        self.queue_cache[hostname] = [user for user in self.queue_cache.get(hostname, []) if user != self.username]
+        return dequeued
+
+
+    def __group_by_site(self, hostnames: Tuple[str]) -> List[Tuple[str]]:
+        """Splits the hostnames into groups of testbenches locked in the same database."""
+        groups: Dict[str, List[str]] = {}
+        for hostname in hostnames:
+            groups.setdefault(self.get_site(hostname), []).append(hostname)
+        return [tuple(group) for group in groups.values()]
+
+
+    def get_group(self, id: str) -> List[str]:
+        """Returns the id of the testbench followed by the ids of all its descendants."""
+        group = [id]
+        for child in self.testbenches.get_children(id):
+            group += self.get_group(child)
+        return group
+
+
+    def set_lock_group(self, ids: List[str], database: DatabaseController = None, lease: float = None) -> bool:
+        """Acquires the locks of all given testbenches in one transaction, or none of them if any is held by another user.
+        A refused group is reported in the notices, naming the testbenches held by other users.
+
+        Raises:
+            ValueError: Raised if the testbenches belong to different sites.
+
+        Returns:
+            bool: True if all locks are held by the current user afterwards.
+        """
+        hostnames = tuple(dict.fromkeys(self.get_testbench(id).hostname for id in ids))
+        result = self.__write('acquire', hostnames, lease, lambda database: (database.try_acquire_multiple(hostnames, self.username, lease),
+                                                                             database.get_next_reservations(hostnames)), database)
+        if result is None:
+            return all(self.lock_cache[hostname][0] == self.username for hostname in hostnames)    # Queued while offline
+        (success, lockDict), reservationDict = result
+        self.lock_cache.update(lockDict)
+        self.__check_reservations({hostname: success for hostname in hostnames}, reservationDict)
+        held = [f'{testbench.id} is used by {lock_user}' for hostname, (lock_user, _) in lockDict.items() if lock_user not in ('', self.username)
+                for testbench in self.testbenches.get_by_hostname(hostname)]
+        if not success and held:
+            self.notices.append(f'{", ".join(ids)} could not be locked, {", ".join(held)}.')
+        return success
+
+
+    def __check_reservations(self, acquired: Dict[str, bool], reservationDict: Dict[str, Reservation]) -> None:
+        """Updates the reservation cache with the reservations read together with a lock attempt, and adds notices for
+        locks refused by an active reservation, or taken shortly before a reservation of another user.
+
+        Args:
+            acquired (Dict[str, bool]): Hostnames of the lock attempt linked to its success.
+            reservationDict (Dict[str, Reservation]): Current or next reservations of the hostnames.
+        """
+        now = datetime.now()
+        for hostname, success in acquired.items():
+            reservation = reservationDict.get(hostname)
+            if reservation is None:
+                self.reservation_cache.pop(hostname, None)
+                continue
+            self.reservation_cache[hostname] = reservation
+
+            _, lock_user, start, end = reservation
+            ids = ", ".join(testbench.id for testbench in self.testbenches.get_by_hostname(hostname))
+            if lock_user == self.username:
+                continue
+            if not success and start <= now:
+                self.notices.append(f'{ids} is reserved by {lock_user} until {end:%Y-%m-%d %H:%M}.')
+            elif success and (start - now).total_seconds() < self.RESERVATION_NOTICE:
+                self.notices.append(f'{ids} is reserved by {lock_user} from {start:%Y-%m-%d %H:%M}, please release it by then.')
+
+
+    def reserve_testbench(self, id: str, start: datetime, end: datetime, database: DatabaseController = None) -> Reservation:
+        """Books the testbench for the current user from start until end. While the reservation is active, other users
+        cannot lock the testbench. Reservations are not queued while the database is unavailable.
+
+        Raises:
+            ValueError: Raised if the time slot overlaps another reservation, is empty or in the past,
+                or the database is unavailable.
+
+        Returns:
+            Reservation: The new reservation.
+        """
+        hostname = self.get_testbench(id).hostname
+        success, reservation = self.__run(hostname, lambda database: database.reserve(hostname, self.username, start, end), database)
+        if not success:
+            _, lock_user, start, end = reservation
+            raise ValueError(f'{id} is already reserved by {lock_user} from {start:%Y-%m-%d %H:%M} until {end:%Y-%m-%d %H:%M}.')
+
+        cached = self.reservation_cache.get(hostname)
+        if cached is None or reservation[3] < cached[3]:
+            self.reservation_cache[hostname] = reservation
+        return reservation
+
+
+    def cancel_reservation(self, id: str, reservation_id: int, database: DatabaseController = None) -> bool:
+        """Removes the reservation of the testbench if it belongs to the current user.
+
+        Returns:
+            bool: True if the reservation was removed.
+        """
+        hostname = self.get_testbench(id).hostname
+        cancelled = self.__run(hostname, lambda database: database.cancel_reservation(reservation_id, self.username), database)
+        if cancelled and self.reservation_cache.get(hostname, (None,))[0] == reservation_id:
+            del self.reservation_cache[hostname]    # The following reservation is read with the next poll
+        return cancelled
 
     
-    def run_rdp(self, id: str) -> None:
-        self.set_lock(id)
-        pid = self.get_testbench(id).run_rdp()
-        self.subprocesses[id] = pid
+    def run_rdp(self, id: str, database: DatabaseController = None) -> bool:
+        # Session locks are leased, so they expire if this client crashes
+        held = self.get_cached_lock(id)[0] == self.username
+        if not self.set_lock(id, database, lease=self.LOCK_LEASE_TIME):
+            return False    # Testbench is in use by another user
+        try:
+            process = self.get_testbench(id).run_rdp()
+        except Exception:
+            if not held:
+                self.release_lock(id, database)     # No session is running which would release it
+            raise
+        self.sessions.add(id, process)
+        self.start_heartbeat()
+        return True
+
 
+    def start_heartbeat(self) -> None:
+        """Starts the thread renewing the leases of running sessions and handed over testbenches, if not already running."""
+        if self.heartbeat is None or not self.heartbeat.is_alive():
+            self.heartbeat = threading.Thread(target=self.__renew_leases, name='LeaseHeartbeat', daemon=True)
+            self.heartbeat.start()
 
-    def unlock_by_pid(self):
-        for id, pid in self.subprocesses.items():
-            if self.lock_cache[id][0] == self.username:
-                if not pid in psutil.pids():
-                    self.unset_lock(id)
+
+    def __renew_leases(self) -> None:
+        """Heartbeat loop renewing all leases held by this client with one statement per site, using its own database connection.
+        Leases which expired before they were renewed are reported once as notices.
+        """
+        database: DatabaseController = None
+        lost: Set[str] = set()
+        while True:
+            time.sleep(self.HEARTBEAT_TIMER)
+            # Released testbenches are no longer held according to the lock cache
+            handovers = [hostname for hostname in self.handover_leases if self.lock_cache.get(hostname, ('',))[0] == self.username]
+            if not self.sessions.ids and not handovers:
+                continue
+
+            try:
+                if self.database is not None and (database is None or database.dbFile != self.database.dbFile):
+                    database = self.database.clone()
+
+                hostnames = tuple(dict.fromkeys([self.get_testbench(id).hostname for id in self.sessions.ids] + handovers))
+            except (sqlite3.Error, ValueError):
+                continue
+
+            for group in self.__group_by_site(hostnames):
+                try:
+                    renewed = self.__run(group[0], lambda database: database.renew_leases(group, self.username, self.LOCK_LEASE_TIME), database)
+                except (sqlite3.Error, ValueError):
+                    continue    # Retry with the next heartbeat, the lease time covers multiple missed heartbeats
+
+                lost.difference_update(renewed)
+                expired = [hostname for hostname in group if hostname not in renewed and hostname not in lost]
+                if expired:
+                    lost.update(expired)
+                    metrics.count('leases.lost', len(expired))
+                    self.notices.append(f'The lock of {", ".join(expired)} expired before it was renewed, lock it again to keep it.')
 
 
     def load_settings(self) -> None:
+        """Applies the settings file. The file is written at most once afterwards, and only if a setting changed."""
         try:
             with open(self.SETTINGS_FILE, 'r') as f:
                 settings = json.load(f)
-        except (IOError, SyntaxError):
-            self.save_settings()    # Create new Settings File
-            settings = {}
+            self.__saved_settings = settings
+        except (IOError, ValueError):
+            settings = {}   # A new settings file is created at the end of the batch
             
-        self.set_username(settings.get('Username', ''))
-        self.set_database(settings.get('Database', ''))
-        self.load_testbench_JSON(settings.get('Testbenchfile', ''))
+        with self.batch_settings():
+            self.set_username(settings.get('Username', ''))
+            self.broker = settings.get('Broker', '')
+            self.set_slow_operation_ms(settings.get('SlowOperationMs', self.slow_operation_ms))
+            database = settings.get('Database', '')
+            success, err = self.set_database(database, settings.get('DatabaseProfile', DEFAULT_PROFILE))
+            if not success and isinstance(err, sqlite3.OperationalError):
+                self.database_profile = settings.get('DatabaseProfile', DEFAULT_PROFILE)
+                self.go_offline(database)   # Database on an unavailable share, start with the local replica
+            for site, siteDatabase in settings.get('Sites', {}).items():
+                self.attach_site(site, siteDatabase)    # Opened by the first poll, in the background
+            try:
+                self.load_testbench_JSON(settings.get('Testbenchfile', ''))
+            except ValueError:
+                pass    # Invalid testbench file, start without testbenches
+
+
+    @contextmanager
+    def batch_settings(self) -> Iterator[None]:
+        """Defers all calls of save_settings() inside the block, writing the settings file once at its end."""
+        self.__settings_batch += 1
+        try:
+            yield
+        finally:
+            self.__settings_batch -= 1
+            if not self.__settings_batch and self.__settings_dirty:
+                self.save_settings()
 
 
     def save_settings(self) -> None:
+        if self.__settings_batch:
+            self.__settings_dirty = True
+            return
+        self.__settings_dirty = False
+
         settings = {}
         settings['Username']        = self.username
         settings['Testbenchfile']   = str(self.testbenchJson.absolute())
         settings['Database']        = str(self.databaseFile.absolute())
+        settings['DatabaseProfile'] = self.database_profile
+        settings['Broker']          = self.broker
+        settings['SlowOperationMs'] = self.slow_operation_ms
+        settings['Sites']           = dict(self.sites.files)
+        if settings == self.__saved_settings:
+            return
         
         with open(self.SETTINGS_FILE, 'w') as f:
             json.dump(settings, f, indent=4)
+        self.__saved_settings = settings
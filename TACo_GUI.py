@@ -1,18 +1,24 @@
 import os
+import queue
 from pathlib import Path
 import sys
 import tkinter as tk
-from tkinter import ttk, filedialog, messagebox
+from tkinter import ttk, filedialog, messagebox, simpledialog
 from tkinter import font
 from datetime import datetime, timedelta
-import webbrowser
 
 from taco.Testbench import Testbench
+from taco.DatabaseController import DatabaseController
+from taco.LockRefresher import LockRefresher
+from taco.ReachabilityProber import ReachabilityProber
+from taco.Metrics import metrics
 from TACo import TestbenchAccessController
 
 
 class TACo_GUI(tk.Tk):
-    TREEVIEW_UPDATE_TIMER = 2000
+    TREEVIEW_UPDATE_TIMER = 2000    # Fallback interval for rendering snapshots whose notification got lost
+    TESTBENCH_RELOAD_TIMER = 5000   # Interval for checking the testbench file for changes
+    SEARCH_DELAY = 200              # Delay after the last keystroke before the search is applied
     COLOR_TREEVIEW_ITEM_FREE = "DarkBlue"
     COLOR_TREEVIEW_ITEM_LOCKED = "Red"
     COLOR_TREEVIEW_POPUP_FREE = "DeepSkyBlue"
@@ -23,21 +29,46 @@ class TACo_GUI(tk.Tk):
         
         self.taco = TestbenchAccessController()
         self.user = tk.StringVar(value = self.taco.username)
+        self.search = tk.StringVar()
+        self.status = tk.StringVar()    # Last error of the background refresher
 
         self.selected_testbench: Testbench = None
         self.images = {}
+        self.rendered_items = {}    # Last rendered values and tags per treeview item
+        self.matches = None         # Ids matching the search in rank order, None without search
+        self.expanded = set()       # Ids of the expanded testbenches, kept across searches and reloads
+        self.placeholders = {}      # Placeholder item per collapsed testbench, whose children are not yet inserted
+        self.search_job = None
+        self.render_job = None
+        self.testbench_files = queue.Queue()    # Content of the changed testbench file, read by the refresher thread
+
+        # Database access is handled by a background thread, the GUI only renders the lock snapshots
+        self.refresher = LockRefresher(self.taco, self.taco.LOCK_UPDATE_TIMER, on_snapshot=self.notify_lock_snapshot)
+        self.bind('<<LockSnapshot>>', lambda _: self.render_lock_snapshot())
+        self.refresher.start()
+        self.taco.sessions.on_release = self.refresher.request_refresh
+
+        # Reachability of the testbenches is checked by another background thread
+        self.prober = ReachabilityProber(self.taco, self.taco.PROBE_TIMER, on_update=self.notify_probe_results)
+        self.bind('<<ProbeResults>>', lambda _: self.update_testbench_treeview())
+        self.bind('<<TestbenchFileChanged>>', lambda _: self.apply_testbench_file())
         
         self.draw_GUI()
         
-        # Load Database if not present
-        if self.taco.database is None:
+        # Load Database if not present, an unavailable database is replaced by the local replica
+        if self.taco.database is None and not self.taco.offline:
             self.set_database_file()
         
         # Load Testbench Config
         if not self.taco.testbenches:
             self.load_testbench_json()
 
+        self.prober.start()
+        self.poll_lock_snapshots()
+        self.after(self.TESTBENCH_RELOAD_TIMER, self.watch_testbench_json)
         self.mainloop()
+        self.refresher.stop()
+        self.prober.stop()
 
 
     def draw_GUI(self):
@@ -46,6 +77,8 @@ class TACo_GUI(tk.Tk):
         self.minsize(200, 400)
         self.draw_main_menu()
         self.draw_userbar()
+        self.draw_searchbar()
+        self.draw_statusbar()
         self.draw_testbench_treeview()
 
 
@@ -78,6 +111,7 @@ class TACo_GUI(tk.Tk):
         filemenu.add_separator()
         filemenu.add_command(label="Quit", command=lambda:sys.exit(0))
 
+        self.menubar.add_command(label="Statistics", command=lambda: StatisticsWindow(self))
         self.menubar.add_command(label="About", command=lambda: AboutWindow(self))
 
         self.config(menu=self.menubar)
@@ -94,8 +128,34 @@ class TACo_GUI(tk.Tk):
         entry.pack(side=tk.RIGHT, fill=tk.X, expand=True)
         
         frame.pack(side=tk.TOP, fill=tk.X, padx=2, pady=2)
+
+
+    def draw_searchbar(self):
+        """
+        Search field filtering the treeview by id, hostname, login name and lock holder, e.g. "lab user:alice"
+        """
+        frame = tk.Frame()
+
+        label = ttk.Label(frame, text='Search')
+        entry = ttk.Entry(frame, textvariable=self.search)
+        entry.bind('<Escape>', lambda _: self.search.set(''))
+        entry.bind('<Return>', lambda _: self.apply_search())
+        self.search.trace_add('write', lambda *args: self.schedule_search())
+
+        label.pack(side=tk.LEFT)
+        entry.pack(side=tk.RIGHT, fill=tk.X, expand=True)
+
+        frame.pack(side=tk.TOP, fill=tk.X, padx=2, pady=2)
                 
 
+    def draw_statusbar(self):
+        """
+        Status line below the treeview, showing errors of the background refresher, e.g. of a failed lock action
+        """
+        label = ttk.Label(self, textvariable=self.status, foreground=self.COLOR_TREEVIEW_ITEM_LOCKED, anchor=tk.W)
+        label.pack(side=tk.BOTTOM, fill=tk.X, padx=2, pady=2)     # Packed before the treeview, so it is kept when shrinking
+
+
     def draw_testbench_treeview(self):
         """
         Function for drawing the testbench treeview with scrollbar
@@ -106,11 +166,13 @@ class TACo_GUI(tk.Tk):
         frame = tk.Frame(self)
 
         # Create Treeview
-        self.tree = ttk.Treeview(frame, columns=['User'], show="tree", selectmode="browse")
+        self.tree = ttk.Treeview(frame, columns=['User', 'Reservation'], show="tree", selectmode="browse")
         self.tree.heading("#0", text="Testbench")
         self.tree.heading("User", text="User")
+        self.tree.heading("Reservation", text="Next Reservation")
         self.tree.column("#0", minwidth=80, width=180)
         self.tree.column("User", minwidth=30, width=120)
+        self.tree.column("Reservation", minwidth=30, width=130)
         
         self.tree.icon_free = tk.PhotoImage(file='icons/computer.png')
         self.tree.icon_locked = tk.PhotoImage(file='icons/computer_delete.png')
@@ -122,13 +184,20 @@ class TACo_GUI(tk.Tk):
 
         treeScroll = ttk.Scrollbar(frame)
         treeScroll.configure(command=self.tree.yview)
-        self.tree.configure(yscrollcommand=treeScroll.set)
+
+        # Only the visible rows are refreshed, rows scrolled into view are refreshed on demand
+        def scroll(first, last):
+            treeScroll.set(first, last)
+            self.schedule_render()
+        self.tree.configure(yscrollcommand=scroll)
+        self.tree.bind('<<TreeviewOpen>>', lambda _: self.expand_testbench(self.tree.focus()))
+        self.tree.bind('<<TreeviewClose>>', lambda _: self.expanded.discard(self.tree.focus()))
 
         treeScroll.pack(side=tk.RIGHT, fill=tk.BOTH)
         self.tree.pack(fill=tk.BOTH, expand=True)
         frame.pack(fill=tk.BOTH, expand=True, padx=2, pady=2)
 
-        self.update_testbench_treeview()
+        self.update_testbench_treeview(clear = True)
 
 
         def show_context_menu(event):
@@ -144,22 +213,36 @@ class TACo_GUI(tk.Tk):
                 return               
 
             self.tree.selection_set(selected_row)   # Update Selection
-            self.update_testbench(self.selected_testbench.id, forceLockRefresh=True)
-            lock_user, lock_time = self.taco.get_lock(self.selected_testbench.id)
+            self.refresher.request_refresh()
+            self.update_testbench(self.selected_testbench.id)
+            lock_user, lock_time = self.taco.get_cached_lock(self.selected_testbench.id)
             
             # Create Menu
             self.contextmenu = tk.Menu(self, tearoff=False)
-            self.contextmenu.add_command(label="Remote Desktop", command=lambda:self.taco.run_rdp(self.selected_testbench.id))
+            self.contextmenu.add_command(label="Remote Desktop", command=self.run_rdp)
             self.contextmenu.add_separator()
-            self.contextmenu.add_command(label="Set Lock", command=self.lock_testbench)
+            self.contextmenu.add_command(label="Set Lock", command=self.lock_testbench, state=('normal' if lock_user in ('', self.taco.username) else 'disabled'))
             self.contextmenu.add_command(label="Remove Lock", command=self.unlock_testbench, state=('normal' if lock_user else 'disabled'))
+            lock_queue = self.taco.get_cached_queue(self.selected_testbench.id)
+            if self.taco.username in lock_queue:
+                self.contextmenu.add_command(label="Leave Queue", command=self.dequeue_testbench)
+            elif lock_user not in ('', self.taco.username):
+                self.contextmenu.add_command(label="Join Queue", command=self.enqueue_testbench)
+            reservation = self.taco.get_cached_reservation(self.selected_testbench.id)
+            self.contextmenu.add_separator()
+            self.contextmenu.add_command(label="Reserve...", command=self.reserve_testbench)
+            if reservation is not None and reservation[1] == self.taco.username:
+                self.contextmenu.add_command(label="Cancel Reservation", command=lambda: self.cancel_reservation(reservation[0]))
+            if self.taco.testbenches.get_children(self.selected_testbench.id):
+                self.contextmenu.add_separator()
+                self.contextmenu.add_command(label="Lock Group", command=self.lock_testbench_group)
+                self.contextmenu.add_command(label="Release Group", command=self.unlock_testbench_group)
 
             # Add Popup-Header
             headerlines = []
             headerlines.append(f'{self.selected_testbench.id} ({self.selected_testbench.hostname})')
             bgcolor = self.COLOR_TREEVIEW_POPUP_FREE
 
-            lock_user, lock_time = self.taco.get_lock(self.selected_testbench.id)
             def get_lock_time_string(deltatime):
                 days = deltatime.days
                 hours, remainder = divmod(deltatime.seconds, 3600)
@@ -176,6 +259,17 @@ class TACo_GUI(tk.Tk):
                 headerlines.append(f'Locked by {lock_user} for {lock_str}')
             else:
                 headerlines.append(f'Free for {lock_str}')
+
+            status, rtt = self.prober.get_status(self.selected_testbench.hostname)
+            if rtt is not None:
+                headerlines.append(f'Reachable ({rtt:.0f} ms)')
+            elif status != ReachabilityProber.STATUS_UNKNOWN:
+                headerlines.append(f'Not reachable ({status})')
+            if lock_queue:
+                headerlines.append(f'Queue: {", ".join(lock_queue)}')
+            if reservation is not None:
+                _, reserved_by, start, end = reservation
+                headerlines.append(f'Reserved by {reserved_by} from {start:%Y-%m-%d %H:%M} until {end:%Y-%m-%d %H:%M}')
             
             # Insert Header at top
             self.contextmenu.insert_separator(0)
@@ -202,44 +296,413 @@ class TACo_GUI(tk.Tk):
         self.tree.bind("<Button-3>", show_context_menu)
         
         
-    def update_testbench(self, id, parent = "", forceLockRefresh: bool = False) -> None:
-        lock_user = self.taco.get_lock(id, forceRefresh=forceLockRefresh)[0]
-        
-        # Add Testbench to Treeview if not yet present
-        if not self.tree.exists(id):
-            testbench = self.taco.get_testbench(id)
-            self.tree.insert(parent, tk.END, iid = id, text = str(testbench))
-        
-        self.tree.item(id, values=(lock_user,), tags=("locked",) if lock_user else ("free",))
+    def update_testbench(self, id, parent = "") -> None:
+        self.apply_treeview_changes(self.get_treeview_changes([(id, parent)]))
+
+
+    def get_treeview_changes(self, items) -> dict:
+        """
+        Compares the lock state of the given (id, parent) pairs with the last rendered state and returns the changed items
+        """
+        changes = {}
+        for id, parent in items:
+            lock_user = self.taco.get_cached_lock(id)[0]
+            waiting = len(self.taco.get_cached_queue(id))
+            status = self.prober.get_status(self.taco.get_testbench(id).hostname)[0]
+            if status in (ReachabilityProber.STATUS_UNREACHABLE, ReachabilityProber.STATUS_UNRESOLVED):
+                tags = ("error",)
+            else:
+                tags = ("locked",) if lock_user else ("free",)
+            reservation = self.get_reservation_string(self.taco.get_cached_reservation(id))
+            state = ((f'{lock_user} (+{waiting})' if waiting else lock_user, reservation), tags)
+            if self.rendered_items.get(id, (None, None))[1:] != state:
+                changes[id] = (parent,) + state
+        return changes
+
+
+    @staticmethod
+    def get_reservation_string(reservation) -> str:
+        """
+        Short description of the current or next reservation, with the weekday for reservations after today
+        """
+        if reservation is None:
+            return ''
+        _, reserved_by, start, end = reservation
+        now = datetime.now()
+        if start <= now:
+            return f'{reserved_by} until {end:%H:%M}' if end.date() == now.date() else f'{reserved_by} until {end:%a %H:%M}'
+        return f'{reserved_by} {start:%H:%M}' if start.date() == now.date() else f'{reserved_by} {start:%a %H:%M}'
+
+
+    def apply_treeview_changes(self, changes: dict) -> None:
+        """
+        Applies the changed items in one batch, inserting testbenches which are not yet present
+        """
+        for id, (parent, values, tags) in changes.items():
+            if id in self.rendered_items:
+                self.tree.item(id, values=values, tags=tags)
+            else:
+                # Add Testbench to Treeview if not yet present
+                testbench = self.taco.get_testbench(id)
+                self.tree.insert(parent, tk.END, iid = id, text = str(testbench), values=values, tags=tags)
+        self.rendered_items.update(changes)
 
     
+    @metrics.timed('gui.update_testbench_treeview')
     def update_testbench_treeview(self, clear: bool = False) -> None:
+        """
+        Refreshes the visible rows, or rebuilds the treeview from the testbench structure and the search if clear is set
+        """
         if clear:
-            for child in self.tree.get_children():
-                self.tree.delete(child)
-        
+            self.materialize_testbench_treeview()
+        self.render_job = None
+
+        items = [(id, self.tree.parent(id)) for id in self.get_visible_rows()]
+        self.apply_treeview_changes(self.get_treeview_changes(items))
+
+
+    def materialize_testbench_treeview(self) -> None:
+        """
+        Inserts only the testbenches matching the search and the children of expanded testbenches.
+        Collapsed testbenches get a placeholder child, which is replaced by the children when they are expanded.
+        """
+        position = self.tree.yview()[0]
+        self.tree.delete(*self.tree.get_children())
+        self.rendered_items.clear()
+        self.placeholders.clear()
+
+        matches = None if self.matches is None else set(self.matches)
+        items, collapsed = [], []
         for testbench_block in self.taco.tb_structure:
             for root, children in testbench_block.items():
-                self.update_testbench(root)
-                for child in children:
-                    self.update_testbench(child, parent = root)
+                shown = self.get_shown_rows(root, children, matches)
+                if shown is None:
+                    continue
+                items.append((root, ""))
+                items.extend((child, root) for child in shown)
+                if children and not shown:
+                    collapsed.append(root)
+
+        self.apply_treeview_changes(self.get_treeview_changes(items))
+        for root in collapsed:
+            self.placeholders[root] = self.tree.insert(root, tk.END, text='...')
+        for id, parent in items:
+            if parent and not self.tree.item(parent, 'open'):
+                self.tree.item(parent, open=True)
+        self.tree.yview_moveto(position)
+
+
+    def get_shown_rows(self, root, children, matches) -> list:
+        """
+        Returns the children of the testbench to insert, or None if the testbench is hidden by the search
+        """
+        if matches is None:
+            return list(children) if root in self.expanded else []
+        shown = [child for child in children if child in matches]
+        return shown if root in matches or shown else None
+
+
+    def delete_rows(self, ids) -> None:
+        """
+        Deletes the inserted rows of the testbenches together with the rows of their children
+        """
+        for id in ids:
+            if id not in self.rendered_items:
+                continue
+            for child in self.tree.get_children(id):
+                self.rendered_items.pop(child, None)
+            self.placeholders.pop(id, None)
+            del self.rendered_items[id]
+            self.tree.delete(id)
+
+
+    def expand_testbench(self, id) -> None:
+        """
+        Replaces the placeholder of the expanded testbench by its children
+        """
+        self.expanded.add(id)
+        placeholder = self.placeholders.pop(id, None)
+        if placeholder is None:
+            return
+        self.tree.delete(placeholder)
+        children = self.taco.testbenches.get_children(id)
+        self.apply_treeview_changes(self.get_treeview_changes([(child, id) for child in children]))
+
+
+    def get_visible_rows(self) -> list:
+        """
+        Returns the ids of the testbench rows inside the visible area of the treeview
+        """
+        placeholders = set(self.placeholders.values())
+        rows = []
+        id = self.tree.identify_row(1)
+        while id and self.tree.bbox(id):
+            if id not in placeholders:
+                rows.append(id)
+            children = self.tree.get_children(id)
+            if children and self.tree.item(id, 'open'):
+                id = children[0]
+                continue
+            while id and not self.tree.next(id):
+                id = self.tree.parent(id)
+            id = self.tree.next(id) if id else ''
+        return rows
+
+
+    def schedule_render(self) -> None:
+        """
+        Refreshes the visible rows once the treeview is idle, e.g. after scrolling
+        """
+        if self.render_job is None:
+            self.render_job = self.after_idle(self.update_testbench_treeview)
+
+
+    def schedule_search(self) -> None:
+        if self.search_job is not None:
+            self.after_cancel(self.search_job)
+        self.search_job = self.after(self.SEARCH_DELAY, self.apply_search)
+
+
+    def apply_search(self) -> None:
+        """
+        Filters the treeview by the search and selects the best match
+        """
+        if self.search_job is not None:
+            self.after_cancel(self.search_job)
+            self.search_job = None
 
-        # Update-Loop
-        self.after(self.TREEVIEW_UPDATE_TIMER, lambda: self.update_testbench_treeview())        
+        query = self.search.get().strip()
+        self.matches = self.taco.search_testbenches(query) if query else None
+        self.update_testbench_treeview(clear = True)
+        if self.matches:
+            self.tree.selection_set(self.matches[0])
+            self.tree.see(self.matches[0])
+
+
+    def notify_lock_snapshot(self) -> None:
+        """
+        Called by the refresher thread, schedules the rendering of the new snapshot in the Tk thread
+        """
+        try:
+            self.event_generate('<<LockSnapshot>>', when='tail')
+        except (RuntimeError, tk.TclError):
+            pass    # Main loop not running (yet), the fallback loop renders the snapshot
+
+
+    def notify_probe_results(self) -> None:
+        """
+        Called by the prober thread, schedules the rendering of the changed reachability in the Tk thread
+        """
+        try:
+            self.event_generate('<<ProbeResults>>', when='tail')
+        except (RuntimeError, tk.TclError):
+            pass    # Main loop not running (yet), the results are rendered with the next lock snapshot
+
+
+    @metrics.timed('gui.render_lock_snapshot')
+    def render_lock_snapshot(self) -> None:
+        """
+        Renders the latest lock snapshot posted by the background refresher without blocking the GUI
+        """
+        snapshot = self.refresher.latest_snapshot()
+        if snapshot is not None:
+            self.taco.apply_locks(*snapshot)
+            self.update_testbench_treeview()
+        unavailable = [self.taco.offline_database] if self.taco.offline else []
+        unavailable += [f'site {site}' for site in self.taco.sites.errors]
+        self.title(f'TACo (offline: {", ".join(unavailable)})' if unavailable else 'TACo')
+        error = self.refresher.last_error
+        self.status.set('' if error is None else f'Error: {error or type(error).__name__}')
+
+        conflicts = self.taco.pop_conflicts()
+        if conflicts:
+            messagebox.showwarning('Lock conflicts', 'Lock changes made while offline could not be applied:\n' + '\n'.join(conflicts))
+
+        notices = self.taco.pop_notices()
+        if notices:
+            messagebox.showwarning('Locks', '\n'.join(notices))
+
+        handovers = self.taco.pop_handovers()
+        if handovers:
+            messagebox.showinfo('Testbench available', f'Your turn: {", ".join(handovers)} is now locked for you.')
+
+
+    def poll_lock_snapshots(self) -> None:
+        self.render_lock_snapshot()
+
+        # Fallback Update-Loop
+        self.after(self.TREEVIEW_UPDATE_TIMER, self.poll_lock_snapshots)
     
         
+    def watch_testbench_json(self) -> None:
+        """
+        Checks the testbench file for changes in the refresher thread, as reading it may block on a network share
+        """
+        self.apply_testbench_file()     # Fallback if the change was read before the main loop was running
+        self.refresher.submit(lambda _: self.read_testbench_json())
+        self.after(self.TESTBENCH_RELOAD_TIMER, self.watch_testbench_json)
+
+
+    def read_testbench_json(self) -> None:
+        """
+        Called by the refresher thread, posts the content of the changed testbench file to the Tk thread
+        """
+        try:
+            testbenchdata = self.taco.read_changed_testbench_JSON()
+        except ValueError:
+            return      # Invalid edit, the loaded testbenches are kept until the file changes again
+        if testbenchdata is None:
+            return
+
+        self.testbench_files.put(testbenchdata)
+        try:
+            self.event_generate('<<TestbenchFileChanged>>', when='tail')
+        except (RuntimeError, tk.TclError):
+            pass    # Main loop not running (yet), applied by the next check
+
+
+    def apply_testbench_file(self) -> None:
+        """
+        Applies the latest content of the testbench file to the treeview, keeping the selection and all unchanged items.
+        The changed testbenches are registered in the database by the refresher thread.
+        """
+        testbenchdata = None
+        while True:
+            try:
+                testbenchdata = self.testbench_files.get_nowait()
+            except queue.Empty:
+                break
+        if testbenchdata is None:
+            return
+
+        try:
+            removed, added, changed = self.taco.reload_testbench_JSON(testbenchdata, register = False)
+        except ValueError:
+            return      # Duplicate ids, the loaded testbenches are kept until the file changes again
+
+        self.apply_testbench_diff(removed, added, changed)
+        hostnames = tuple(dict.fromkeys(self.taco.get_testbench(id).hostname for id in added + changed))
+        self.refresher.submit(lambda _: self.taco.register_testbenches(hostnames))
+        self.prober.request_probe()
+
+
+    def apply_testbench_diff(self, removed, added, changed) -> None:
+        """
+        Applies the changes of the testbench file to the affected rows only, so the selection and all other rows are kept.
+        Added testbenches are inserted if they match the search or their parent is expanded
+        """
+        structure = {root: children for testbench_block in self.taco.tb_structure for root, children in testbench_block.items()}
+        affected = {self.tree.parent(id) for id in removed if id in self.rendered_items}
+        affected.update(self.taco.testbenches.get_parent(id) or id for id in added + changed)
+        affected.update(root for root in self.placeholders if not structure.get(root))     # Collapsed testbenches without children left
+
+        self.expanded.difference_update(removed)
+        self.delete_rows(removed)
+        for id in changed:
+            if id in self.rendered_items:
+                self.tree.item(id, text = str(self.taco.get_testbench(id)))
+        if self.matches is not None:
+            self.matches = self.taco.search_testbenches(self.search.get().strip())
+        matches = None if self.matches is None else set(self.matches)
+
+        new_roots = []
+        for root in affected & structure.keys():
+            shown = self.get_shown_rows(root, structure[root], matches)
+            if shown is None:
+                self.delete_rows([root])
+                continue
+            if root not in self.rendered_items:
+                new_roots.append(root)
+            self.apply_treeview_changes(self.get_treeview_changes([(root, "")]))
+
+            rows = [child for child in self.tree.get_children(root) if child in self.rendered_items]
+            self.delete_rows([child for child in rows if child not in shown])
+            self.apply_treeview_changes(self.get_treeview_changes([(child, root) for child in shown]))
+            for index, child in enumerate(shown):
+                if child not in rows:
+                    self.tree.move(child, root, index)  # Inserted rows are appended, the existing ones are in the order of the file
+
+            placeholder = self.placeholders.get(root)
+            if structure[root] and not shown and placeholder is None:
+                self.placeholders[root] = self.tree.insert(root, tk.END, text='...')
+            elif placeholder is not None and (shown or not structure[root]):
+                self.tree.delete(self.placeholders.pop(root))
+            if shown and not self.tree.item(root, 'open'):
+                self.tree.item(root, open=True)
+
+        if new_roots:
+            positions = {root: index for index, root in enumerate(root for root in structure if root in self.rendered_items)}
+            for root in sorted(new_roots, key=positions.get):
+                self.tree.move(root, "", positions[root])
+
+
     def run_rdp(self):
-        self.taco.run_rdp(self.selected_testbench.id)
+        id = self.selected_testbench.id
+        self.refresher.submit(lambda database: self.taco.run_rdp(id, database))
 
     
     def lock_testbench(self):
-        self.taco.set_lock(self.selected_testbench.id)
-        self.update_testbench(self.selected_testbench.id)
+        id = self.selected_testbench.id
+        self.refresher.submit(lambda database: self.taco.set_lock(id, database))
     
 
     def unlock_testbench(self):
-        self.taco.unset_lock(self.selected_testbench.id)
-        self.update_testbench(self.selected_testbench.id)
+        id = self.selected_testbench.id
+        self.refresher.submit(lambda database: self.taco.unset_lock(id, database))
+
+
+    def enqueue_testbench(self):
+        id = self.selected_testbench.id
+        self.refresher.submit(lambda database: self.taco.enqueue_lock(id, database))
+
+
+    def dequeue_testbench(self):
+        id = self.selected_testbench.id
+        self.refresher.submit(lambda database: self.taco.dequeue_lock(id, database))
+
+
+    def reserve_testbench(self):
+        id = self.selected_testbench.id
+        start = simpledialog.askstring('Reserve Testbench', f'Start of the reservation of {id} (YYYY-MM-DD HH:MM):',
+                                       initialvalue=f'{datetime.now() + timedelta(days=1):%Y-%m-%d %H:00}', parent=self)
+        if not start:
+            return
+        hours = simpledialog.askfloat('Reserve Testbench', 'Duration in hours:', initialvalue=4, minvalue=0.25, parent=self)
+        if not hours:
+            return
+        try:
+            start = datetime.strptime(start.strip(), '%Y-%m-%d %H:%M')
+        except ValueError:
+            messagebox.showerror('Reserve Testbench', f'Invalid start "{start}", expected YYYY-MM-DD HH:MM.')
+            return
+
+        def reserve(database):
+            try:
+                self.taco.reserve_testbench(id, start, start + timedelta(hours=hours), database)
+            except ValueError as err:
+                self.taco.notices.append(str(err))  # Shown with the next snapshot
+        self.refresher.submit(reserve)
+
+
+    def cancel_reservation(self, reservation_id):
+        id = self.selected_testbench.id
+        self.refresher.submit(lambda database: self.taco.cancel_reservation(id, reservation_id, database))
+
+
+    def lock_testbench_group(self):
+        ids = self.taco.get_group(self.selected_testbench.id)
+
+        def lock_group(database):
+            try:
+                self.taco.set_lock_group(ids, database)
+            except ValueError as err:
+                self.taco.notices.append(str(err))  # Shown with the next snapshot
+        self.refresher.submit(lock_group)
+
+
+    def unlock_testbench_group(self):
+        ids = self.taco.get_group(self.selected_testbench.id)
+        self.refresher.submit(lambda database: self.taco.release_locks(ids, database))
         
         
     def set_database_file(self):
@@ -254,12 +717,16 @@ class TACo_GUI(tk.Tk):
 
         old_dbfile = self.taco.databaseFile
         result, err = self.taco.set_database(dbfile)
+        if not result and DatabaseController.requires_migration(dbfile) and messagebox.askyesno('Migrate Database',
+                f'The database located at {dbfile} was created by an older TACo version. Once it is migrated, '
+                'clients of older versions sharing it stop working. Migrate it now?'):
+            result, err = self.taco.set_database(dbfile, allow_migration=True)
         if not result:
             # Revert to previous database
             messagebox.showerror('Error loading Database', f'Failed to load database located at {dbfile}: {err}')
             self.taco.set_database(old_dbfile)
             
-        self.update_testbench_treeview()
+        self.refresher.request_refresh()
             
             
     def load_testbench_json(self) -> None:
@@ -269,8 +736,13 @@ class TACo_GUI(tk.Tk):
         if not jsonfile: 
             return
         
-        self.taco.load_testbench_JSON(jsonfile)
+        try:
+            self.taco.load_testbench_JSON(jsonfile)
+        except ValueError as err:
+            messagebox.showerror('Error loading Testbench List', f'Failed to load testbench list located at {jsonfile}: {err}')
         self.update_testbench_treeview(clear = True)
+        self.refresher.request_refresh()
+        self.prober.request_probe()
 
 
     def save_testbench_json(self) -> None:
@@ -289,7 +761,96 @@ class TACo_GUI(tk.Tk):
         
     def set_username(self, *args):
         self.taco.set_username(self.user.get())
-        self.taco.save_settings()
+
+
+class StatisticsWindow(tk.Toplevel):
+    REFRESH_TIMER = 1000    # Interval for refreshing the displayed metrics
+    COLUMNS = ('count', 'mean_ms', 'p50_ms', 'p99_ms', 'max_ms', 'errors')
+
+    def __init__(self, parent, *args, **kwargs):
+        """
+        Debug panel showing the timing of the database, broker and GUI operations, and the slow operation log
+        """
+        super().__init__(parent, *args, **kwargs)
+        self.taco = parent.taco
+
+        self.title("Statistics")
+        self.geometry("720x480")
+
+        # Operation timings
+        self.table = ttk.Treeview(self, columns=self.COLUMNS)
+        self.table.heading('#0', text='Operation', anchor=tk.W)
+        self.table.column('#0', width=260)
+        for column in self.COLUMNS:
+            self.table.heading(column, text=column.replace('_ms', ' [ms]').replace('_', ' ').title(), anchor=tk.E)
+            self.table.column(column, width=70, anchor=tk.E)
+        self.table.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
+
+        # Counters and slow operations
+        tk.Label(self, text='Counters and slow operations', font=font.Font(size=10, weight='bold')).pack(anchor=tk.W, padx=5)
+        self.events = tk.Listbox(self, height=8)
+        self.events.pack(fill=tk.X, padx=5)
+
+        frame = tk.Frame(self)
+        frame.pack(fill=tk.X, padx=5, pady=5)
+        tk.Label(frame, text='Log operations slower than [ms], 0 to disable:').pack(side=tk.LEFT)
+        self.threshold = tk.StringVar(self, value=f'{self.taco.slow_operation_ms:g}')
+        threshold_entry = tk.Entry(frame, textvariable=self.threshold, width=8)
+        threshold_entry.bind('<Return>', self.set_threshold)
+        threshold_entry.bind('<FocusOut>', self.set_threshold)
+        threshold_entry.pack(side=tk.LEFT, padx=5)
+
+        tk.Button(frame, text='Close', command=self.destroy, width=10).pack(side=tk.RIGHT)
+        tk.Button(frame, text='Reset', command=self.reset, width=10).pack(side=tk.RIGHT, padx=5)
+        tk.Button(frame, text='Export', command=self.export, width=10).pack(side=tk.RIGHT)
+
+        self.refresh()
+
+
+    def refresh(self) -> None:
+        if not self.winfo_exists():
+            return
+        snapshot = metrics.snapshot()
+
+        for name, operation in snapshot['operations'].items():
+            values = [operation['count']] + [f'{operation[column]:.1f}' for column in self.COLUMNS[1:-1]] + [operation['errors']]
+            if self.table.exists(name):
+                self.table.item(name, values=values)
+            else:
+                self.table.insert('', tk.END, iid=name, text=name, values=values)
+
+        self.events.delete(0, tk.END)
+        for name, value in sorted(snapshot['counters'].items()):
+            self.events.insert(tk.END, f'{name}: {value}')
+        for when, name, ms in reversed(snapshot['slow_operations']):
+            self.events.insert(tk.END, f'{when[:19]} slow {name}: {ms:.1f} ms')
+
+        self.after(self.REFRESH_TIMER, self.refresh)
+
+
+    def set_threshold(self, *args) -> None:
+        try:
+            self.taco.set_slow_operation_ms(self.threshold.get())
+        except ValueError:
+            pass
+        self.threshold.set(f'{self.taco.slow_operation_ms:g}')
+
+
+    def reset(self) -> None:
+        metrics.reset()
+        self.table.delete(*self.table.get_children())
+        self.events.delete(0, tk.END)
+
+
+    def export(self) -> None:
+        path = filedialog.asksaveasfilename(parent=self, title='Export statistics', defaultextension='.json',
+                                            filetypes=[('JSON', '*.json'), ('Prometheus text', '*.prom')])
+        if not path:
+            return
+        try:
+            metrics.export(path)
+        except OSError as err:
+            messagebox.showerror('Export failed', str(err), parent=self)
 
 
 class AboutWindow(tk.Toplevel):
@@ -308,7 +869,7 @@ class AboutWindow(tk.Toplevel):
         
         url = 'https://github.com/rjwolke/TestbenchAccessController'
         github_link   = tk.Label(self, text=url, fg="blue", cursor="hand2")
-        github_link.bind('<Button-1>', lambda _: webbrowser.open_new_tab(url))
+        github_link.bind('<Button-1>', lambda _: self.open_url(url))
         github_link.pack()
 
         ttk.Separator(self, orient=tk.HORIZONTAL).pack(pady=5, fill=tk.X)
@@ -324,6 +885,11 @@ class AboutWindow(tk.Toplevel):
         closeButton = tk.Button(self, text='Close', command=lambda: self.withdraw(), width=15)
         closeButton.pack(side=tk.BOTTOM, padx=5, pady=5, anchor='se')
 
+
+    def open_url(self, url) -> None:
+        import webbrowser   # Imported on demand, it is only needed for the links of this window
+        webbrowser.open_new_tab(url)
+
         
     def creative_commons_attribution(self, name, author, url) -> None:
         frame = tk.Frame(self)
@@ -334,11 +900,11 @@ class AboutWindow(tk.Toplevel):
         title.grid(row=0, column=0, sticky="w")
 
         link = tk.Label(frame, text=url, fg="blue", cursor="hand2")
-        link.bind('<Button-1>', lambda _: webbrowser.open_new_tab(url))
+        link.bind('<Button-1>', lambda _: self.open_url(url))
         link.grid(row=1, column=0, sticky="w")
 
         image = tk.Label(frame, image=self.img_cc_by_3, cursor="hand2")
-        image.bind('<Button-1>', lambda _: webbrowser.open_new_tab('https://creativecommons.org/licenses/by/3.0/'))
+        image.bind('<Button-1>', lambda _: self.open_url('https://creativecommons.org/licenses/by/3.0/'))
         image.grid(row=0, column=1, rowspan=2, sticky="e")
         
 
@@ -0,0 +1,202 @@
+"""Multi-client load benchmark for the lock database.
+
+Spawns N simulated clients as separate processes against a local sqlite file. Each client runs a random but seeded
+mix of lock reads, lock/unlock cycles and testbench registrations at a configurable rate, and the combined results
+are reported as throughput, p50/p99 latency, "database is locked" error rate and lost updates.
+
+A lost update is counted when a client which believed to hold a lock finds another holder before releasing it.
+This happens with the check-then-set pattern of DatabaseController.set_lock (--mode plain), but must not happen
+with try_acquire/release (--mode cas).
+
+Example:
+    python benchmarks/database_load.py --clients 16 --duration 20 --mix read=80,lock=18,add=2 --mode cas --json results.json
+"""
+import os
+import sys
+import json
+import time
+import random
+import sqlite3
+import argparse
+import tempfile
+import multiprocessing as mp
+from typing import Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from taco.DatabaseController import DatabaseController
+from taco.ConnectionProfile import ConnectionProfile, PROFILES, DEFAULT_PROFILE
+
+
+OPERATIONS = ('read', 'lock', 'add')
+
+
+def parse_mix(mix: str) -> Dict[str, float]:
+    """Parses a mix like "read=80,lock=18,add=2" into weights per operation."""
+    weights = dict.fromkeys(OPERATIONS, 0.0)
+    for item in mix.split(','):
+        name, _, weight = item.partition('=')
+        if name.strip() not in weights:
+            raise argparse.ArgumentTypeError(f'Unknown operation "{name}", expected one of {OPERATIONS}.')
+        weights[name.strip()] = float(weight)
+    return weights
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+
+def run_client(index: int, config: dict, start_time: float, results: mp.Queue) -> None:
+    """Simulated client executing the operation mix until the end of the benchmark."""
+    rng         = random.Random(config['seed'] * 1000 + index)    # Same operation sequence on every run
+    database    = DatabaseController(config['database'], ConnectionProfile.get(config['profile']))
+    username    = f'client{index}'
+    hostnames   = tuple(f'bench{i:04d}' for i in range(config['hosts']))
+    operations  = list(config['mix'])
+    weights     = list(config['mix'].values())
+
+    latencies: Dict[str, List[float]] = {op: [] for op in OPERATIONS}
+    stats = {'locked_errors': 0, 'other_errors': 0, 'lost_updates': 0, 'acquired': 0, 'refused': 0}
+    held = set()
+    added = 0
+
+    def lock() -> None:
+        nonlocal held
+        hostname = rng.choice(hostnames)
+        if hostname in held:
+            # Release, verifying that nobody took over the lock in the meantime
+            if database.get_lock(hostname)[0] != username:
+                stats['lost_updates'] += 1
+            if config['mode'] == 'cas':
+                database.release(hostname, username)
+            else:
+                database.set_lock(hostname, '')
+            held.discard(hostname)
+            return
+
+        if config['mode'] == 'cas':
+            success = database.try_acquire(hostname, username)[0]
+        else:
+            success = not database.get_lock(hostname)[0]
+            if success:
+                database.set_lock(hostname, username)
+
+        if success:
+            held.add(hostname)
+            stats['acquired'] += 1
+        else:
+            stats['refused'] += 1
+
+    def add() -> None:
+        nonlocal added
+        database.add_testbench(f'client{index}-bench{added:06d}')
+        added += 1
+
+    execute = {'read': lambda: database.get_lock_multiple(hostnames), 'lock': lock, 'add': add}
+
+    time.sleep(max(0.0, start_time - time.time()))
+    interval    = 1.0 / config['rate'] if config['rate'] else 0.0
+    deadline    = start_time + config['duration']
+    next_time   = time.time()
+    while time.time() < deadline:
+        op = rng.choices(operations, weights)[0]
+        started = time.perf_counter()
+        try:
+            execute[op]()
+        except sqlite3.OperationalError as err:
+            stats['locked_errors' if 'locked' in str(err) else 'other_errors'] += 1
+            continue
+        except (sqlite3.Error, ValueError):
+            stats['other_errors'] += 1
+            continue
+        latencies[op].append(time.perf_counter() - started)
+
+        if interval:
+            next_time += interval
+            time.sleep(max(0.0, next_time - time.time()))
+
+    results.put({'latencies': latencies, **stats})
+
+
+def run_benchmark(config: dict) -> dict:
+    """Prepares a fresh database, runs all clients and aggregates their results."""
+    database = DatabaseController(config['database'], ConnectionProfile.get(config['profile']))
+    database.create_testbench_table(forceRecreate=True)
+    database.add_testbenches(tuple(f'bench{i:04d}' for i in range(config['hosts'])))
+    database.close()
+
+    results     = mp.Queue()
+    start_time  = time.time() + 1.0 + 0.05 * config['clients']  # Leave time to spawn all processes
+    clients     = [mp.Process(target=run_client, args=(i, config, start_time, results)) for i in range(config['clients'])]
+    for client in clients:
+        client.start()
+    client_results = [results.get() for _ in clients]
+    for client in clients:
+        client.join()
+
+    report = {'config': config, 'operations': {}}
+    total = 0
+    for op in OPERATIONS:
+        latencies = [latency for result in client_results for latency in result['latencies'][op]]
+        total += len(latencies)
+        report['operations'][op] = {
+            'count':        len(latencies),
+            'throughput':   len(latencies) / config['duration'],
+            'p50_ms':       percentile(latencies, 0.50) * 1000,
+            'p99_ms':       percentile(latencies, 0.99) * 1000,
+        }
+
+    for key in ('locked_errors', 'other_errors', 'lost_updates', 'acquired', 'refused'):
+        report[key] = sum(result[key] for result in client_results)
+    report['throughput'] = total / config['duration']
+    report['locked_error_rate'] = report['locked_errors'] / max(1, total + report['locked_errors'])
+    return report
+
+
+def print_report(report: dict) -> None:
+    config = report['config']
+    print(f"{config['clients']} clients, {config['duration']}s, mode={config['mode']}, profile={config['profile']}, seed={config['seed']}")
+    print(f"{'operation':<10}{'count':>10}{'ops/s':>10}{'p50 ms':>10}{'p99 ms':>10}")
+    for op, stats in report['operations'].items():
+        print(f"{op:<10}{stats['count']:>10}{stats['throughput']:>10.1f}{stats['p50_ms']:>10.2f}{stats['p99_ms']:>10.2f}")
+    print(f"total throughput:   {report['throughput']:.1f} ops/s")
+    print(f"database is locked: {report['locked_errors']} ({report['locked_error_rate']:.2%})")
+    print(f"other errors:       {report['other_errors']}")
+    print(f"locks acquired:     {report['acquired']} (refused: {report['refused']})")
+    print(f"lost updates:       {report['lost_updates']}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Multi-client load benchmark for the TACo lock database.')
+    parser.add_argument('--clients', type=int, default=8, help='Number of simulated client processes')
+    parser.add_argument('--duration', type=float, default=10.0, help='Duration of the benchmark in seconds')
+    parser.add_argument('--rate', type=float, default=0.0, help='Operations per second and client, 0 for unlimited')
+    parser.add_argument('--hosts', type=int, default=50, help='Number of testbenches in the database')
+    parser.add_argument('--mix', type=parse_mix, default='read=80,lock=18,add=2', help='Weights of the operations read, lock and add')
+    parser.add_argument('--mode', choices=('cas', 'plain'), default='cas', help='Locking via try_acquire/release or get_lock/set_lock')
+    parser.add_argument('--profile', choices=list(PROFILES), default=DEFAULT_PROFILE, help='Connection profile of the clients')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the operation sequences')
+    parser.add_argument('--database', help='Database file, recreated by the benchmark. Defaults to a temporary file')
+    parser.add_argument('--json', help='Write the report as JSON to this file')
+    args = parser.parse_args()
+
+    config = vars(args).copy()
+    del config['json']
+    if isinstance(config['mix'], str):
+        config['mix'] = parse_mix(config['mix'])
+
+    with tempfile.TemporaryDirectory() as tempdir:
+        config['database'] = args.database or os.path.join(tempdir, 'benchmark.db')
+        report = run_benchmark(config)
+
+    print_report(report)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=4)
+
+
+if __name__ == '__main__':
+    main()
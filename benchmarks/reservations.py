@@ -0,0 +1,122 @@
+"""Reservation lookup benchmark of the DatabaseController.
+
+Fills a temporary database with many future time slots per testbench and measures the latency of booking a slot
+(including the overlap check), reading the next reservation of all testbenches, and acquiring and releasing a lock,
+which checks for an active reservation. All lookups are single index seeks, so their latency must not grow with
+the number of booked slots.
+
+The benchmark fails (exit code 1) if the median latency of an operation exceeds the target.
+
+Example:
+    python benchmarks/reservations.py --testbenches 50 --slots 5000 --operations 500 --target-ms 20 --json results.json
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import statistics
+from datetime import datetime
+from typing import Callable, Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from taco.DatabaseController import DatabaseController
+from taco.ConnectionProfile import ConnectionProfile
+
+
+SLOT_SPACING = 3600     # Start of consecutive slots of a testbench in seconds, each slot is half as long
+
+
+def prepare(database: DatabaseController, hostnames: List[str], slots: int) -> int:
+    """Registers the testbenches and books the slots directly in one transaction. Returns the epoch of the first slot."""
+    database.add_testbenches(tuple(hostnames))
+    first = database.epoch() + SLOT_SPACING
+
+    def book() -> None:
+        database.cursor.executemany("INSERT INTO Reservations (Name, User, Starts_At, Ends_At) VALUES (?, 'benchmark', ?, ?)",
+                                    ((hostname, first + i * SLOT_SPACING, first + i * SLOT_SPACING + SLOT_SPACING // 2)
+                                     for hostname in hostnames for i in range(slots)))
+    database.write_transaction(book)
+    return first
+
+
+def measure(operation: Callable[[], None], operations: int) -> List[float]:
+    durations = []
+    for _ in range(operations):
+        started = time.perf_counter()
+        operation()
+        durations.append((time.perf_counter() - started) * 1000)
+    return durations
+
+
+def run_benchmark(config: dict) -> dict:
+    random.seed(config['seed'])
+    hostnames = [f'host{i:04d}' for i in range(config['testbenches'])]
+
+    with tempfile.TemporaryDirectory() as directory:
+        database = DatabaseController(os.path.join(directory, 'taco.db'), ConnectionProfile.get(config['profile']))
+        first = prepare(database, hostnames, config['slots'])
+
+        def reserve() -> None:
+            # Gaps between the booked slots, every second attempt overlaps a booked slot
+            start = first + random.randrange(config['slots']) * SLOT_SPACING + random.choice((SLOT_SPACING // 2, 0))
+            database.reserve(random.choice(hostnames), 'benchmark', datetime.fromtimestamp(start), datetime.fromtimestamp(start + 60))
+
+        def acquire() -> None:
+            hostname = random.choice(hostnames)
+            database.try_acquire(hostname, 'benchmark')
+            database.release(hostname, 'benchmark')
+
+        results: Dict[str, List[float]] = {
+            'reserve':                  measure(reserve, config['operations']),
+            'get_next_reservations':    measure(lambda: database.get_next_reservations(tuple(hostnames)), config['operations']),
+            'acquire_release':          measure(acquire, config['operations']),
+        }
+        database.close()
+
+    report = {'config': config, 'operations': {}}
+    for name, durations in results.items():
+        report['operations'][name] = {'median_ms': statistics.median(durations), 'max_ms': max(durations)}
+
+    report['failures'] = [f"median {name} {operation['median_ms']:.2f} ms exceeds the target of {config['target_ms']} ms"
+                          for name, operation in report['operations'].items() if operation['median_ms'] > config['target_ms']]
+    return report
+
+
+def print_report(report: dict) -> None:
+    config = report['config']
+    print(f"{config['testbenches']} testbenches with {config['slots']} future slots each, {config['operations']} operations, "
+          f"profile {config['profile']}, target {config['target_ms']} ms")
+    for name, operation in report['operations'].items():
+        print(f"{name + ':':24}{operation['median_ms']:8.2f} ms median {operation['max_ms']:8.2f} ms max")
+    for failure in report['failures']:
+        print(f"FAILED: {failure}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Reservation lookup benchmark of the DatabaseController.')
+    parser.add_argument('--testbenches', type=int, default=20, help='Number of testbenches')
+    parser.add_argument('--slots', type=int, default=5000, help='Number of booked future slots per testbench')
+    parser.add_argument('--operations', type=int, default=200, help='Number of measured calls per operation')
+    parser.add_argument('--profile', default='local', help='Connection profile of the database')
+    parser.add_argument('--target-ms', type=float, default=20.0, help='Maximum median latency of every operation in milliseconds')
+    parser.add_argument('--seed', type=int, default=1, help='Seed of the random slots')
+    parser.add_argument('--json', help='Write the report as JSON to this file')
+    args = parser.parse_args()
+
+    config = vars(args).copy()
+    del config['json']
+    report = run_benchmark(config)
+
+    print_report(report)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=4)
+    sys.exit(1 if report['failures'] else 0)
+
+
+if __name__ == '__main__':
+    main()
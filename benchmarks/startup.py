@@ -0,0 +1,122 @@
+"""Startup time regression benchmark of the TestbenchAccessController.
+
+Every run starts a fresh interpreter in a temporary directory holding a settings file, a database and a testbench list,
+and measures the import of TACo and the construction of the TestbenchAccessController, which loads the settings,
+connects to the database and registers the testbenches. Settings file writes are counted with an audit hook.
+
+The benchmark fails (exit code 1) if the median startup time exceeds the target, if the unchanged settings file
+is rewritten, or if heavy modules which are only needed on demand (GUI, broker) are imported.
+
+Example:
+    python benchmarks/startup.py --testbenches 500 --runs 10 --target-ms 300 --json results.json
+"""
+import os
+import sys
+import json
+import argparse
+import tempfile
+import statistics
+import subprocess as sp
+from typing import Dict, List
+
+
+REPOSITORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFERRED_MODULES = ('tkinter', 'asyncio', 'psutil', 'webbrowser')    # Must not be loaded by the startup path
+
+CHILD = """
+import os, sys, json, time
+started = time.perf_counter()
+writes = []
+sys.addaudithook(lambda event, args: writes.append(args[0]) if event == 'open' and isinstance(args[1], str)
+                 and args[1].startswith(('w', 'a')) and str(args[0]).endswith('.taco_settings') else None)
+sys.path.insert(0, {repository!r})
+import TACo
+imported = time.perf_counter()
+taco = TACo.TestbenchAccessController()
+initialized = time.perf_counter()
+print(json.dumps({{
+    'import_ms':        (imported - started) * 1000,
+    'init_ms':          (initialized - imported) * 1000,
+    'total_ms':         (initialized - started) * 1000,
+    'settings_writes':  len(writes),
+    'testbenches':      len(taco.testbenches),
+    'deferred_loaded':  [module for module in {deferred!r} if module in sys.modules],
+}}))
+"""
+
+
+def prepare(directory: str, testbenches: int) -> None:
+    """Creates the testbench list, a database with all testbenches registered and a matching settings file."""
+    testbenchfile = os.path.join(directory, 'testbenches.json')
+    blocks = [{f'rig{i:04d}': {'hostname': f'host{i:04d}', 'children': {f'rig{i:04d}-dut': {}}} for i in range(testbenches // 2)}]
+    with open(testbenchfile, 'w') as f:
+        json.dump(blocks, f)
+
+    settings = {'Username': 'benchmark', 'Testbenchfile': testbenchfile, 'Database': os.path.join(directory, 'taco.db'),
+                'DatabaseProfile': 'share', 'Broker': ''}
+    with open(os.path.join(directory, '.taco_settings'), 'w') as f:
+        json.dump(settings, f, indent=4)
+
+
+def run_once(directory: str) -> Dict[str, float]:
+    code = CHILD.format(repository=REPOSITORY, deferred=DEFERRED_MODULES)
+    output = sp.run([sys.executable, '-c', code], cwd=directory, capture_output=True, text=True, check=True).stdout
+    return json.loads(output.splitlines()[-1])
+
+
+def run_benchmark(config: dict) -> dict:
+    with tempfile.TemporaryDirectory() as directory:
+        prepare(directory, config['testbenches'])
+        cold = run_once(directory)      # Creates the database, registers all testbenches and normalizes the settings file
+        runs: List[Dict[str, float]] = [run_once(directory) for _ in range(config['runs'])]
+
+    report = {'config': config, 'cold': cold, 'runs': runs}
+    for key in ('import_ms', 'init_ms', 'total_ms'):
+        report[key] = statistics.median(run[key] for run in runs)
+    report['settings_writes'] = max(run['settings_writes'] for run in runs)
+    report['deferred_loaded'] = sorted({module for run in runs for module in run['deferred_loaded']})
+
+    report['failures'] = []
+    if report['total_ms'] > config['target_ms']:
+        report['failures'].append(f"median startup {report['total_ms']:.1f} ms exceeds the target of {config['target_ms']} ms")
+    if report['settings_writes']:
+        report['failures'].append(f"unchanged settings file written {report['settings_writes']} times")
+    if report['deferred_loaded']:
+        report['failures'].append(f"deferred modules imported: {report['deferred_loaded']}")
+    return report
+
+
+def print_report(report: dict) -> None:
+    config = report['config']
+    print(f"{config['testbenches']} testbenches, {config['runs']} runs, target {config['target_ms']} ms")
+    print(f"cold start:         {report['cold']['total_ms']:.1f} ms ({report['cold']['settings_writes']} settings writes)")
+    print(f"import (median):    {report['import_ms']:.1f} ms")
+    print(f"init (median):      {report['init_ms']:.1f} ms")
+    print(f"startup (median):   {report['total_ms']:.1f} ms")
+    print(f"settings writes:    {report['settings_writes']}")
+    print(f"deferred imported:  {', '.join(report['deferred_loaded']) or '-'}")
+    for failure in report['failures']:
+        print(f"FAILED: {failure}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Startup time regression benchmark of the TestbenchAccessController.')
+    parser.add_argument('--testbenches', type=int, default=200, help='Number of testbenches in the testbench list')
+    parser.add_argument('--runs', type=int, default=5, help='Number of measured startups')
+    parser.add_argument('--target-ms', type=float, default=300.0, help='Maximum median startup time in milliseconds')
+    parser.add_argument('--json', help='Write the report as JSON to this file')
+    args = parser.parse_args()
+
+    config = vars(args).copy()
+    del config['json']
+    report = run_benchmark(config)
+
+    print_report(report)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=4)
+    sys.exit(1 if report['failures'] else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,346 @@
+import random
+import asyncio
+import logging
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager, suppress
+from datetime import datetime
+from typing import AsyncIterator, Callable, Dict, NamedTuple, Set, Tuple, TypeVar
+
+from taco.DatabaseController import DatabaseController
+from taco.LockClient import LockClient, Pool
+
+
+T = TypeVar('T')
+
+
+class LockChange(NamedTuple):
+    hostname: str
+    lock_user: str          # New holder, '' if the testbench became free
+    lock_time: datetime
+    previous_user: str      # Holder before the change, '' if the testbench was free
+
+
+class AsyncLockClient():
+    MAX_WORKERS     = 4     # Threads running the blocking database calls, shared by all coroutines of the client
+    POLL_TIMER      = 1.0   # Time between two checks of the database for changes
+    REFRESH_TIMER   = 10.0  # Time after which the lock data is read even without changes, as expiring leases do not modify the database
+    RETRY_JITTER    = 0.2   # Upper bound of the random delay before competing for a freed testbench again
+
+    def __init__(self, database: str = None, broker: str = None, username: str = None, profile: str = None, max_workers: int = MAX_WORKERS) -> None:
+        """asyncio facade of the LockClient for test orchestration. The blocking database calls run in a bounded executor,
+        and a single watcher task reads the lock data of all testbenches once per change, so one event loop can wait
+        for hundreds of testbenches. Arguments are passed to the LockClient, which is opened on first use.
+
+        Example:
+            async with AsyncLockClient() as client:
+                async with client.session(("rigA", "rigB"), timeout=600) as hostname:
+                    await run_tests(hostname)
+        """
+        self._arguments     = (database, broker, username, profile)
+        self.executor       = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='AsyncLockClient')
+        self.client: LockClient = None
+
+        self._connecting: asyncio.Lock = None
+        self._watcher: asyncio.Task = None
+        self._wakeup: asyncio.Event = None          # Set to check for changes before the next poll
+        self._snapshot_read: asyncio.Event = None   # Replaced after every read of the lock data, awaited by waiting coroutines
+        self._snapshot: Dict[str, Tuple[str, datetime]] = None
+        self._subscribers: Set[asyncio.Queue] = set()
+        self._cleanups: Set[asyncio.Task] = set()   # Releases of locks taken by cancelled attempts, referenced until done
+
+
+    async def __aenter__(self) -> 'AsyncLockClient':
+        await self._connect()
+        return self
+
+
+    async def __aexit__(self, *args) -> None:
+        await self.aclose()
+
+
+    @property
+    def username(self) -> str:
+        return self.client.username if self.client is not None else self._arguments[2]
+
+
+    async def _connect(self) -> LockClient:
+        """Opens the LockClient in the executor, as opening the database file may block, e.g. on a network share."""
+        if self._connecting is None:
+            self._connecting = asyncio.Lock()
+        async with self._connecting:
+            if self.client is None:
+                loop = asyncio.get_running_loop()
+                self.client = await loop.run_in_executor(self.executor, lambda: LockClient(*self._arguments))
+                self._wakeup = asyncio.Event()
+                self._snapshot_read = asyncio.Event()
+                # Changes pushed by a broker are checked immediately
+                self.client.database.subscribe(lambda: loop.call_soon_threadsafe(self._wakeup.set))
+        return self.client
+
+
+    async def _run(self, function: Callable[[DatabaseController], T]) -> T:
+        """Runs the blocking function, called with the database of the LockClient, in the executor."""
+        client = await self._connect()
+        return await asyncio.get_running_loop().run_in_executor(self.executor, function, client.database)
+
+
+    async def get_lock_multiple(self, hostnames: Pool = ()) -> Dict[str, Tuple[str, datetime]]:
+        """Returns the lock data of the testbenches, all testbenches of the database if none are given.
+
+        Raises:
+            ValueError: Raised if a hostname is not found in the database.
+        """
+        return await self._run(lambda database: database.get_lock_multiple(LockClient._pool(hostnames)))
+
+
+    async def try_acquire(self, pool: Pool, lease: float = LockClient.LEASE_TIME) -> str:
+        """Locks one free testbench of the pool in a single round trip.
+
+        Returns:
+            str: Hostname of the acquired testbench, '' if all testbenches are locked.
+        """
+        client = await self._connect()
+        hostname = (await self._run(lambda database: database.try_acquire_any(LockClient._pool(pool), client.username, LockClient._lease(lease))))[0]
+        if hostname:
+            self._wakeup.set()
+        return hostname
+
+
+    async def acquire(self, pool: Pool, timeout: float = None, lease: float = LockClient.LEASE_TIME) -> str:
+        """Waits until a testbench of the pool is free and locks it. Instead of polling the database, waiting coroutines
+        are woken by the watcher once a testbench of their pool is reported free. A testbench locked by an attempt which was
+        still running when the timeout expired or the caller was cancelled is released again before raising.
+
+        Args:
+            pool (Pool): Hostname or hostnames of interchangeable testbenches.
+            timeout (float, optional): Time in seconds to wait. Defaults to None, meaning no limit.
+            lease (float, optional): Lease time in seconds, None or 0 for locks which never expire. Defaults to LEASE_TIME.
+
+        Raises:
+            TimeoutError: Raised if no testbench became free within the timeout.
+            ValueError: Raised if a hostname is not found in the database.
+
+        Returns:
+            str: Hostname of the acquired testbench.
+        """
+        async def acquire() -> str:
+            while True:
+                try:
+                    hostname = await self._attempt(pool, lease)
+                except sqlite3.OperationalError as err:
+                    if 'locked' not in str(err):
+                        raise
+                    hostname = ''   # Database busy, retry with the next change
+                if hostname:
+                    return hostname
+                await self._wait_free(LockClient._pool(pool), after_read=True)
+                await asyncio.sleep(random.uniform(0, self.RETRY_JITTER))     # Spread the waiters competing for the same testbench
+
+        try:
+            return await asyncio.wait_for(acquire(), timeout)
+        except asyncio.TimeoutError:
+            raise TimeoutError(f'No testbench of {list(LockClient._pool(pool))} became free within {timeout} s.')
+
+
+    async def wait_free(self, pool: Pool, timeout: float = None) -> str:
+        """Waits until a testbench of the pool is free, without locking it.
+
+        Raises:
+            TimeoutError: Raised if no testbench became free within the timeout.
+            ValueError: Raised if a hostname is not found in the database.
+
+        Returns:
+            str: Hostname of the first free testbench.
+        """
+        pool = LockClient._pool(pool)
+        await self.get_lock_multiple(pool)  # Raises for unknown hostnames
+        try:
+            return await asyncio.wait_for(self._wait_free(pool), timeout)
+        except asyncio.TimeoutError:
+            raise TimeoutError(f'No testbench of {list(pool)} became free within {timeout} s.')
+
+
+    async def release(self, hostnames: Pool) -> Dict[str, Tuple[str, datetime]]:
+        """Removes the locks of the testbenches held by the user in one transaction.
+
+        Returns:
+            Dict[str, Tuple[str, datetime]]: dictionary linking the hostnames to a tuple of locked_by, locked_since after the operation
+        """
+        client = await self._connect()
+        lockDict = await self._run(lambda database: database.release_multiple(LockClient._pool(hostnames), client.username))
+        self._wakeup.set()
+        return lockDict
+
+
+    async def changes(self, hostnames: Pool = ()) -> AsyncIterator[LockChange]:
+        """Yields the changes of the lock holders of the testbenches, all testbenches if none are given, e.g.
+
+            async for change in client.changes(("rigA", "rigB")):
+                print(change.hostname, change.previous_user, '->', change.lock_user)
+
+        Changes are detected by the watcher, so changes reverted within one poll interval are not reported.
+        """
+        hostnames = set(LockClient._pool(hostnames))
+        queue: asyncio.Queue = asyncio.Queue()
+        self._subscribers.add(queue)
+        try:
+            await self._start_watcher()
+            while True:
+                change = await queue.get()
+                if not hostnames or change.hostname in hostnames:
+                    yield change
+        finally:
+            self._subscribers.discard(queue)
+
+
+    @asynccontextmanager
+    async def session(self, pool: Pool, timeout: float = None, lease: float = LockClient.LEASE_TIME) -> AsyncIterator[str]:
+        """Async context manager holding a testbench of the pool. The lease is renewed by a heartbeat task
+        while the context is active, and the lock is released when it is left.
+
+        Yields:
+            str: Hostname of the acquired testbench.
+        """
+        lease = LockClient._lease(lease)
+        hostname = await self.acquire(pool, timeout, lease)
+        heartbeat = asyncio.ensure_future(self._renew_lease(hostname, lease)) if lease is not None else None
+        try:
+            yield hostname
+        finally:
+            if heartbeat is not None:
+                heartbeat.cancel()  # A renewal still running in the executor does not renew the released lock
+            await self._shielded(self.release(hostname))
+
+
+    async def aclose(self) -> None:
+        """Stops the watcher, waits for pending releases and closes the database connection and the executor."""
+        if self._cleanups:
+            await asyncio.gather(*self._cleanups, return_exceptions=True)
+        if self._watcher is not None:
+            self._watcher.cancel()
+            with suppress(asyncio.CancelledError):
+                await self._watcher
+            self._watcher = None
+        if self.client is not None:
+            with suppress(Exception):
+                await self._run(lambda database: database.close())
+        self.executor.shutdown(wait=False)
+
+
+    async def _attempt(self, pool: Pool, lease: float) -> str:
+        """Runs try_acquire() for acquire(). The database call cannot be interrupted and still commits its lock if the caller
+        is cancelled meanwhile, e.g. by the timeout, so in this case the testbench it locked is released before the cancellation is raised.
+        """
+        attempt = asyncio.ensure_future(self.try_acquire(pool, lease))
+        try:
+            return await asyncio.shield(attempt)
+        except asyncio.CancelledError:
+            await self._shielded(self._release_attempt(attempt))
+            raise
+
+
+    async def _release_attempt(self, attempt: 'asyncio.Future[str]') -> None:
+        with suppress(Exception):
+            hostname = await attempt
+            if hostname:
+                await self.release(hostname)
+
+
+    async def _shielded(self, coroutine) -> None:
+        """Runs the coroutine to its end even if the caller is cancelled meanwhile."""
+        task = asyncio.ensure_future(coroutine)
+        self._cleanups.add(task)
+        task.add_done_callback(self._cleanups.discard)
+        await asyncio.shield(task)
+
+
+    async def _renew_lease(self, hostname: str, lease: float) -> None:
+        client = await self._connect()
+        while True:
+            await asyncio.sleep(min(LockClient.HEARTBEAT_TIMER, lease / 3))
+            try:
+                renewed = await self._run(lambda database: database.renew_leases((hostname,), client.username, lease))
+            except (sqlite3.Error, ValueError):
+                continue    # Retry with the next heartbeat, the lease time covers multiple missed heartbeats
+            if not renewed:
+                logging.getLogger('taco').warning('Lease of %s expired before it was renewed, the testbench is no longer locked', hostname)
+                return
+
+
+    async def _wait_free(self, pool: Tuple[str], after_read: bool = False) -> str:
+        """Waits until the lock data read by the watcher shows a free testbench of the pool and returns it.
+        With after_read set, lock data read before the call is not trusted, e.g. after a failed attempt to lock the pool.
+        """
+        await self._start_watcher()
+        if after_read:
+            await self._next_read()
+        while True:
+            free = [hostname for hostname in pool if not self._snapshot.get(hostname, ('',))[0]]
+            if free:
+                return free[0]
+            await self._next_read()
+
+
+    async def _next_read(self) -> None:
+        await self._snapshot_read.wait()
+
+
+    async def _start_watcher(self) -> None:
+        """Starts the watcher task after the first read of the lock data."""
+        await self._connect()
+        if self._snapshot is None:
+            await self._read_locks()
+        if self._watcher is None or self._watcher.done():
+            self._watcher = asyncio.ensure_future(self._watch())
+
+
+    async def _watch(self) -> None:
+        """Reads the lock data whenever the database changed, was written by this client, or the refresh timer expired."""
+        loop = asyncio.get_running_loop()
+        last_read = loop.time()
+        while True:
+            woken = self._wakeup.is_set()
+            self._wakeup.clear()
+            try:
+                if woken or loop.time() - last_read >= self.REFRESH_TIMER or await self._run(lambda database: database.has_changed()):
+                    await self._read_locks()
+                    last_read = loop.time()
+            except (sqlite3.Error, ValueError, OSError):
+                pass    # Database busy or unavailable, e.g. the connection to the broker was lost, retried with the next poll
+
+            with suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self._wakeup.wait(), self.POLL_TIMER)
+
+
+    async def _read_locks(self) -> None:
+        """Reads the lock data of all testbenches, publishes the changed holders and wakes the waiting coroutines."""
+        lockDict = await self._run(lambda database: database.get_lock_multiple())
+        previous, self._snapshot = self._snapshot, lockDict
+
+        if previous is not None:
+            for hostname, (lock_user, lock_time) in lockDict.items():
+                previous_user = previous.get(hostname, ('', None))[0]
+                if lock_user != previous_user:
+                    for queue in self._subscribers:
+                        queue.put_nowait(LockChange(hostname, lock_user, lock_time, previous_user))
+
+        event, self._snapshot_read = self._snapshot_read, asyncio.Event()
+        event.set()
+
+
+@asynccontextmanager
+async def acquire(pool: Pool, timeout: float = None, lease: float = LockClient.LEASE_TIME, **kwargs) -> AsyncIterator[str]:
+    """Holds a testbench of the pool while the async context is active, e.g.
+
+        async with acquire(("rigA", "rigB"), timeout=600) as hostname:
+            await run_tests(hostname)
+
+    Keyword arguments are passed to the AsyncLockClient.
+
+    Yields:
+        str: Hostname of the acquired testbench.
+    """
+    async with AsyncLockClient(**kwargs) as client:
+        async with client.session(pool, timeout, lease) as hostname:
+            yield hostname
@@ -0,0 +1,225 @@
+import json
+import queue
+import socket
+import sqlite3
+import threading
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Tuple
+
+from taco.DatabaseController import DatabaseController, Reservation
+from taco.ConnectionProfile import ConnectionProfile
+from taco.Metrics import metrics
+from taco.LockBroker import DEFAULT_PORT
+
+
+@metrics.instrument('broker')
+class BrokerClient():
+    TIMEOUT = 10.0      # Time in seconds to wait for a response of the broker
+
+    def __init__(self, host: str, port: int = DEFAULT_PORT) -> None:
+        """Connection to a LockBroker, providing the lock operations of the DatabaseController.
+        Lock changes are pushed by the broker, so has_changed() does not access the network.
+
+        Args:
+            host (str): Address of the broker.
+            port (int, optional): Port of the broker. Defaults to DEFAULT_PORT.
+
+        Raises:
+            OSError: Raised if the broker cannot be reached.
+        """
+        self.address    = (host, port)
+        self.socket     = socket.create_connection(self.address, timeout=self.TIMEOUT)
+        self.socket.settimeout(None)
+        self._reader    = self.socket.makefile('rb')
+        self._writer    = self.socket.makefile('wb')
+
+        self._lock      = threading.Lock()      # One request at a time, the client is shared among threads
+        self._responses: queue.Queue[dict] = queue.Queue()
+        self._callbacks: List[Callable[[], None]] = []
+        self._changed   = True
+        self._next_id   = 0
+        self._closed    = False
+
+        threading.Thread(target=self.__receive, name='BrokerClient', daemon=True).start()
+
+        info            = self._call('info')
+        self.dbFile     = info['dbFile']
+        self.profile    = ConnectionProfile.get(info['profile'])
+        self._call('subscribe')
+
+
+    @classmethod
+    def from_address(cls, address: str) -> 'BrokerClient':
+        """Connects to the broker given as "host" or "host:port"."""
+        host, _, port = address.partition(':')
+        return cls(host, int(port) if port else DEFAULT_PORT)
+
+
+    def __receive(self) -> None:
+        try:
+            for line in self._reader:
+                message = json.loads(line)
+                if 'event' in message:
+                    self._changed = True
+                    for callback in list(self._callbacks):
+                        callback()
+                else:
+                    self._responses.put(message)
+        except (OSError, ValueError):
+            pass
+        self._closed = True
+        self._responses.put({'error': 'Connection to lock broker lost', 'type': 'OperationalError'})
+
+
+    def _call(self, method: str, **params) -> Any:
+        """Sends a request and waits for its response.
+
+        Raises:
+            ValueError: Raised for errors of the database operation.
+            sqlite3.OperationalError: Raised if the database is locked or the broker cannot be reached.
+        """
+        with self._lock:
+            if self._closed:
+                raise sqlite3.OperationalError('Connection to lock broker lost')
+
+            self._next_id += 1
+            request = {'id': self._next_id, 'method': method, 'params': params}
+            try:
+                self._writer.write((json.dumps(request) + '\n').encode())
+                self._writer.flush()
+                response = self._responses.get(timeout=self.TIMEOUT)
+                while response.get('id') not in (self._next_id, None):
+                    response = self._responses.get(timeout=self.TIMEOUT)    # Discard late responses of timed out requests
+            except (OSError, queue.Empty) as err:
+                raise sqlite3.OperationalError(f'Lock broker not responding: {err}')
+
+        if 'error' in response:
+            if response['type'] == 'OperationalError':
+                raise sqlite3.OperationalError(response['error'])
+            raise ValueError(response['error'])
+        return response['result']
+
+
+    @staticmethod
+    def _decode_lock(lock: list) -> Tuple[str, datetime]:
+        lock_user, lock_time = lock
+        return (lock_user, DatabaseController.from_epoch(lock_time))
+
+
+    @staticmethod
+    def _decode_reservation(reservation: list) -> Reservation:
+        id, lock_user, start, end = reservation
+        return (id, lock_user, DatabaseController.from_epoch(start), DatabaseController.from_epoch(end))
+
+
+    def clone(self) -> 'BrokerClient':
+        """The client is thread-safe, so all threads share the same connection."""
+        return self
+
+
+    def subscribe(self, callback: Callable[[], None]) -> None:
+        """Registers a callback, called from the receiving thread whenever the broker pushes lock changes."""
+        self._callbacks.append(callback)
+
+
+    def has_changed(self) -> bool:
+        changed = self._changed
+        self._changed = False
+        return changed
+
+
+    def close(self) -> None:
+        self._closed = True
+        self.socket.close()
+
+
+    def add_testbench(self, hostname: str) -> None:
+        self._call('add_testbench', hostname=hostname)
+
+
+    def add_testbenches(self, hostnames: Tuple[str]) -> List[str]:
+        return self._call('add_testbenches', hostnames=list(hostnames))
+
+
+    def get_lock(self, hostname: str) -> Tuple[str, datetime]:
+        return self._decode_lock(self._call('get_lock', hostname=hostname))
+
+
+    def get_lock_multiple(self, hostnames: Tuple[str] = ()) -> Dict[str, Tuple[str, datetime]]:
+        lockDict = self._call('get_lock_multiple', hostnames=list(hostnames))
+        return {hostname: self._decode_lock(lock) for hostname, lock in lockDict.items()}
+
+
+    def set_lock(self, hostname: str, lock_user: str) -> None:
+        self._call('set_lock', hostname=hostname, lock_user=lock_user)
+
+
+    def unset_locks(self, expected: Dict[str, str]) -> List[str]:
+        return self._call('unset_locks', expected=expected)
+
+
+    def try_acquire(self, hostname: str, lock_user: str, lease: float = None) -> Tuple[bool, str, datetime]:
+        success, lock_by, lock_time = self._call('try_acquire', hostname=hostname, lock_user=lock_user, lease=lease)
+        return (success,) + self._decode_lock((lock_by, lock_time))
+
+
+    def try_acquire_multiple(self, hostnames: Tuple[str], lock_user: str, lease: float = None) -> Tuple[bool, Dict[str, Tuple[str, datetime]]]:
+        success, lockDict = self._call('try_acquire_multiple', hostnames=list(hostnames), lock_user=lock_user, lease=lease)
+        return (success, {hostname: self._decode_lock(lock) for hostname, lock in lockDict.items()})
+
+
+    def try_acquire_any(self, hostnames: Tuple[str], lock_user: str, lease: float = None) -> Tuple[str, datetime]:
+        return self._decode_lock(self._call('try_acquire_any', hostnames=list(hostnames), lock_user=lock_user, lease=lease))
+
+
+    def release(self, hostname: str, lock_user: str) -> Tuple[bool, str, datetime]:
+        success, lock_by, lock_time = self._call('release', hostname=hostname, lock_user=lock_user)
+        return (success,) + self._decode_lock((lock_by, lock_time))
+
+
+    def release_multiple(self, hostnames: Tuple[str], lock_user: str) -> Dict[str, Tuple[str, datetime]]:
+        lockDict = self._call('release_multiple', hostnames=list(hostnames), lock_user=lock_user)
+        return {hostname: self._decode_lock(lock) for hostname, lock in lockDict.items()}
+
+
+    def renew_leases(self, hostnames: Tuple[str], lock_user: str, lease: float) -> List[str]:
+        return self._call('renew_leases', hostnames=list(hostnames), lock_user=lock_user, lease=lease)
+
+
+    def enqueue(self, hostname: str, lock_user: str) -> Tuple[int, str, datetime]:
+        position, lock_by, lock_time = self._call('enqueue', hostname=hostname, lock_user=lock_user)
+        return (position,) + self._decode_lock((lock_by, lock_time))
+
+
+    def dequeue(self, hostname: str, lock_user: str) -> bool:
+        return self._call('dequeue', hostname=hostname, lock_user=lock_user)
+
+
+    def get_queue_multiple(self, hostnames: Tuple[str] = ()) -> Dict[str, List[str]]:
+        return self._call('get_queue_multiple', hostnames=list(hostnames))
+
+
+    def hand_over(self, hostnames: Tuple[str]) -> Dict[str, Tuple[str, datetime]]:
+        lockDict = self._call('hand_over', hostnames=list(hostnames))
+        return {hostname: self._decode_lock(lock) for hostname, lock in lockDict.items()}
+
+
+    def reserve(self, hostname: str, lock_user: str, start: datetime, end: datetime) -> Tuple[bool, Reservation]:
+        success, reservation = self._call('reserve', hostname=hostname, lock_user=lock_user,
+                                          start=DatabaseController.epoch(start), end=DatabaseController.epoch(end))
+        return (success, self._decode_reservation(reservation))
+
+
+    def cancel_reservation(self, id: int, lock_user: str) -> bool:
+        return self._call('cancel_reservation', id=id, lock_user=lock_user)
+
+
+    def get_reservations(self, hostname: str, start: datetime = None, end: datetime = None) -> List[Reservation]:
+        reservations = self._call('get_reservations', hostname=hostname, start=DatabaseController.epoch(start),
+                                  end=DatabaseController.epoch(end) if end is not None else None)
+        return [self._decode_reservation(reservation) for reservation in reservations]
+
+
+    def get_next_reservations(self, hostnames: Tuple[str] = ()) -> Dict[str, Reservation]:
+        reservationDict = self._call('get_next_reservations', hostnames=list(hostnames))
+        return {hostname: self._decode_reservation(reservation) for hostname, reservation in reservationDict.items()}
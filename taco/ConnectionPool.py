@@ -0,0 +1,110 @@
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterator, Tuple
+
+from taco.ConnectionProfile import ConnectionProfile
+
+
+Reader = Tuple[sqlite3.Connection, sqlite3.Cursor]
+
+
+class ConnectionPool():
+    STATEMENT_CACHE = 256   # Prepared statements kept per connection, reused by sqlite3 for identical SQL text
+
+    def __init__(self, databaseFile: str, profile: ConnectionProfile) -> None:
+        """Connections of one database shared by all threads of the process: every thread reads through its own
+        read-only connection, so polling does not wait for writes of other threads, while all writes go through one
+        writer connection serialized by a lock. Read connections of finished threads are handed to new threads,
+        keeping their prepared statements.
+
+        Args:
+            databaseFile (str): Path to the database file.
+            profile (ConnectionProfile): Journal mode, synchronous level and busy timeout of the connections.
+
+        Raises:
+            sqlite3.Error: Raised if the database cannot be opened.
+        """
+        self.databaseFile   = databaseFile
+        self.profile        = profile
+
+        self._local         = threading.local()     # Read connection and nesting level of writer() per thread
+        self._lock          = threading.Lock()      # Guards the readers
+        self._readers: Dict[threading.Thread, Reader] = {}
+
+        # The writer is opened up front, it sets the journal mode and reports unavailable databases immediately
+        self._write_lock    = threading.RLock()
+        self._writer        = self._open(read_only=False)
+        self._writer_cursor = self._writer.cursor()
+        self._writer_cursor.execute(f"PRAGMA journal_mode = {self.profile.journal_mode}")
+        self.journal_mode: str = self._writer_cursor.fetchone()[0]     # Mode actually in effect
+        self._writer_cursor.execute(f"PRAGMA synchronous = {self.profile.synchronous}")
+
+
+    def _open(self, read_only: bool) -> sqlite3.Connection:
+        # Timestamps are stored as integer epoch seconds, so no type detection is needed.
+        # Connections are used by one thread at a time, but readers are handed over and closed by other threads.
+        connection = sqlite3.connect(self.databaseFile, timeout=self.profile.busy_timeout, check_same_thread=False,
+                                     cached_statements=self.STATEMENT_CACHE)
+        if read_only:
+            connection.execute("PRAGMA query_only = ON")
+        return connection
+
+
+    @property
+    def writing(self) -> bool:
+        """True while the calling thread is inside writer()."""
+        return getattr(self._local, 'depth', 0) > 0
+
+
+    @contextmanager
+    def writer(self) -> Iterator[sqlite3.Cursor]:
+        """Serializes the block with the writes of all other threads. Inside the block, connection() and cursor()
+        return the writer, so reads of a transaction see its own changes. Blocks can be nested.
+
+        Yields:
+            sqlite3.Cursor: Cursor of the writer connection.
+        """
+        with self._write_lock:
+            self._local.depth = getattr(self._local, 'depth', 0) + 1
+            try:
+                yield self._writer_cursor
+            finally:
+                self._local.depth -= 1
+
+
+    def connection(self) -> sqlite3.Connection:
+        """Returns the writer inside writer(), otherwise the read-only connection of the calling thread."""
+        return self._writer if self.writing else self._reader()[0]
+
+
+    def cursor(self) -> sqlite3.Cursor:
+        """Returns the cursor of connection()."""
+        return self._writer_cursor if self.writing else self._reader()[1]
+
+
+    def _reader(self) -> Reader:
+        reader = getattr(self._local, 'reader', None)
+        if reader is not None:
+            return reader
+
+        with self._lock:
+            idle = next((owner for owner in self._readers if not owner.is_alive()), None)
+            reader = self._readers.pop(idle) if idle is not None else None
+        if reader is None:
+            connection = self._open(read_only=True)
+            reader = (connection, connection.cursor())
+
+        with self._lock:
+            self._readers[threading.current_thread()] = reader
+        self._local.reader = reader
+        return reader
+
+
+    def close(self) -> None:
+        """Closes the writer and the read connections of all threads."""
+        with self._write_lock, self._lock:
+            for connection, _ in self._readers.values():
+                connection.close()
+            self._readers.clear()
+            self._writer.close()
@@ -0,0 +1,50 @@
+from typing import Dict
+
+
+class ConnectionProfile():
+    def __init__(self, name: str, journal_mode: str = 'DELETE', synchronous: str = 'FULL',
+                 busy_timeout: float = 5.0, busy_retries: int = 5, busy_backoff: float = 0.05) -> None:
+        """Settings applied to every sqlite connection opened by the DatabaseController.
+
+        Args:
+            name (str): Name of the profile, as stored in the settings file.
+            journal_mode (str, optional): sqlite journal mode. WAL requires shared memory and must not be used on network shares. Defaults to 'DELETE'.
+            synchronous (str, optional): sqlite synchronous level. Defaults to 'FULL'.
+            busy_timeout (float, optional): Time in seconds sqlite waits for a lock held by another connection. Defaults to 5.0.
+            busy_retries (int, optional): Retries of write transactions failing with "database is locked". Defaults to 5.
+            busy_backoff (float, optional): Initial delay in seconds between retries, doubled after each attempt. Defaults to 0.05.
+        """
+        self.name           = name
+        self.journal_mode   = journal_mode
+        self.synchronous    = synchronous
+        self.busy_timeout   = busy_timeout
+        self.busy_retries   = busy_retries
+        self.busy_backoff   = busy_backoff
+
+
+    def __repr__(self) -> str:
+        return f'{self.name} (journal_mode={self.journal_mode}, synchronous={self.synchronous}, busy_timeout={self.busy_timeout})'
+
+
+    @classmethod
+    def get(cls, name: str) -> 'ConnectionProfile':
+        """Returns the predefined profile with the given name.
+
+        Raises:
+            ValueError: Raised if no profile with this name exists.
+        """
+        try:
+            return PROFILES[name]
+        except KeyError:
+            raise ValueError(f'Unknown database profile "{name}", expected one of {list(PROFILES)}.')
+
+
+PROFILES: Dict[str, ConnectionProfile] = {
+    # Database on a network share: rollback journal, truncated instead of deleted to save a metadata round trip per commit
+    'share':    ConnectionProfile('share', journal_mode='TRUNCATE', synchronous='FULL', busy_timeout=10.0, busy_retries=5, busy_backoff=0.1),
+    # Database on a local disk used by multiple processes: readers do not block the writer
+    'local':    ConnectionProfile('local', journal_mode='WAL', synchronous='NORMAL', busy_timeout=5.0, busy_retries=5, busy_backoff=0.02),
+    # Behaviour of sqlite without any tuning
+    'default':  ConnectionProfile('default', journal_mode='DELETE', synchronous='FULL', busy_timeout=5.0, busy_retries=5, busy_backoff=0.05),
+}
+DEFAULT_PROFILE = 'share'
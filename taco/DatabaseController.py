@@ -1,22 +1,66 @@
 import os
+import math
+import time
 import sqlite3
+import threading
 from datetime import datetime
-from typing import Dict, List, Tuple
+from pathlib import Path
+from typing import Callable, Dict, List, Tuple, TypeVar, Union
 
+from taco.ConnectionProfile import ConnectionProfile, DEFAULT_PROFILE
+from taco.ConnectionPool import ConnectionPool
+from taco.Metrics import metrics
 
+
+T = TypeVar('T')
+Reservation = Tuple[int, str, datetime, datetime]   # Id, user, start and end of a reservation
+
+
+@metrics.instrument('database')
 class DatabaseController():
-    def __init__(self, databaseFile : str) -> None:
-        """Initializes the sqlite connection and creates the required table.
+    SCHEMA_VERSION  = 4     # Stored in PRAGMA user_version, 1: Leases and integer epoch timestamps, 2: Lock history, 3: Wait queues, 4: Reservations
+    HANDOVER_LEASE  = 300   # Lease in seconds of locks handed over from a wait queue, until the heartbeat of the new holder renews it
+
+    # Lock data with expired leases reported as free since the end of the lease
+    LOCK_COLUMNS = """CASE WHEN Lease_Until < :now THEN '' ELSE Locked_By END,
+        CASE WHEN Lease_Until < :now THEN Lease_Until ELSE Locked_Since END
+    """
+
+    # Hosts reserved by another user than {user} at :now. Reservations of a host do not overlap, so the first one ending
+    # after :now is the only one which can contain it, found with one seek of the index on (Name, Ends_At)
+    RESERVED = """(SELECT Starts_At <= :now AND User != {user} FROM Reservations
+        WHERE Reservations.Name = Testbenches.Name AND Ends_At > :now ORDER BY Ends_At LIMIT 1) IS 1
+    """
+
+    def __init__(self, databaseFile : str, profile: ConnectionProfile = None, allow_migration: bool = False) -> None:
+        """Opens the connection pool and creates the required table. The controller is thread-safe: every thread reads
+        through its own read-only connection, and all write transactions go through one serialized writer.
 
         Args:
             databaseFile (str): Path to the database file.
+            profile (ConnectionProfile, optional): Journal mode, synchronous level and busy handling of the connection. Defaults to the DEFAULT_PROFILE.
+            allow_migration (bool, optional): Migrates databases of versions before the schema versioning, which breaks
+                the clients of these versions still sharing the database. Defaults to False.
+
+        Raises:
+            ValueError: Raised if the database is malformed, or requires a migration which is not allowed.
         """
         self.dbFile     = os.path.abspath(databaseFile)
-        self.connection = sqlite3.connect(self.dbFile, 
-                                          detect_types=sqlite3.PARSE_DECLTYPES|sqlite3.PARSE_COLNAMES)
-        self.cursor     = self.connection.cursor()
-        
-        self.create_testbench_table(False)
+        self.profile    = profile if profile is not None else ConnectionProfile.get(DEFAULT_PROFILE)
+        self.allow_migration = allow_migration
+        self.pool       = ConnectionPool(self.dbFile, self.profile)
+        self.journal_mode: str = self.pool.journal_mode     # Mode actually in effect
+
+        self._polled    = threading.local()     # Last seen value of PRAGMA data_version of the read connection of each thread
+
+        # Databases with the current schema only need a read, instead of a write transaction creating the table
+        self.cursor.execute("PRAGMA user_version")
+        if self.cursor.fetchone()[0] < self.SCHEMA_VERSION:
+            try:
+                self.create_testbench_table(False)
+            except ValueError:
+                self.pool.close()
+                raise
         
         
     def create_testbench_table(self, forceRecreate: bool = False) -> None:
@@ -24,18 +68,236 @@ class DatabaseController():
 
         Args:
             forceRecreate (bool, optional): Drops the table before creating it. Defaults to False.
+
+        Raises:
+            ValueError: Raised if the database requires a migration which is not allowed.
         """
         
         table = """CREATE TABLE IF NOT EXISTS Testbenches (
             Name VARCHAR(255) NOT NULL UNIQUE,
             Locked_By CHAR(255),
-            Locked_Since TIMESTAMP)
+            Locked_Since INTEGER,
+            Lease_Until INTEGER)
+        """
+        with self.pool.writer():
+            if not forceRecreate and not self.allow_migration and self._is_legacy(self.cursor):
+                raise ValueError(f'Database "{self.dbFile}" was created by an older TACo version, whose clients cannot read it once it is migrated. '
+                                 f'Upgrade all clients sharing it, then migrate it once with "python -m taco --database <file> migrate".')
+            if forceRecreate:
+                self.cursor.execute("DROP TABLE IF EXISTS Testbenches")
+                self.cursor.execute("PRAGMA user_version = 0")
+
+            self.cursor.execute(table)
+            self.commit()
+
+            self.cursor.execute("PRAGMA user_version")
+            if self.cursor.fetchone()[0] < self.SCHEMA_VERSION:
+                self.migrate()
+
+
+    def migrate(self) -> None:
+        """Migrates databases created by older versions. Runs in one write transaction, so concurrent clients migrate only once.
+        Version 1 adds the Lease_Until column and converts TIMESTAMP text (local time) to integer epoch seconds,
+        version 2 adds the lock history, version 3 the wait queues and version 4 the reservations.
+
+        Clients of the versions before the schema versioning parse Locked_Since as TIMESTAMP and fail on the epoch seconds,
+        so their databases are only migrated with allow_migration, once all clients sharing them are upgraded.
+        The later versions only add tables, which the clients of version 1 and above do not need.
         """
-        if forceRecreate:
-            self.cursor.execute("DROP TABLE IF EXISTS Testbenches")
-            
-        self.cursor.execute(table)
+        def migrate() -> None:
+            self.cursor.execute("PRAGMA user_version")
+            version = self.cursor.fetchone()[0]
+            if version >= self.SCHEMA_VERSION:
+                return  # Migrated by another client meanwhile
+
+            if version < 1:
+                self.cursor.execute("PRAGMA table_info(Testbenches)")
+                columns = [column[1] for column in self.cursor.fetchall()]
+                if 'Lease_Until' not in columns:
+                    self.cursor.execute("ALTER TABLE Testbenches ADD COLUMN Lease_Until INTEGER")
+
+                for column in ('Locked_Since', 'Lease_Until'):
+                    self.cursor.execute(f"""UPDATE Testbenches SET {column} = CAST(strftime('%s', {column}, 'utc') AS INTEGER)
+                        WHERE typeof({column}) = 'text'""")
+
+            if version < 2:
+                self.create_history_tables()
+
+            if version < 3:
+                self.create_queue_table()
+
+            if version < 4:
+                self.create_reservation_table()
+
+            self.cursor.execute(f"PRAGMA user_version = {self.SCHEMA_VERSION}")
+
+        try:
+            self.write_transaction(migrate)
+        except sqlite3.OperationalError as err:
+            if 'locked' in str(err):
+                raise
+            # Malformed Database
+            raise ValueError(err)
+
+
+    @staticmethod
+    def _is_legacy(cursor: sqlite3.Cursor) -> bool:
+        """Checks whether the database was created by a version before the schema versioning, which has no user_version."""
+        cursor.execute("PRAGMA user_version")
+        if cursor.fetchone()[0]:
+            return False
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'Testbenches'")
+        return cursor.fetchone() is not None
+
+
+    @classmethod
+    def requires_migration(cls, databaseFile: str) -> bool:
+        """Checks whether the database can only be opened with allow_migration, without modifying the file."""
+        try:
+            connection = sqlite3.connect(Path(os.path.abspath(databaseFile)).as_uri() + '?mode=ro', uri=True)
+        except sqlite3.Error:
+            return False    # Missing file, a new database is created
+        try:
+            return cls._is_legacy(connection.cursor())
+        except sqlite3.Error:
+            return False    # Not a database
+        finally:
+            connection.close()
+
+
+    def create_history_tables(self) -> None:
+        """Creates the append-only table "LockEvents", the daily rollup "LockUsage" used by the compaction, and the trigger
+        logging every change of a lock holder in the same transaction as the change, regardless of the client version.
+        Expired leases are logged as released at the end of the lease.
+        """
+        self.cursor.execute("""CREATE TABLE IF NOT EXISTS LockEvents (
+            Name VARCHAR(255) NOT NULL,
+            Event CHAR(16) NOT NULL,
+            User CHAR(255) NOT NULL,
+            Time INTEGER NOT NULL)
+        """)
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS LockEvents_Name_Time ON LockEvents (Name, Time)")
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS LockEvents_Time ON LockEvents (Time)")
+
+        self.cursor.execute("""CREATE TABLE IF NOT EXISTS LockUsage (
+            Name VARCHAR(255) NOT NULL,
+            User CHAR(255) NOT NULL,
+            Day INTEGER NOT NULL,
+            Held_Seconds INTEGER NOT NULL,
+            Acquisitions INTEGER NOT NULL,
+            PRIMARY KEY (Name, User, Day))
+        """)
+
+        self.cursor.execute("""CREATE TRIGGER IF NOT EXISTS Testbenches_LockEvents AFTER UPDATE OF Locked_By ON Testbenches
+            WHEN IFNULL(OLD.Locked_By, '') IS NOT IFNULL(NEW.Locked_By, '')
+            BEGIN
+                INSERT INTO LockEvents (Name, Event, User, Time)
+                    SELECT NEW.Name, 'release', OLD.Locked_By, MIN(NEW.Locked_Since, IFNULL(OLD.Lease_Until, NEW.Locked_Since))
+                    WHERE IFNULL(OLD.Locked_By, '') != '';
+                INSERT INTO LockEvents (Name, Event, User, Time)
+                    SELECT NEW.Name, 'acquire', NEW.Locked_By, NEW.Locked_Since
+                    WHERE IFNULL(NEW.Locked_By, '') != '';
+            END
+        """)
+
+
+    def create_queue_table(self) -> None:
+        """Creates the table "LockQueue" holding the FIFO wait queue of every testbench, ordered by the increasing position."""
+        self.cursor.execute("""CREATE TABLE IF NOT EXISTS LockQueue (
+            Position INTEGER PRIMARY KEY AUTOINCREMENT,
+            Name VARCHAR(255) NOT NULL,
+            User CHAR(255) NOT NULL,
+            Queued_Since INTEGER NOT NULL,
+            UNIQUE (Name, User))
+        """)
+
+
+    def create_reservation_table(self) -> None:
+        """Creates the table "Reservations" holding the time slots booked per testbench. The slots of a testbench never
+        overlap, so ordered by their end they are ordered by their start as well, and the index on (Name, Ends_At)
+        serves overlap checks and the next reservation with a single seek, regardless of the number of future slots.
+        """
+        self.cursor.execute("""CREATE TABLE IF NOT EXISTS Reservations (
+            Id INTEGER PRIMARY KEY AUTOINCREMENT,
+            Name VARCHAR(255) NOT NULL,
+            User CHAR(255) NOT NULL,
+            Starts_At INTEGER NOT NULL,
+            Ends_At INTEGER NOT NULL,
+            CHECK (Ends_At > Starts_At))
+        """)
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS Reservations_Name_End ON Reservations (Name, Ends_At)")
+
+
+    def _log_refused(self, hostnames: Tuple[str], lock_user: str, now: int) -> None:
+        """Logs refused lock requests, used to compute wait times. Must be called inside a write transaction."""
+        self.cursor.executemany("INSERT INTO LockEvents (Name, Event, User, Time) VALUES (?, 'refused', ?, ?)",
+                                ((hostname, lock_user, now) for hostname in hostnames))
+
+
+    @staticmethod
+    def epoch(when: datetime = None) -> int:
+        """Converts the time (defaults to now) to the integer epoch seconds stored in the database."""
+        return int((when or datetime.now()).timestamp())
+
+
+    @staticmethod
+    def from_epoch(value: Union[int, str, None]) -> datetime:
+        """Converts a timestamp of the database to a datetime. Tolerates TIMESTAMP text written by clients of versions
+        before the schema versioning which were still running when the database was migrated.
+        """
+        if value is None:
+            return None
+        if isinstance(value, str):
+            return datetime.fromisoformat(value)
+        return datetime.fromtimestamp(value)
+
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        """Connection of the calling thread: the writer inside write transactions, otherwise the read-only connection of the thread."""
+        return self.pool.connection()
+
+
+    @property
+    def cursor(self) -> sqlite3.Cursor:
+        """Cursor of the connection of the calling thread."""
+        return self.pool.cursor()
+
+
+    def clone(self) -> 'DatabaseController':
+        """Returns the controller itself, as it can be shared among threads. Kept for the interface of the BrokerClient,
+        whose connections cannot be shared.
+        """
+        return self
+
+
+    def close(self) -> None:
+        self.pool.close()
+
+
+    def subscribe(self, callback: Callable[[], None]) -> None:
+        """Push notifications are only provided by the LockBroker, changes of the database file are detected by polling has_changed()."""
+
+
+    def commit(self) -> None:
+        """Commits the current transaction of the writer."""
         self.connection.commit()
+
+
+    def has_changed(self) -> bool:
+        """Checks whether the database was modified since the last call of the calling thread, using PRAGMA data_version
+        of its read connection, which changes with every commit of another connection including the own writer.
+        This only reads the file header instead of the table.
+
+        Returns:
+            bool: True if the database was modified or this is the first call of the thread.
+        """
+        self.cursor.execute("PRAGMA data_version")
+        data_version = self.cursor.fetchone()[0]
+
+        changed = data_version != getattr(self._polled, 'data_version', None)
+        self._polled.data_version = data_version
+        return changed
         
         
     def add_testbench(self, hostname: str) -> None:
@@ -47,17 +309,53 @@ class DatabaseController():
         Raises:
             ValueError: Raised if the table "Testbenches" deviates from the required format.
         """
+        with self.pool.writer():
+            try:
+                self.cursor.execute("INSERT INTO Testbenches (Name, Locked_By, Locked_Since) VALUES (?, '', ?)", (hostname, self.epoch()))
+            except sqlite3.IntegrityError:
+                # Testbench already exists, release the write lock of the implicitly opened transaction
+                self.connection.rollback()
+                return
+            except sqlite3.OperationalError as err:
+                # Malformed Database
+                raise ValueError(err)
+
+            self.commit()
+        
+
+    def add_testbenches(self, hostnames: Tuple[str]) -> List[str]:
+        """Adds all specified testbenches which do not exist yet to the table "Testbenches" in a single transaction.
+
+        Args:
+            hostnames (Tuple[str]): Hostnames of the testbenches.
+
+        Raises:
+            ValueError: Raised if the table "Testbenches" deviates from the required format.
+
+        Returns:
+            List[str]: Hostnames of the newly created testbenches.
+        """
+        if not hostnames:
+            return []
+
+        def add() -> List[str]:
+            self.cursor.execute("SELECT Name FROM Testbenches")
+            existing = {row[0] for row in self.cursor.fetchall()}
+            created = [hostname for hostname in dict.fromkeys(hostnames) if hostname not in existing]
+
+            now = self.epoch()
+            self.cursor.executemany("INSERT OR IGNORE INTO Testbenches (Name, Locked_By, Locked_Since) VALUES (?, '', ?)",
+                                    ((hostname, now) for hostname in created))
+            return created
+
         try:
-            self.cursor.execute("INSERT INTO Testbenches VALUES (?, '', ?)", (hostname, datetime.now()))
-        except sqlite3.IntegrityError:
-            # Testbench already exists
-            return
+            return self.write_transaction(add)
         except sqlite3.OperationalError as err:
+            if 'locked' in str(err):
+                raise
             # Malformed Database
             raise ValueError(err)
         
-        self.connection.commit()
-        
 
     def get_lock(self, hostname: str) -> Tuple[str, datetime]:
         """_summary_
@@ -71,17 +369,18 @@ class DatabaseController():
         Returns:
             Tuple[str, datetime]: tuple of locked_by, locked_since
         """
-        self.cursor.execute("SELECT Locked_By, Locked_Since FROM Testbenches WHERE Name IS ?", (hostname,))
+        self.cursor.execute(f"SELECT {self.LOCK_COLUMNS} FROM Testbenches WHERE Name IS :hostname", {'now': self.epoch(), 'hostname': hostname})
         
         lockData = self.cursor.fetchone()
         if not lockData:
             raise ValueError(f'Testbench "{hostname}" not found in database "{self.dbFile}".')
         
-        return lockData
+        lock_user, lock_time = lockData
+        return (lock_user, self.from_epoch(lock_time))
     
     
     def get_lock_multiple(self, hostnames: Tuple[str] = ()) -> Dict[str, Tuple[str, datetime]]:
-        """Get Lock Data for multiple entries in the database.
+        """Get Lock Data for multiple entries in the database. Hosts with an expired lease are reported as free.
 
         Args:
             hostnames (List[str], optional): List of hostnames. Defaults to [], meaning all hosts found in the database.
@@ -93,16 +392,19 @@ class DatabaseController():
             dict[str, Tuple[str, datetime]]: dictionary linking hostnames to a tuple of locked_by, locked_since
         """
         
-        query = "SELECT Name, Locked_By, Locked_Since FROM Testbenches"
+        parameters = {f'h{i}': hostname for i, hostname in enumerate(hostnames)}
+        parameters['now'] = self.epoch()
+
+        query = f"SELECT Name, {self.LOCK_COLUMNS} FROM Testbenches"
         if hostnames:
-            query += " WHERE Name IN ({0})".format(", ".join('?' for _ in hostnames))
+            query += " WHERE Name IN ({0})".format(", ".join(f':h{i}' for i in range(len(hostnames))))
 
-        self.cursor.execute(query, hostnames)
+        self.cursor.execute(query, parameters)
         lockData = self.cursor.fetchall()
         
         lockDict = {}
         for hostname, lock_user, lock_time in lockData:
-            lockDict[hostname] = (lock_user, lock_time)
+            lockDict[hostname] = (lock_user, self.from_epoch(lock_time))
         
         missingdata = set(hostnames) - set(lockDict.keys())
         if missingdata:
@@ -112,12 +414,566 @@ class DatabaseController():
     
     
     def set_lock(self, hostname: str, lock_user: str) -> None:
-        """Sets a lock in the database for the specified host.
+        """Sets a lock in the database for the specified host. Removing the lock hands the host over to the first user of its queue.
 
         Args:
             hostname (str): hostname of the computer
             lockedBy (str): name of the user assigned to the lock
         """
-        self.cursor.execute("UPDATE Testbenches SET Locked_By = ?, Locked_Since = ? WHERE Name IS ?", (lock_user, datetime.now(), hostname))
-        self.connection.commit()
-        
\ No newline at end of file
+        now = self.epoch()
+
+        def set_lock() -> None:
+            self.cursor.execute("UPDATE Testbenches SET Locked_By = ?, Locked_Since = ?, Lease_Until = NULL WHERE Name IS ?", (lock_user, now, hostname))
+            self._hand_over((hostname,), now)
+
+        self.write_transaction(set_lock)
+
+
+    def unset_locks(self, expected: Dict[str, str]) -> List[str]:
+        """Removes the locks of all specified hosts whose holder is still the expected one in a single transaction,
+        so locks taken by other users meanwhile are kept. Removed locks are handed over to the first user of their queue.
+
+        Args:
+            expected (Dict[str, str]): dictionary linking the hostnames to the expected holder, '' for free hosts
+
+        Raises:
+            ValueError: Raised if any specified hostname is not found in the database
+
+        Returns:
+            List[str]: hostnames whose holder changed and whose lock was kept
+        """
+        if not expected:
+            return []
+
+        now = self.epoch()
+        parameters = {f'h{i}': hostname for i, hostname in enumerate(expected)}
+        parameters['now'] = now
+        names = ", ".join(f':h{i}' for i in range(len(expected)))
+
+        def unset() -> List[str]:
+            # The write lock is held from the start of the transaction, so the holders cannot change between check and update
+            self.cursor.execute(f"SELECT Name, {self.LOCK_COLUMNS} FROM Testbenches WHERE Name IN ({names})", parameters)
+            holders = {hostname: lock_by or '' for hostname, lock_by, _ in self.cursor.fetchall()}
+
+            missingdata = set(expected) - set(holders)
+            if missingdata:
+                raise ValueError(f'Testbench(es) "{list(missingdata)}" not found in database "{self.dbFile}".')
+
+            unset = tuple(hostname for hostname, lock_user in expected.items() if holders[hostname] == lock_user)
+            self.cursor.executemany("UPDATE Testbenches SET Locked_By = '', Locked_Since = ?, Lease_Until = NULL WHERE Name IS ?",
+                                    ((now, hostname) for hostname in unset))
+            self._hand_over(unset, now)
+            return [hostname for hostname in expected if hostname not in unset]
+
+        return self.write_transaction(unset)
+
+
+    def try_acquire(self, hostname: str, lock_user: str, lease: float = None) -> Tuple[bool, str, datetime]:
+        """Locks the specified host for the user if it is free, its lease expired or it is already locked by the same user.
+        The check and the update are done by a single conditional statement inside an immediate transaction,
+        so concurrent clients cannot both acquire the lock. Users waiting in the queue of a free host take precedence,
+        and hosts reserved by another user at the moment are not locked.
+
+        Args:
+            hostname (str): hostname of the computer
+            lock_user (str): name of the user requesting the lock
+            lease (float, optional): Lease time in seconds after which the lock expires unless renewed. Defaults to None, meaning no expiry.
+
+        Raises:
+            ValueError: Raised if the specified hostname is not found in the database
+
+        Returns:
+            Tuple[bool, str, datetime]: tuple of success, locked_by, locked_since after the operation
+        """
+        now = self.epoch()
+
+        def acquire() -> Tuple[str, int]:
+            lockData = self._acquire(hostname, lock_user, now, lease)
+            if lockData and lockData[0] != lock_user:
+                self._log_refused((hostname,), lock_user, now)
+            return lockData
+
+        lockData = self.write_transaction(acquire)
+        if not lockData:
+            raise ValueError(f'Testbench "{hostname}" not found in database "{self.dbFile}".')
+
+        lock_by, lock_time = lockData
+        return (lock_by == lock_user, lock_by, self.from_epoch(lock_time))
+
+
+    def try_acquire_multiple(self, hostnames: Tuple[str], lock_user: str, lease: float = None) -> Tuple[bool, Dict[str, Tuple[str, datetime]]]:
+        """Locks all specified hosts for the user in a single transaction, or none of them if any is held or reserved by another user.
+
+        Args:
+            hostnames (Tuple[str]): hostnames of the computers
+            lock_user (str): name of the user requesting the locks
+            lease (float, optional): Lease time in seconds after which the locks expire unless renewed. Defaults to None, meaning no expiry.
+
+        Raises:
+            ValueError: Raised if any specified hostname is not found in the database
+
+        Returns:
+            Tuple[bool, Dict[str, Tuple[str, datetime]]]: tuple of success and a dictionary linking the hostnames to a tuple of locked_by, locked_since after the operation
+        """
+        if not hostnames:
+            return (True, {})
+
+        now = self.epoch()
+        parameters = {f'h{i}': hostname for i, hostname in enumerate(hostnames)}
+        parameters.update({'now': now, 'user': lock_user, 'lease': now + math.ceil(lease) if lease is not None else None})
+        names = ", ".join(f':h{i}' for i in range(len(hostnames)))
+
+        def acquire() -> Tuple[bool, Dict[str, Tuple[str, datetime]]]:
+            # The write lock is held from the start of the transaction, so the holders cannot change between check and update
+            self._hand_over(hostnames, now)
+            self.cursor.execute(f"SELECT Name, {self.LOCK_COLUMNS} FROM Testbenches WHERE Name IN ({names})", parameters)
+            lockDict = {hostname: (lock_by, lock_time) for hostname, lock_by, lock_time in self.cursor.fetchall()}
+
+            missingdata = set(hostnames) - set(lockDict.keys())
+            if missingdata:
+                raise ValueError(f'Testbench(es) "{list(missingdata)}" not found in database "{self.dbFile}".')
+
+            self.cursor.execute(f"SELECT Name FROM Testbenches WHERE Name IN ({names}) AND {self.RESERVED.format(user=':user')}", parameters)
+            reserved = {row[0] for row in self.cursor.fetchall()}
+            blocked = tuple(hostname for hostname, (lock_by, _) in lockDict.items() if lock_by not in ('', None, lock_user) or hostname in reserved)
+            if blocked:
+                self._log_refused(blocked, lock_user, now)
+                return (False, lockDict)
+
+            self.cursor.execute(f"""UPDATE Testbenches SET
+                Locked_Since = CASE WHEN IFNULL(Locked_By, '') = '' OR Lease_Until < :now THEN :now ELSE Locked_Since END,
+                Lease_Until  = :lease,
+                Locked_By    = :user
+                WHERE Name IN ({names})
+                RETURNING Name, Locked_By, Locked_Since
+            """, parameters)
+            return (True, {hostname: (lock_by, lock_time) for hostname, lock_by, lock_time in self.cursor.fetchall()})
+
+        success, lockDict = self.write_transaction(acquire)
+        return (success, {hostname: (lock_by, self.from_epoch(lock_time)) for hostname, (lock_by, lock_time) in lockDict.items()})
+
+
+    def try_acquire_any(self, hostnames: Tuple[str], lock_user: str, lease: float = None) -> Tuple[str, datetime]:
+        """Locks one free host of the pool for the user with a single conditional statement. Hosts already locked by the user
+        are not reused, so parallel jobs of the same user get different hosts. The host which is free for the longest time is chosen,
+        hosts reserved by another user at the moment are skipped.
+
+        Args:
+            hostnames (Tuple[str]): hostnames of the computers in the pool
+            lock_user (str): name of the user requesting the lock
+            lease (float, optional): Lease time in seconds after which the lock expires unless renewed. Defaults to None, meaning no expiry.
+
+        Raises:
+            ValueError: Raised if any specified hostname is not found in the database
+
+        Returns:
+            Tuple[str, datetime]: tuple of the hostname and locked_since of the acquired host, or ('', None) if all hosts are locked
+        """
+        if not hostnames:
+            return ('', None)
+
+        now = self.epoch()
+        parameters = {f'h{i}': hostname for i, hostname in enumerate(hostnames)}
+        parameters.update({'now': now, 'user': lock_user, 'lease': now + math.ceil(lease) if lease is not None else None})
+        names = ", ".join(f':h{i}' for i in range(len(hostnames)))
+
+        def acquire() -> Tuple[str, int]:
+            self._hand_over(hostnames, now)
+            self.cursor.execute(f"""UPDATE Testbenches SET Locked_By = :user, Locked_Since = :now, Lease_Until = :lease
+                WHERE Name = (SELECT Name FROM Testbenches WHERE Name IN ({names})
+                    AND (IFNULL(Locked_By, '') = '' OR Lease_Until < :now) AND NOT {self.RESERVED.format(user=':user')}
+                    ORDER BY CASE WHEN Lease_Until < :now THEN Lease_Until ELSE Locked_Since END LIMIT 1)
+                RETURNING Name, Locked_Since
+            """, parameters)
+            lockData = self.cursor.fetchone()
+            if lockData:
+                return lockData
+
+            self.cursor.execute(f"SELECT Name FROM Testbenches WHERE Name IN ({names})", parameters)
+            missingdata = set(hostnames) - {row[0] for row in self.cursor.fetchall()}
+            if missingdata:
+                raise ValueError(f'Testbench(es) "{list(missingdata)}" not found in database "{self.dbFile}".')
+            return ('', None)
+
+        hostname, lock_time = self.write_transaction(acquire)
+        return (hostname, self.from_epoch(lock_time))
+
+
+    def release(self, hostname: str, lock_user: str) -> Tuple[bool, str, datetime]:
+        """Removes the lock of the specified host if it is held by the user. Releasing a free host succeeds.
+        The released host is handed over to the first user of its queue in the same transaction.
+
+        Args:
+            hostname (str): hostname of the computer
+            lock_user (str): name of the user holding the lock
+
+        Raises:
+            ValueError: Raised if the specified hostname is not found in the database
+
+        Returns:
+            Tuple[bool, str, datetime]: tuple of success, locked_by, locked_since after the operation
+        """
+        now = self.epoch()
+        query = """UPDATE Testbenches SET
+            Locked_Since = CASE WHEN Locked_By = :user OR Lease_Until < :now THEN :now ELSE Locked_Since END,
+            Lease_Until  = CASE WHEN Locked_By = :user OR Lease_Until < :now THEN NULL ELSE Lease_Until END,
+            Locked_By    = CASE WHEN Locked_By = :user OR Lease_Until < :now THEN '' ELSE Locked_By END
+            WHERE Name IS :hostname
+            RETURNING Locked_By, Locked_Since
+        """
+        parameters = {'now': now, 'user': lock_user, 'hostname': hostname}
+
+        def release() -> Tuple[bool, str, int]:
+            self.cursor.execute(query, parameters)
+            lockData = self.cursor.fetchone()
+            if not lockData:
+                return None
+            released = not lockData[0]
+            if released:
+                lockData = self._hand_over((hostname,), now).get(hostname, lockData)
+            return (released,) + tuple(lockData)
+
+        lockData = self.write_transaction(release)
+        if not lockData:
+            raise ValueError(f'Testbench "{hostname}" not found in database "{self.dbFile}".')
+
+        released, lock_by, lock_time = lockData
+        return (released, lock_by, self.from_epoch(lock_time))
+
+
+    def release_multiple(self, hostnames: Tuple[str], lock_user: str) -> Dict[str, Tuple[str, datetime]]:
+        """Removes the locks of all specified hosts held by the user in a single transaction.
+        Released hosts are handed over to the first user of their queue.
+
+        Args:
+            hostnames (Tuple[str]): hostnames of the computers
+            lock_user (str): name of the user holding the locks
+
+        Returns:
+            Dict[str, Tuple[str, datetime]]: dictionary linking the hostnames to a tuple of locked_by, locked_since after the operation
+        """
+        if not hostnames:
+            return {}
+
+        parameters = {f'h{i}': hostname for i, hostname in enumerate(hostnames)}
+        now = self.epoch()
+        parameters.update({'user': lock_user, 'now': now})
+        query = """UPDATE Testbenches SET
+            Locked_Since = CASE WHEN Locked_By = :user OR Lease_Until < :now THEN :now ELSE Locked_Since END,
+            Lease_Until  = CASE WHEN Locked_By = :user OR Lease_Until < :now THEN NULL ELSE Lease_Until END,
+            Locked_By    = CASE WHEN Locked_By = :user OR Lease_Until < :now THEN '' ELSE Locked_By END
+            WHERE Name IN ({0})
+            RETURNING Name, Locked_By, Locked_Since
+        """.format(", ".join(f':h{i}' for i in range(len(hostnames))))
+
+        def release() -> Dict[str, Tuple[str, int]]:
+            self.cursor.execute(query, parameters)
+            lockDict = {hostname: (lock_by, lock_time) for hostname, lock_by, lock_time in self.cursor.fetchall()}
+            lockDict.update(self._hand_over(tuple(hostname for hostname, (lock_by, _) in lockDict.items() if not lock_by), now))
+            return lockDict
+
+        lockDict = self.write_transaction(release)
+        return {hostname: (lock_by, self.from_epoch(lock_time)) for hostname, (lock_by, lock_time) in lockDict.items()}
+
+
+    def renew_leases(self, hostnames: Tuple[str], lock_user: str, lease: float) -> List[str]:
+        """Extends the leases of all specified hosts still locked by the user with a single statement.
+        Expired leases are not renewed, as other users may have seen the testbench free and locked it meanwhile.
+
+        Args:
+            hostnames (Tuple[str]): hostnames of the computers
+            lock_user (str): name of the user holding the locks
+            lease (float): Lease time in seconds from now
+
+        Returns:
+            List[str]: hostnames whose lease was renewed, the others are no longer locked by the user
+        """
+        if not hostnames:
+            return []
+
+        now = self.epoch()
+        parameters = {f'h{i}': hostname for i, hostname in enumerate(hostnames)}
+        parameters.update({'user': lock_user, 'now': now, 'lease': now + math.ceil(lease)})
+        query = """UPDATE Testbenches SET Lease_Until = :lease
+            WHERE Locked_By = :user AND Lease_Until IS NOT NULL AND Lease_Until >= :now AND Name IN ({0})
+            RETURNING Name
+        """.format(", ".join(f':h{i}' for i in range(len(hostnames))))
+
+        def renew() -> List[str]:
+            self.cursor.execute(query, parameters)
+            return [row[0] for row in self.cursor.fetchall()]
+
+        return self.write_transaction(renew)
+
+
+    def enqueue(self, hostname: str, lock_user: str) -> Tuple[int, str, datetime]:
+        """Locks the specified host for the user if possible, otherwise appends the user to the wait queue of the host.
+        Once the holder releases the lock, it is handed over to the first user of the queue.
+
+        Args:
+            hostname (str): hostname of the computer
+            lock_user (str): name of the user requesting the lock
+
+        Raises:
+            ValueError: Raised if the specified hostname is not found in the database
+
+        Returns:
+            Tuple[int, str, datetime]: tuple of the position in the queue (0 if the lock was acquired), locked_by, locked_since
+        """
+        now = self.epoch()
+
+        def enqueue() -> Tuple[int, str, int]:
+            lockData = self._acquire(hostname, lock_user, now, None)
+            if not lockData or lockData[0] == lock_user:
+                return (0,) + tuple(lockData) if lockData else None
+
+            self.cursor.execute("INSERT OR IGNORE INTO LockQueue (Name, User, Queued_Since) VALUES (?, ?, ?)", (hostname, lock_user, now))
+            if self.cursor.rowcount:
+                self._log_refused((hostname,), lock_user, now)
+
+            self.cursor.execute("""SELECT COUNT(*) FROM LockQueue WHERE Name = :hostname
+                AND Position <= (SELECT Position FROM LockQueue WHERE Name = :hostname AND User = :user)
+            """, {'hostname': hostname, 'user': lock_user})
+            return (self.cursor.fetchone()[0],) + tuple(lockData)
+
+        queueData = self.write_transaction(enqueue)
+        if not queueData:
+            raise ValueError(f'Testbench "{hostname}" not found in database "{self.dbFile}".')
+
+        position, lock_by, lock_time = queueData
+        return (position, lock_by, self.from_epoch(lock_time))
+
+
+    def dequeue(self, hostname: str, lock_user: str) -> bool:
+        """Removes the user from the wait queue of the specified host.
+
+        Returns:
+            bool: True if the user was waiting for the host.
+        """
+        def dequeue() -> bool:
+            self.cursor.execute("DELETE FROM LockQueue WHERE Name = ? AND User = ?", (hostname, lock_user))
+            return self.cursor.rowcount > 0
+
+        return self.write_transaction(dequeue)
+
+
+    def get_queue_multiple(self, hostnames: Tuple[str] = ()) -> Dict[str, List[str]]:
+        """Get the wait queues of multiple hosts.
+
+        Args:
+            hostnames (Tuple[str], optional): hostnames of the computers. Defaults to (), meaning all hosts found in the database.
+
+        Returns:
+            Dict[str, List[str]]: dictionary linking the hostnames with waiting users to the users in queue order
+        """
+        parameters = {f'h{i}': hostname for i, hostname in enumerate(hostnames)}
+        query = "SELECT Name, User FROM LockQueue"
+        if hostnames:
+            query += " WHERE Name IN ({0})".format(", ".join(f':h{i}' for i in range(len(hostnames))))
+        self.cursor.execute(query + " ORDER BY Position", parameters)
+
+        queueDict: Dict[str, List[str]] = {}
+        for hostname, lock_user in self.cursor.fetchall():
+            queueDict.setdefault(hostname, []).append(lock_user)
+        return queueDict
+
+
+    def hand_over(self, hostnames: Tuple[str]) -> Dict[str, Tuple[str, datetime]]:
+        """Hands free hosts and hosts with an expired lease over to the first user of their queue.
+        Releases hand over immediately, this completes the hand over of expired leases.
+
+        Returns:
+            Dict[str, Tuple[str, datetime]]: dictionary linking the hosts handed over to a tuple of locked_by, locked_since
+        """
+        now = self.epoch()
+        lockDict = self.write_transaction(lambda: self._hand_over(hostnames, now))
+        return {hostname: (lock_by, self.from_epoch(lock_time)) for hostname, (lock_by, lock_time) in lockDict.items()}
+
+
+    def reserve(self, hostname: str, lock_user: str, start: datetime, end: datetime) -> Tuple[bool, Reservation]:
+        """Reserves the host for the user from start until end, unless the time slot overlaps another reservation of the host.
+        As the reservations of a host do not overlap, the first one ending after the start is the only candidate for an overlap.
+
+        Args:
+            hostname (str): hostname of the computer
+            lock_user (str): name of the user reserving the host
+            start (datetime): start of the time slot
+            end (datetime): end of the time slot, exclusive
+
+        Raises:
+            ValueError: Raised if the specified hostname is not found in the database, or the time slot is empty or in the past
+
+        Returns:
+            Tuple[bool, Reservation]: tuple of success and the new reservation, or the overlapping reservation
+        """
+        starts_at, ends_at = self.epoch(start), self.epoch(end)
+        if ends_at <= starts_at:
+            raise ValueError(f'Reservation of "{hostname}" must end after its start.')
+        if ends_at <= self.epoch():
+            raise ValueError(f'Reservation of "{hostname}" must end in the future.')
+
+        def reserve() -> Tuple[bool, tuple]:
+            self.cursor.execute("SELECT 1 FROM Testbenches WHERE Name IS ?", (hostname,))
+            if not self.cursor.fetchone():
+                return None
+
+            self.cursor.execute("""SELECT Id, User, Starts_At, Ends_At FROM Reservations
+                WHERE Name = ? AND Ends_At > ? ORDER BY Ends_At LIMIT 1
+            """, (hostname, starts_at))
+            overlapping = self.cursor.fetchone()
+            if overlapping and overlapping[2] < ends_at:
+                return (False, overlapping)
+
+            self.cursor.execute("""INSERT INTO Reservations (Name, User, Starts_At, Ends_At) VALUES (?, ?, ?, ?)
+                RETURNING Id, User, Starts_At, Ends_At
+            """, (hostname, lock_user, starts_at, ends_at))
+            return (True, self.cursor.fetchone())
+
+        result = self.write_transaction(reserve)
+        if result is None:
+            raise ValueError(f'Testbench "{hostname}" not found in database "{self.dbFile}".')
+
+        success, reservation = result
+        return (success, self._reservation(reservation))
+
+
+    def cancel_reservation(self, id: int, lock_user: str) -> bool:
+        """Removes the reservation if it belongs to the user.
+
+        Returns:
+            bool: True if the reservation was removed.
+        """
+        def cancel() -> bool:
+            self.cursor.execute("DELETE FROM Reservations WHERE Id = ? AND User = ?", (id, lock_user))
+            return self.cursor.rowcount > 0
+
+        return self.write_transaction(cancel)
+
+
+    def get_reservations(self, hostname: str, start: datetime = None, end: datetime = None) -> List[Reservation]:
+        """Get the reservations of the host overlapping the time span, ordered by their start.
+
+        Args:
+            hostname (str): hostname of the computer
+            start (datetime, optional): Start of the time span. Defaults to None, meaning now.
+            end (datetime, optional): End of the time span. Defaults to None, meaning all future reservations.
+
+        Returns:
+            List[Reservation]: reservations overlapping the time span
+        """
+        parameters = {'hostname': hostname, 'start': self.epoch(start), 'end': self.epoch(end) if end is not None else None}
+        self.cursor.execute("""SELECT Id, User, Starts_At, Ends_At FROM Reservations
+            WHERE Name = :hostname AND Ends_At > :start AND (:end IS NULL OR Starts_At < :end) ORDER BY Ends_At
+        """, parameters)
+        return [self._reservation(reservation) for reservation in self.cursor.fetchall()]
+
+
+    def get_next_reservations(self, hostnames: Tuple[str] = ()) -> Dict[str, Reservation]:
+        """Get the current or next reservation of multiple hosts, using one index seek per host.
+
+        Args:
+            hostnames (Tuple[str], optional): hostnames of the computers. Defaults to (), meaning all hosts found in the database.
+
+        Returns:
+            Dict[str, Reservation]: dictionary linking the hostnames with reservations to their current or next reservation
+        """
+        parameters = {f'h{i}': hostname for i, hostname in enumerate(hostnames)}
+        parameters['now'] = self.epoch()
+        query = """SELECT Testbenches.Name, Id, User, Starts_At, Ends_At FROM Testbenches
+            JOIN Reservations ON Id = (SELECT Id FROM Reservations WHERE Reservations.Name = Testbenches.Name AND Ends_At > :now ORDER BY Ends_At LIMIT 1)
+        """
+        if hostnames:
+            query += " WHERE Testbenches.Name IN ({0})".format(", ".join(f':h{i}' for i in range(len(hostnames))))
+        self.cursor.execute(query, parameters)
+        return {hostname: self._reservation(reservation) for hostname, *reservation in self.cursor.fetchall()}
+
+
+    @classmethod
+    def _reservation(cls, row: tuple) -> Reservation:
+        id, lock_user, starts_at, ends_at = row
+        return (id, lock_user, cls.from_epoch(starts_at), cls.from_epoch(ends_at))
+
+
+    def _acquire(self, hostname: str, lock_user: str, now: int, lease: float) -> Tuple[str, int]:
+        """Hands the host over to its queue if it is free, then locks it for the user with a single conditional statement,
+        unless it is reserved by another user at the moment. Must be called inside a write transaction.
+
+        Returns:
+            Tuple[str, int]: tuple of locked_by, locked_since after the operation or None if the host is not found
+        """
+        self._hand_over((hostname,), now)
+        free = f"(IFNULL(Locked_By, '') = '' OR Lease_Until < :now) AND NOT {self.RESERVED.format(user=':user')}"
+        self.cursor.execute(f"""UPDATE Testbenches SET
+            Locked_Since = CASE WHEN {free} THEN :now ELSE Locked_Since END,
+            Lease_Until  = CASE WHEN IFNULL(Locked_By, '') = :user OR {free} THEN :lease ELSE Lease_Until END,
+            Locked_By    = CASE WHEN {free} THEN :user ELSE Locked_By END
+            WHERE Name IS :hostname
+            RETURNING Locked_By, Locked_Since
+        """, {'now': now, 'user': lock_user, 'hostname': hostname, 'lease': now + math.ceil(lease) if lease is not None else None})
+        return self.cursor.fetchone()
+
+
+    def _hand_over(self, hostnames: Tuple[str], now: int) -> Dict[str, Tuple[str, int]]:
+        """Locks all specified hosts which are free or whose lease expired for the first user of their queue,
+        and removes these users from the queues. Hosts reserved by another user are handed over once the reservation ended.
+        The locks are leased for HANDOVER_LEASE, so a host is passed on to the next user if the new holder is not running a client.
+        Must be called inside a write transaction.
+
+        Returns:
+            Dict[str, Tuple[str, int]]: dictionary linking the hosts handed over to a tuple of locked_by, locked_since
+        """
+        if not hostnames:
+            return {}
+
+        parameters = {f'h{i}': hostname for i, hostname in enumerate(hostnames)}
+        parameters.update({'now': now, 'lease': now + self.HANDOVER_LEASE})
+        first = "(SELECT User FROM LockQueue WHERE LockQueue.Name = Testbenches.Name ORDER BY Position LIMIT 1)"
+        self.cursor.execute("""UPDATE Testbenches SET
+            Locked_By    = {0},
+            Locked_Since = :now,
+            Lease_Until  = :lease
+            WHERE (IFNULL(Locked_By, '') = '' OR Lease_Until < :now) AND NOT {1}
+                AND Name IN (SELECT Name FROM LockQueue) AND Name IN ({2})
+            RETURNING Name, Locked_By, Locked_Since
+        """.format(first, self.RESERVED.format(user=first), ", ".join(f':h{i}' for i in range(len(hostnames)))), parameters)
+        lockDict = {hostname: (lock_by, lock_time) for hostname, lock_by, lock_time in self.cursor.fetchall()}
+
+        self.cursor.executemany("DELETE FROM LockQueue WHERE Name = ? AND User = ?", ((hostname, lock_by) for hostname, (lock_by, _) in lockDict.items()))
+        return lockDict
+
+
+    def write_transaction(self, operation: Callable[[], T]) -> T:
+        """Runs the operation inside a BEGIN IMMEDIATE transaction, which takes the write lock up front instead of
+        failing on the first write. Retries with exponential backoff if the database stays locked longer than the busy timeout.
+        Transactions of all threads are serialized on the writer connection, which the operation accesses through cursor.
+
+        Args:
+            operation (Callable[[], T]): Function executing the statements of the transaction.
+
+        Raises:
+            sqlite3.OperationalError: Raised if the database is still locked after all retries.
+
+        Returns:
+            T: Return value of the operation.
+        """
+        with self.pool.writer():
+            delay = self.profile.busy_backoff
+            for attempt in range(self.profile.busy_retries + 1):
+                try:
+                    self.cursor.execute("BEGIN IMMEDIATE")
+                    result = operation()
+                    self.commit()
+                    return result
+                except sqlite3.OperationalError as err:
+                    if self.connection.in_transaction:
+                        self.connection.rollback()
+                    if 'locked' not in str(err) or attempt == self.profile.busy_retries:
+                        raise
+                except BaseException:
+                    if self.connection.in_transaction:
+                        self.connection.rollback()
+                    raise
+
+                metrics.count('database.busy_retries')
+                time.sleep(delay)
+                delay *= 2
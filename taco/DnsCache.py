@@ -0,0 +1,62 @@
+import time
+import socket
+import threading
+from typing import Dict, Tuple
+
+from taco.Metrics import metrics
+
+
+class DnsCache():
+    TTL             = 300   # Time in seconds a resolved address is reused
+    NEGATIVE_TTL    = 30    # Time in seconds a failed lookup is reused, so unknown hosts do not block every caller
+
+    def __init__(self, ttl: float = TTL, negative_ttl: float = NEGATIVE_TTL) -> None:
+        """Thread-safe cache of resolved IPv4 addresses with a time to live.
+
+        Args:
+            ttl (float, optional): Time in seconds a resolved address is reused. Defaults to TTL.
+            negative_ttl (float, optional): Time in seconds a failed lookup is reused. Defaults to NEGATIVE_TTL.
+        """
+        self.ttl            = ttl
+        self.negative_ttl   = negative_ttl
+
+        self._entries: Dict[str, Tuple[str, float]] = {}   # Address ('' if unresolved) and expiry per hostname
+        self._lock          = threading.Lock()
+
+
+    def resolve(self, hostname: str, refresh: bool = False) -> str:
+        """Returns the address of the host, looking it up only if the cached entry expired.
+
+        Args:
+            hostname (str): Hostname to resolve.
+            refresh (bool, optional): Ignores the cached entry. Defaults to False.
+
+        Returns:
+            str: IPv4 address of the host or '' if it cannot be resolved.
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(hostname)
+        if entry is not None and entry[1] > now and not refresh:
+            metrics.count('dns.cache_hits')
+            return entry[0]
+
+        # Resolve outside the lock, so lookups of different hosts run in parallel
+        try:
+            with metrics.time('dns.lookup'):
+                address = socket.gethostbyname(hostname)
+        except (socket.gaierror, UnicodeError):
+            address = ''
+
+        with self._lock:
+            self._entries[hostname] = (address, now + (self.ttl if address else self.negative_ttl))
+        return address
+
+
+    def invalidate(self, hostname: str = None) -> None:
+        """Removes the entry of the host, or all entries if no hostname is given."""
+        with self._lock:
+            if hostname is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(hostname, None)
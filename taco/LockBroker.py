@@ -0,0 +1,214 @@
+import json
+import time
+import asyncio
+import sqlite3
+import argparse
+import threading
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Tuple
+
+from taco.DatabaseController import DatabaseController, Reservation
+from taco.LockHistory import LockHistory
+from taco.ConnectionProfile import ConnectionProfile, PROFILES, DEFAULT_PROFILE
+
+
+DEFAULT_PORT = 47800
+
+
+def encode(value: Any) -> Any:
+    """Converts results of the DatabaseController to JSON, timestamps are sent as epoch seconds."""
+    if isinstance(value, datetime):
+        return DatabaseController.epoch(value)
+    if isinstance(value, (tuple, list)):
+        return [encode(item) for item in value]
+    if isinstance(value, dict):
+        return {key: encode(item) for key, item in value.items()}
+    return value
+
+
+class LockBroker():
+    POLL_TIMER      = 1.0   # Time between checks for changes made by clients accessing the database file directly
+    READ_WORKERS    = 4     # Threads serving read requests, each reading through its own connection
+    PUSH_QUEUE      = 64    # Pushes buffered per subscriber, subscribers falling further behind are disconnected
+
+    # Methods of the DatabaseController callable by clients, modifying methods trigger a push to all subscribers
+    READ_METHODS    = {'get_lock', 'get_lock_multiple', 'get_queue_multiple', 'get_reservations', 'get_next_reservations'}
+    WRITE_METHODS   = {'add_testbench', 'add_testbenches', 'set_lock', 'unset_locks', 'try_acquire', 'try_acquire_multiple', 'try_acquire_any', 'release', 'release_multiple', 'renew_leases',
+                       'enqueue', 'dequeue', 'hand_over', 'reserve', 'cancel_reservation'}
+    TIME_PARAMS     = {'start', 'end'}  # Parameters sent as epoch seconds
+
+    def __init__(self, databaseFile: str, profile: ConnectionProfile = None, host: str = '127.0.0.1', port: int = DEFAULT_PORT) -> None:
+        """Lock broker serving one database to multiple TACo clients over a newline delimited JSON socket protocol.
+        Write operations are serialized through a single worker thread, while reads are served concurrently by a pool
+        of reader threads, so polling clients do not queue behind lock writes. Lock changes are pushed to subscribed clients instead of being polled from the file.
+        Every subscriber is served by its own push task, so a slow client does not delay the pushes to the others.
+
+        Args:
+            databaseFile (str): Path to the database file.
+            profile (ConnectionProfile, optional): Connection profile of the database. Defaults to None.
+            host (str, optional): Address to listen on. Defaults to '127.0.0.1'.
+            port (int, optional): Port to listen on, 0 selects a free port. Defaults to DEFAULT_PORT.
+        """
+        self.databaseFile   = databaseFile
+        self.profile        = profile
+        self.host           = host
+        self.port           = port
+
+        self.database: DatabaseController = None
+        self.executor       = ThreadPoolExecutor(max_workers=1, thread_name_prefix='LockBroker')
+        self.readers        = ThreadPoolExecutor(max_workers=self.READ_WORKERS, thread_name_prefix='LockBrokerReader')
+        self.subscribers: Dict[asyncio.StreamWriter, Tuple['asyncio.Queue[bytes]', asyncio.Task]] = {}
+        self.snapshot: Dict[str, Tuple[str, datetime]] = {}
+        self.queues: Dict[str, List[str]] = {}
+        self.reservations: Dict[str, Reservation] = {}
+
+        self.ready          = threading.Event()     # Set once the server accepts connections
+        self._server: asyncio.AbstractServer = None
+
+
+    async def execute(self, function, *args, read: bool = False) -> Any:
+        """Runs the function in the writing worker thread, or in one of the reader threads if read is set."""
+        return await asyncio.get_running_loop().run_in_executor(self.readers if read else self.executor, function, *args)
+
+
+    async def call(self, method: str, params: Dict[str, Any]) -> Any:
+        if method not in self.READ_METHODS | self.WRITE_METHODS:
+            raise ValueError(f'Unknown method "{method}".')
+
+        # Lists are sent for tuples of hostnames
+        params = {key: tuple(value) if isinstance(value, list) else value for key, value in params.items()}
+        params.update({key: DatabaseController.from_epoch(params[key]) for key in self.TIME_PARAMS & params.keys()})
+        result = await self.execute(lambda: getattr(self.database, method)(**params), read=method in self.READ_METHODS)
+        if method in self.WRITE_METHODS:
+            await self.publish()
+        return result
+
+
+    async def publish(self) -> None:
+        """Pushes the lock data, wait queues and next reservations which changed since the last push to all subscribers."""
+        # Read by the writing worker, so snapshots are taken in the order of the writes
+        lockDict = await self.execute(self.database.get_lock_multiple)
+        queueDict = await self.execute(self.database.get_queue_multiple)
+        reservationDict = await self.execute(self.database.get_next_reservations)
+        changes = {hostname: lock for hostname, lock in lockDict.items() if self.snapshot.get(hostname) != lock}
+        queue_changes = {hostname: queueDict.get(hostname, []) for hostname in queueDict.keys() | self.queues.keys()
+                         if self.queues.get(hostname) != queueDict.get(hostname)}
+        reservation_changes = {hostname: reservationDict.get(hostname) for hostname in reservationDict.keys() | self.reservations.keys()
+                               if self.reservations.get(hostname) != reservationDict.get(hostname)}
+        self.snapshot, self.queues, self.reservations = lockDict, queueDict, reservationDict
+        if not changes and not queue_changes and not reservation_changes:
+            return
+
+        message = (json.dumps({'event': 'locks', 'locks': encode(changes), 'queues': queue_changes,
+                               'reservations': encode(reservation_changes)}) + '\n').encode()
+        for writer, (pushes, task) in list(self.subscribers.items()):
+            try:
+                pushes.put_nowait(message)
+            except asyncio.QueueFull:
+                task.cancel()   # Not reading its pushes, the client notices the closed connection
+
+
+    def subscribe(self, writer: asyncio.StreamWriter) -> None:
+        """Starts the task pushing the lock changes to the client."""
+        if writer not in self.subscribers:
+            pushes = asyncio.Queue(maxsize=self.PUSH_QUEUE)
+            self.subscribers[writer] = (pushes, asyncio.create_task(self.push(writer, pushes)))
+
+
+    def unsubscribe(self, writer: asyncio.StreamWriter) -> None:
+        _, task = self.subscribers.pop(writer, (None, None))
+        if task is not None:
+            task.cancel()
+
+
+    async def push(self, writer: asyncio.StreamWriter, pushes: 'asyncio.Queue[bytes]') -> None:
+        try:
+            while True:
+                writer.write(await pushes.get())
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self.subscribers.pop(writer, None)
+            writer.close()
+
+
+    async def watch(self) -> None:
+        """Detects changes of clients which access the database file directly, and compacts the lock history periodically."""
+        compacted = None
+        while True:
+            await asyncio.sleep(self.POLL_TIMER)
+            if await self.execute(self.database.has_changed):
+                await self.publish()
+
+            if compacted is None or time.monotonic() - compacted >= LockHistory.COMPACT_TIMER:
+                compacted = time.monotonic()
+                try:
+                    await self.execute(LockHistory(self.database).compact)
+                except sqlite3.Error:
+                    pass    # Retried with the next compaction
+
+
+    async def handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while line := await reader.readline():
+                request = json.loads(line)
+                response = {'id': request.get('id')}
+                try:
+                    if request['method'] == 'subscribe':
+                        self.subscribe(writer)
+                        response['result'] = None
+                    elif request['method'] == 'info':
+                        response['result'] = {'dbFile': self.database.dbFile, 'profile': self.database.profile.name}
+                    else:
+                        response['result'] = encode(await self.call(request['method'], request.get('params', {})))
+                except Exception as err:
+                    response['error'] = str(err)
+                    response['type'] = type(err).__name__
+
+                writer.write((json.dumps(response) + '\n').encode())
+                await writer.drain()
+        except (ConnectionError, json.JSONDecodeError):
+            pass
+        finally:
+            self.unsubscribe(writer)
+            writer.close()
+
+
+    async def serve(self) -> None:
+        """Opens the database and serves clients until cancelled."""
+        self.database = await self.execute(DatabaseController, self.databaseFile, self.profile)
+        self.snapshot = await self.execute(self.database.get_lock_multiple)
+        self.queues = await self.execute(self.database.get_queue_multiple)
+        self.reservations = await self.execute(self.database.get_next_reservations)
+
+        self._server = await asyncio.start_server(self.handle_client, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        self.ready.set()
+
+        async with self._server:
+            await asyncio.gather(self._server.serve_forever(), self.watch())
+
+
+    def run(self) -> None:
+        asyncio.run(self.serve())
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Lock broker serving a TACo database to multiple clients.')
+    parser.add_argument('database', help='Path to the database file')
+    parser.add_argument('--host', default='127.0.0.1', help='Address to listen on, 0.0.0.0 to serve clients of other machines')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help='Port to listen on')
+    parser.add_argument('--profile', choices=list(PROFILES), default=DEFAULT_PROFILE, help='Connection profile of the database')
+    args = parser.parse_args()
+
+    broker = LockBroker(args.database, ConnectionProfile.get(args.profile), args.host, args.port)
+    try:
+        broker.run()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,234 @@
+import os
+import time
+import random
+import getpass
+import logging
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, Iterable, Iterator, List, Tuple, Union
+
+from taco.DatabaseController import DatabaseController, Reservation
+from taco.LockHistory import LockHistory
+from taco.ConnectionProfile import ConnectionProfile, DEFAULT_PROFILE
+
+
+Pool = Union[str, Iterable[str]]    # A single hostname or the hostnames of interchangeable testbenches
+
+
+class LockClient():
+    LEASE_TIME      = 60    # Time after which locks expire unless renewed, so crashed jobs do not block testbenches
+    HEARTBEAT_TIMER = 20    # Time between two renewals of the leases held by a session
+    BACKOFF_START   = 0.5   # Initial delay in seconds while waiting for a free testbench
+    BACKOFF_MAX     = 15.0  # Upper bound of the delay, doubled after each attempt
+
+    def __init__(self, database: str = None, broker: str = None, username: str = None, profile: str = None) -> None:
+        """Headless access to the lock database for scripts and CI jobs. Unlike the TestbenchAccessController,
+        it neither reads nor writes the settings file, and does not need a login session.
+        Unset arguments are taken from the environment variables TACO_DATABASE, TACO_BROKER, TACO_USER and TACO_PROFILE.
+
+        Args:
+            database (str, optional): Path to the database file. Defaults to None.
+            broker (str, optional): Address "host:port" of a lock broker, used instead of the database file if reachable. Defaults to None.
+            username (str, optional): Name of the lock user. Defaults to the user running the process.
+            profile (str, optional): Connection profile of the database. Defaults to the DEFAULT_PROFILE.
+
+        Raises:
+            ValueError: Raised if neither a database nor a reachable broker is given, or the database is malformed.
+        """
+        self.username   = username or os.environ.get('TACO_USER') or getpass.getuser()
+        database        = database or os.environ.get('TACO_DATABASE', '')
+        broker          = broker or os.environ.get('TACO_BROKER', '')
+        profile         = profile or os.environ.get('TACO_PROFILE', DEFAULT_PROFILE)
+
+        self.database: DatabaseController = None
+        if broker:
+            from taco.BrokerClient import BrokerClient
+            try:
+                self.database = BrokerClient.from_address(broker)
+            except OSError:
+                pass    # Broker unavailable
+        if self.database is None:
+            if not database:
+                raise ValueError('No database selected, set TACO_DATABASE or pass the database file.')
+            self.database = DatabaseController(database, ConnectionProfile.get(profile))
+
+        self._changed = threading.Event()
+        self.database.subscribe(self._changed.set)     # Pushed changes of a broker end the backoff early
+
+
+    @staticmethod
+    def _pool(pool: Pool) -> Tuple[str]:
+        return (pool,) if isinstance(pool, str) else tuple(dict.fromkeys(pool))
+
+
+    @staticmethod
+    def _lease(lease: float) -> float:
+        """Lease times of 0 or below take locks which never expire, like None."""
+        return lease if lease is not None and lease > 0 else None
+
+
+    def try_acquire(self, pool: Pool, lease: float = LEASE_TIME) -> str:
+        """Locks one free testbench of the pool in a single round trip.
+
+        Returns:
+            str: Hostname of the acquired testbench, '' if all testbenches are locked.
+        """
+        return self.database.try_acquire_any(self._pool(pool), self.username, self._lease(lease))[0]
+
+
+    def acquire(self, pool: Pool, timeout: float = None, lease: float = LEASE_TIME) -> str:
+        """Waits until a testbench of the pool is free and locks it. Attempts are spaced by an exponential backoff with jitter,
+        so many waiting jobs do not hit the database at the same time.
+
+        Args:
+            pool (Pool): Hostname or hostnames of interchangeable testbenches.
+            timeout (float, optional): Time in seconds to wait. Defaults to None, meaning no limit.
+            lease (float, optional): Lease time in seconds, None or 0 for locks which never expire. Defaults to LEASE_TIME.
+
+        Raises:
+            TimeoutError: Raised if no testbench became free within the timeout.
+            ValueError: Raised if a hostname is not found in the database.
+
+        Returns:
+            str: Hostname of the acquired testbench.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        delay = self.BACKOFF_START
+        while True:
+            self._changed.clear()
+            try:
+                hostname = self.try_acquire(pool, lease)
+            except sqlite3.OperationalError as err:
+                if 'locked' not in str(err):
+                    raise
+                hostname = ''   # Database busy, retry with the next attempt
+            if hostname:
+                return hostname
+
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                raise TimeoutError(f'No testbench of {list(self._pool(pool))} became free within {timeout} s.')
+
+            wait = random.uniform(0.5, 1.0) * delay
+            self._changed.wait(wait if remaining is None else min(wait, remaining))
+            delay = min(delay * 2, self.BACKOFF_MAX)
+
+
+    def release(self, hostnames: Pool) -> Dict[str, Tuple[str, datetime]]:
+        """Removes the locks of the testbenches held by the user in one transaction.
+
+        Returns:
+            Dict[str, Tuple[str, datetime]]: dictionary linking the hostnames to a tuple of locked_by, locked_since after the operation
+        """
+        return self.database.release_multiple(self._pool(hostnames), self.username)
+
+
+    def renew(self, hostnames: Pool, lease: float = LEASE_TIME) -> List[str]:
+        """Extends the leases of the testbenches held by the user in one statement. Expired leases are not renewed.
+
+        Raises:
+            ValueError: Raised if the lease time is not positive.
+
+        Returns:
+            List[str]: Hostnames whose lease was renewed, the others are no longer locked by the user.
+        """
+        if self._lease(lease) is None:
+            raise ValueError(f'Invalid lease time {lease}, leases can only be renewed for a positive time.')
+        return self.database.renew_leases(self._pool(hostnames), self.username, lease)
+
+
+    def status(self, hostnames: Pool = ()) -> Dict[str, Tuple[str, datetime]]:
+        """Returns the lock data of the testbenches, all testbenches of the database if none are given."""
+        return self.database.get_lock_multiple(self._pool(hostnames))
+
+
+    def reserve(self, hostname: str, start: datetime, end: datetime) -> Tuple[bool, Reservation]:
+        """Books the testbench from start until end, unless the time slot overlaps another reservation.
+        While the reservation is active, other users cannot lock the testbench.
+
+        Raises:
+            ValueError: Raised if the hostname is not found in the database, or the time slot is empty or in the past.
+
+        Returns:
+            Tuple[bool, Reservation]: tuple of success and the new reservation, or the overlapping reservation
+        """
+        return self.database.reserve(hostname, self.username, start, end)
+
+
+    def cancel_reservation(self, id: int) -> bool:
+        """Removes a reservation of the user.
+
+        Returns:
+            bool: True if the reservation was removed.
+        """
+        return self.database.cancel_reservation(id, self.username)
+
+
+    def reservations(self, hostname: str, start: datetime = None, end: datetime = None) -> List[Reservation]:
+        """Returns the reservations of the testbench overlapping the time span, all future ones by default."""
+        return self.database.get_reservations(hostname, start, end)
+
+
+    def utilization(self, start: datetime, end: datetime = None) -> Dict[str, object]:
+        """Returns the utilization of the testbenches and users from the lock history, see LockHistory.get_utilization().
+
+        Raises:
+            ValueError: Raised if connected to a lock broker, which does not serve the lock history.
+        """
+        if not isinstance(self.database, DatabaseController):
+            raise ValueError('The lock history is only available with the database file, not through a lock broker.')
+        return LockHistory(self.database).get_utilization(start, end)
+
+
+    @contextmanager
+    def session(self, pool: Pool, timeout: float = None, lease: float = LEASE_TIME) -> Iterator[str]:
+        """Context manager holding a testbench of the pool. The lease is renewed by a heartbeat thread
+        while the context is active, and the lock is released when it is left.
+
+        Yields:
+            str: Hostname of the acquired testbench.
+        """
+        lease = self._lease(lease)
+        hostname = self.acquire(pool, timeout, lease)
+        stopped = threading.Event()
+        heartbeat = None
+        if lease is not None:
+            heartbeat = threading.Thread(target=self.__renew_lease, args=(hostname, lease, stopped), name='LeaseHeartbeat', daemon=True)
+            heartbeat.start()
+        try:
+            yield hostname
+        finally:
+            stopped.set()
+            if heartbeat is not None:
+                heartbeat.join()
+            self.release(hostname)
+
+
+    def __renew_lease(self, hostname: str, lease: float, stopped: threading.Event) -> None:
+        database = self.database.clone()    # Connections of broker clients must not be shared among threads
+        while not stopped.wait(min(self.HEARTBEAT_TIMER, lease / 3)):
+            try:
+                renewed = database.renew_leases((hostname,), self.username, lease)
+            except (sqlite3.Error, ValueError):
+                continue    # Retry with the next heartbeat, the lease time covers multiple missed heartbeats
+            if not renewed:
+                logging.getLogger('taco').warning('Lease of %s expired before it was renewed, the testbench is no longer locked', hostname)
+                return
+
+
+@contextmanager
+def acquire(pool: Pool, timeout: float = None, lease: float = LockClient.LEASE_TIME, **kwargs) -> Iterator[str]:
+    """Holds a testbench of the pool while the context is active, e.g.
+
+        with acquire(("rigA", "rigB"), timeout=600) as hostname:
+            run_tests(hostname)
+
+    Keyword arguments are passed to the LockClient.
+
+    Yields:
+        str: Hostname of the acquired testbench.
+    """
+    with LockClient(**kwargs).session(pool, timeout, lease) as hostname:
+        yield hostname
@@ -0,0 +1,187 @@
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, Tuple
+
+from taco.DatabaseController import DatabaseController
+
+
+class LockHistory():
+    RETENTION_DAYS  = 90            # Raw lock events older than this are compacted into daily usage
+    COMPACT_TIMER   = 24 * 3600     # Time in seconds between two compactions run by the refresher and the broker
+
+    def __init__(self, database: DatabaseController) -> None:
+        """Utilization analytics on the lock events logged by the database, including retention and compaction.
+
+        Args:
+            database (DatabaseController): Connection to the database.
+        """
+        self.database = database
+
+
+    def _replay(self, start: int, end: int, events: Iterable[Tuple[str, str, str, int]], on_interval) -> Dict[str, object]:
+        """Replays the lock events in a single pass, reporting every lock interval clipped to [start, end) to on_interval(name, user, since, until).
+        Locks held at start are taken from the last event before start of each testbench, using the (Name, Time) index.
+        "carry" events mark locks which were held across a compaction cutoff and do not count as acquisitions.
+        Locks whose lease expired before end without being reclaimed yet are held until the end of the lease.
+
+        Returns:
+            Dict[str, object]: Peak concurrency, waits and acquisitions collected while replaying.
+        """
+        cursor = self.database.cursor
+        cursor.execute("SELECT Name, Locked_By, Lease_Until FROM Testbenches WHERE Lease_Until < :end", {'end': end})
+        expired = {name: (user, lease_until) for name, user, lease_until in cursor.fetchall()}
+
+        def expired_before(name: str, user: str, time: int) -> bool:
+            return name in expired and expired[name][0] == user and expired[name][1] <= time
+
+        cursor.execute("""SELECT e.Name, e.User FROM Testbenches t JOIN LockEvents e ON e.rowid = (
+                SELECT rowid FROM LockEvents WHERE Name = t.Name AND Time < :start AND Event != 'refused' ORDER BY Time DESC LIMIT 1)
+            WHERE e.Event IN ('acquire', 'carry')
+        """, {'start': start})
+        held = {name: (user, start) for name, user in cursor.fetchall() if not expired_before(name, user, start)}
+
+        stats = {'peak_concurrency': len(held), 'peak_time': start, 'acquisitions': {}, 'waits': {}}
+        refused: Dict[Tuple[str, str], int] = {}
+        for name, event, user, time in events:
+            if event == 'refused':
+                refused.setdefault((name, user), time)
+                continue
+
+            if name in held:
+                lock_user, since = held.pop(name)
+                on_interval(name, lock_user, since, time)
+
+            if event in ('acquire', 'carry'):
+                held[name] = (user, time)
+            if event == 'acquire':
+                stats['acquisitions'][(name, user)] = stats['acquisitions'].get((name, user), 0) + 1
+                if (name, user) in refused:
+                    stats['waits'].setdefault((name, user), []).append(time - refused.pop((name, user)))
+            if len(held) > stats['peak_concurrency']:
+                stats['peak_concurrency'], stats['peak_time'] = len(held), time
+
+        for name, (lock_user, since) in list(held.items()):
+            if expired_before(name, lock_user, end):
+                del held[name]      # Expired lease which was not reclaimed yet
+                on_interval(name, lock_user, since, max(since, expired[name][1]))
+            else:
+                on_interval(name, lock_user, since, end)
+        stats['open'] = held
+        return stats
+
+
+    def get_utilization(self, start: datetime, end: datetime = None) -> Dict[str, object]:
+        """Computes per-testbench and per-user utilization, peak concurrency and wait times in a single pass over the events.
+        Days which were already compacted contribute their held time and acquisitions, but no concurrency or wait times.
+
+        Args:
+            start (datetime): Start of the date range.
+            end (datetime, optional): End of the date range. Defaults to now.
+
+        Returns:
+            Dict[str, object]: Dictionary with the keys "testbenches" and "users", mapping names to held_seconds, utilization,
+            acquisitions and wait_seconds, as well as "peak_concurrency" and "peak_time".
+        """
+        start, end = DatabaseController.epoch(start), DatabaseController.epoch(end)
+        duration = max(1, end - start)
+        testbenches: Dict[str, Dict[str, float]] = {}
+        users: Dict[str, Dict[str, float]] = {}
+
+        def entry(table: dict, key: str) -> Dict[str, float]:
+            return table.setdefault(key, {'held_seconds': 0, 'utilization': 0.0, 'acquisitions': 0, 'waits': 0, 'wait_seconds': 0})
+
+        def add_interval(name: str, user: str, since: int, until: int) -> None:
+            seconds = min(until, end) - max(since, start)
+            entry(testbenches, name)['held_seconds'] += seconds
+            entry(users, user)['held_seconds'] += seconds
+
+        cursor = self.database.connection.cursor()
+        cursor.execute("""SELECT Name, Event, User, Time FROM LockEvents
+            WHERE Time >= :start AND Time < :end ORDER BY Time, rowid""", {'start': start, 'end': end})
+        stats = self._replay(start, end, cursor, add_interval)
+
+        for (name, user), count in stats['acquisitions'].items():
+            entry(testbenches, name)['acquisitions'] += count
+            entry(users, user)['acquisitions'] += count
+        for (name, user), waits in stats['waits'].items():
+            for table, key in ((testbenches, name), (users, user)):
+                entry(table, key)['waits'] += len(waits)
+                entry(table, key)['wait_seconds'] += sum(waits)
+
+        cursor.execute("""SELECT Name, User, SUM(Held_Seconds), SUM(Acquisitions) FROM LockUsage
+            WHERE Day >= :start AND Day < :end GROUP BY Name, User""", {'start': start, 'end': end})
+        for name, user, seconds, acquisitions in cursor.fetchall():
+            for table, key in ((testbenches, name), (users, user)):
+                entry(table, key)['held_seconds'] += seconds
+                entry(table, key)['acquisitions'] += acquisitions
+
+        for table in (testbenches, users):
+            for values in table.values():
+                values['utilization'] = values['held_seconds'] / duration
+
+        return {'testbenches': testbenches, 'users': users,
+                'peak_concurrency': stats['peak_concurrency'], 'peak_time': DatabaseController.from_epoch(stats['peak_time'])}
+
+
+    def compact(self, retention_days: int = RETENTION_DAYS) -> int:
+        """Rolls up lock events older than the retention period into daily usage per testbench and user and deletes them.
+        Locks still held at the cutoff are kept as a "carry" event at the cutoff. Runs in one write transaction.
+
+        Args:
+            retention_days (int, optional): Days of raw events to keep, the cutoff is aligned to midnight. Defaults to RETENTION_DAYS.
+
+        Returns:
+            int: Number of deleted events.
+        """
+        cutoff_time = (datetime.now() - timedelta(days=retention_days)).replace(hour=0, minute=0, second=0, microsecond=0)
+        cutoff = DatabaseController.epoch(cutoff_time)
+
+        # Checked without the write lock first, as most clients find the history already compacted
+        self.database.cursor.execute("SELECT MIN(Time) FROM LockEvents")
+        first = self.database.cursor.fetchone()[0]
+        if first is None or first >= cutoff:
+            return 0
+
+        def compact() -> int:
+            cursor = self.database.cursor   # Cursor of the writer, only available inside the write transaction
+            cursor.execute("SELECT MIN(Time) FROM LockEvents")
+            first = cursor.fetchone()[0]
+            if first is None or first >= cutoff:
+                return 0
+
+            usage: Dict[Tuple[str, str, int], int] = {}
+
+            def add_interval(name: str, user: str, since: int, until: int) -> None:
+                # Split the interval at midnight
+                day = datetime.fromtimestamp(since).replace(hour=0, minute=0, second=0, microsecond=0)
+                while since < until:
+                    next_day = DatabaseController.epoch(day + timedelta(days=1))
+                    key = (name, user, DatabaseController.epoch(day))
+                    usage[key] = usage.get(key, 0) + min(until, next_day) - since
+                    since, day = next_day, day + timedelta(days=1)
+
+            cursor.execute("""SELECT Name, Event, User, Time FROM LockEvents
+                WHERE Time < :cutoff ORDER BY Time, rowid""", {'cutoff': cutoff})
+            events = cursor.fetchall()
+            stats = self._replay(first, cutoff, events, add_interval)
+
+            # Acquisitions are attributed to the day of the acquire event
+            acquisitions: Dict[Tuple[str, str, int], int] = {}
+            for name, event, user, time in events:
+                if event == 'acquire':
+                    day = DatabaseController.epoch(datetime.fromtimestamp(time).replace(hour=0, minute=0, second=0, microsecond=0))
+                    acquisitions[(name, user, day)] = acquisitions.get((name, user, day), 0) + 1
+
+            cursor.executemany("""INSERT INTO LockUsage (Name, User, Day, Held_Seconds, Acquisitions) VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (Name, User, Day) DO UPDATE SET
+                    Held_Seconds = Held_Seconds + excluded.Held_Seconds,
+                    Acquisitions = Acquisitions + excluded.Acquisitions
+            """, ((name, user, day, usage.get((name, user, day), 0), acquisitions.get((name, user, day), 0))
+                  for name, user, day in usage.keys() | acquisitions.keys()))
+
+            cursor.execute("DELETE FROM LockEvents WHERE Time < :cutoff", {'cutoff': cutoff})
+            deleted = cursor.rowcount
+            cursor.executemany("INSERT INTO LockEvents (Name, Event, User, Time) VALUES (?, 'carry', ?, ?)",
+                               ((name, user, cutoff) for name, (user, _) in stats['open'].items()))
+            return deleted
+
+        return self.database.write_transaction(compact)
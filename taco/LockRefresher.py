@@ -0,0 +1,163 @@
+import time
+import queue
+import logging
+import sqlite3
+import threading
+from datetime import datetime
+from typing import Callable, Dict, List, Tuple
+
+from taco.DatabaseController import DatabaseController, Reservation
+from taco.LockHistory import LockHistory
+
+
+LockSnapshot = Tuple[Dict[str, Tuple[str, datetime]], Dict[str, List[str]], Dict[str, Reservation]]     # Lock data, wait queues and next reservations
+DatabaseTask = Callable[[DatabaseController], None]
+
+
+class LockRefresher(threading.Thread):
+    def __init__(self, taco, interval: float, on_snapshot: Callable[[], None] = None) -> None:
+        """Background worker which owns its own database connection, periodically reads the lock data and posts
+        the results to a queue. Write operations can be submitted as tasks so they are executed off the GUI thread as well.
+        While the database is unavailable, the worker checks for it and reconnects once it is back. Errors of the tasks and
+        refreshes are kept in last_error until a refresh succeeds, the worker keeps running.
+        The lock history of the database is compacted once after connecting and then every LockHistory.COMPACT_TIMER.
+
+        Args:
+            taco (TestbenchAccessController): Controller providing the testbenches and database file.
+            interval (float): Time in seconds between two refreshes.
+            on_snapshot (Callable[[], None], optional): Called from the worker thread after a new snapshot was posted. Defaults to None.
+        """
+        super().__init__(name='LockRefresher', daemon=True)
+        self.taco       = taco
+        self.interval   = interval
+        self.on_snapshot = on_snapshot
+
+        self.tasks: queue.Queue[DatabaseTask]       = queue.Queue()
+        self.snapshots: queue.Queue[LockSnapshot]   = queue.Queue()
+        self.last_error: Exception = None
+
+        self._database: DatabaseController = None
+        self._compacted: float = None       # Monotonic time of the last compaction of the lock history
+        self._stopped = threading.Event()
+
+
+    def submit(self, task: DatabaseTask) -> None:
+        """Queues a task for execution in the worker thread. A new snapshot is posted afterwards.
+
+        Args:
+            task (DatabaseTask): Callable receiving the database connection owned by the worker.
+        """
+        self.tasks.put(task)
+
+
+    def request_refresh(self) -> None:
+        """Wakes up the worker to post a new snapshot without waiting for the refresh interval."""
+        self.tasks.put(None)
+
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self.tasks.put(None)
+
+
+    def latest_snapshot(self) -> LockSnapshot:
+        """Returns the most recent snapshot posted by the worker without blocking, discarding older ones.
+
+        Returns:
+            LockSnapshot: Latest lock data, wait queues and reservations or None if no new snapshot is available.
+        """
+        snapshot = None
+        while True:
+            try:
+                snapshot = self.snapshots.get_nowait()
+            except queue.Empty:
+                return snapshot
+
+
+    def run(self) -> None:
+        while not self._stopped.is_set():
+            tasks = []
+            try:
+                tasks.append(self.tasks.get(timeout=self.interval))
+                while True:
+                    tasks.append(self.tasks.get_nowait())   # Handle all pending tasks in one go
+            except queue.Empty:
+                pass
+
+            if self._stopped.is_set():
+                break
+
+            failed = False
+            try:
+                # While offline, the tasks queue their lock changes in the local replica. Without a database selected,
+                # lock changes fail and are reported in last_error, other tasks like reading the testbench file still run.
+                database = self._connect()
+                for task in tasks:
+                    if task is not None:
+                        failed = not self._run_task(task, database) or failed
+                database = self._connect()      # A failed task may have found the database unavailable
+                if database is None and not self.taco.offline:
+                    continue
+
+                # Reconnecting reconciles the queued changes, which must not block the GUI either
+                if database is None and self.taco.check_database_available() and self.taco.reconnect():
+                    database = self._connect()
+
+                if database is None:
+                    lockDict = dict(self.taco.lock_cache)   # Lock cache including the queued changes
+                    sites = self.taco.poll_locks(None) if self.taco.sites else None     # Other sites are still available
+                    if sites is not None:
+                        lockDict.update(sites[0])
+                    snapshot = (lockDict, None, None) if sites is None else (lockDict,) + sites[1:]
+                else:
+                    snapshot = self.taco.poll_locks(database)
+                if snapshot is not None:    # Only post snapshots if the lock data changed
+                    self.snapshots.put(snapshot)
+                    if self.on_snapshot is not None:
+                        self.on_snapshot()
+
+                # Brokers compact the history themselves
+                if isinstance(database, DatabaseController) and (self._compacted is None or time.monotonic() - self._compacted >= LockHistory.COMPACT_TIMER):
+                    self._compacted = time.monotonic()
+                    LockHistory(database).compact()
+                if not failed:
+                    self.last_error = None
+            except Exception as err:
+                self._record_error(err)
+
+        self._database = None
+
+
+    def _run_task(self, task: DatabaseTask, database: DatabaseController) -> bool:
+        """Runs a submitted task, so a failing task neither stops the worker nor drops the tasks submitted with it.
+
+        Returns:
+            bool: True if the task succeeded, otherwise its error is kept in last_error.
+        """
+        try:
+            task(database)
+            return True
+        except Exception as err:
+            self._record_error(err)
+            return False
+
+
+    def _record_error(self, err: Exception) -> None:
+        """Keeps the error in last_error, switching to the local replica if the database became unavailable."""
+        if isinstance(err, sqlite3.OperationalError):
+            if 'locked' not in str(err):
+                self.taco.go_offline()  # Database unavailable, e.g. the network share dropped
+        elif not isinstance(err, (sqlite3.Error, ValueError)):
+            logging.getLogger('taco').error('Background task failed: %s', err, exc_info=err)
+        self.last_error = err
+
+
+    def _connect(self) -> DatabaseController:
+        """Returns the database connection of the worker thread, reconnecting if the database file of the controller changed."""
+        if self.taco.database is None:
+            self._database = None
+        elif self._database is None or self._database.dbFile != self.taco.database.dbFile:
+            self._database = self.taco.database.clone()
+            self._database.subscribe(self.request_refresh)      # Pushed changes are refreshed immediately
+
+        return self._database
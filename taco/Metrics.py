@@ -0,0 +1,169 @@
+import json
+import time
+import logging
+import functools
+import threading
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Callable, Deque, Dict, Iterator, List, Tuple, TypeVar
+
+
+C = TypeVar('C', bound=type)
+F = TypeVar('F', bound=Callable)
+
+
+class Metrics():
+    BUCKETS         = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)    # Upper bounds of the histogram buckets in ms
+    SLOW_THRESHOLD  = 0.5   # Operations taking longer than this many seconds are logged
+    SLOW_LOG_SIZE   = 100   # Number of slow operations kept for the debug panel
+
+    def __init__(self, slow_threshold: float = SLOW_THRESHOLD) -> None:
+        """Thread-safe registry of counters and latency histograms of named operations, exportable as JSON or
+        Prometheus text. Operations slower than the threshold are logged to the "taco" logger and kept in a ring buffer.
+
+        Args:
+            slow_threshold (float, optional): Threshold in seconds for logging slow operations, None to disable. Defaults to SLOW_THRESHOLD.
+        """
+        self.slow_threshold = slow_threshold
+        self.logger         = logging.getLogger('taco')
+
+        self.counters: Dict[str, int] = {}
+        self.histograms: Dict[str, List[float]] = {}    # Bucket counts, followed by count, sum and max in ms
+        self.slow_operations: Deque[Tuple[datetime, str, float]] = deque(maxlen=self.SLOW_LOG_SIZE)
+        self._lock          = threading.Lock()
+
+
+    def count(self, name: str, value: int = 1) -> None:
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+
+    def observe(self, name: str, seconds: float) -> None:
+        """Records the duration of an operation."""
+        ms = seconds * 1000
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = [0] * (len(self.BUCKETS) + 1) + [0, 0.0, 0.0]
+            index = next((i for i, bound in enumerate(self.BUCKETS) if ms <= bound), len(self.BUCKETS))
+            histogram[index] += 1
+            histogram[-3] += 1
+            histogram[-2] += ms
+            histogram[-1] = max(histogram[-1], ms)
+
+            slow = self.slow_threshold is not None and seconds >= self.slow_threshold
+            if slow:
+                self.slow_operations.append((datetime.now(), name, ms))
+        if slow:
+            self.logger.warning('Slow operation %s took %.1f ms', name, ms)
+
+
+    @contextmanager
+    def time(self, name: str) -> Iterator[None]:
+        """Measures the duration of the block. Exceptions are counted as "<name>.errors"."""
+        started = time.perf_counter()
+        try:
+            yield
+        except BaseException:
+            self.count(f'{name}.errors')
+            raise
+        finally:
+            self.observe(name, time.perf_counter() - started)
+
+
+    def timed(self, name: str) -> Callable[[F], F]:
+        """Decorator measuring every call of the function."""
+        def decorator(function: F) -> F:
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.time(name):
+                    return function(*args, **kwargs)
+            return wrapper
+        return decorator
+
+
+    def instrument(self, prefix: str) -> Callable[[C], C]:
+        """Class decorator measuring every public method as "<prefix>.<method>". Static and class methods are not measured."""
+        def decorator(cls: C) -> C:
+            for attribute, value in list(vars(cls).items()):
+                if attribute.startswith('_') or not callable(value) or isinstance(value, (staticmethod, classmethod)):
+                    continue
+                setattr(cls, attribute, self.timed(f'{prefix}.{attribute}')(value))
+            return cls
+        return decorator
+
+
+    def quantile(self, name: str, q: float) -> float:
+        """Estimates the quantile of the durations in ms as the upper bound of the bucket containing it."""
+        with self._lock:
+            histogram = list(self.histograms.get(name, []))
+        if not histogram or not histogram[-3]:
+            return 0.0
+
+        rank, total = q * histogram[-3], 0
+        for bound, bucket in zip(self.BUCKETS, histogram):
+            total += bucket
+            if total >= rank:
+                return min(float(bound), histogram[-1])
+        return histogram[-1]
+
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Returns all counters and histograms as dictionary."""
+        with self._lock:
+            histograms = {name: list(histogram) for name, histogram in self.histograms.items()}
+            snapshot = {'counters': dict(self.counters), 'operations': {},
+                        'slow_operations': [(when.isoformat(), name, ms) for when, name, ms in self.slow_operations]}
+
+        for name, histogram in sorted(histograms.items()):
+            count, total, maximum = histogram[-3:]
+            snapshot['operations'][name] = {
+                'count':    count,
+                'mean_ms':  total / count if count else 0.0,
+                'p50_ms':   self.quantile(name, 0.50),
+                'p99_ms':   self.quantile(name, 0.99),
+                'max_ms':   maximum,
+                'errors':   snapshot['counters'].get(f'{name}.errors', 0),
+                'buckets':  dict(zip([str(bound) for bound in self.BUCKETS] + ['+Inf'], histogram[:-3])),
+            }
+        return snapshot
+
+
+    def to_json(self) -> str:
+        return json.dumps(self.snapshot(), indent=4)
+
+
+    def to_prometheus(self) -> str:
+        """Exports the metrics in the Prometheus text format, durations in seconds."""
+        snapshot = self.snapshot()
+        lines = ['# TYPE taco_operation_duration_seconds histogram']
+        for name, operation in snapshot['operations'].items():
+            cumulative = 0
+            for bound, bucket in operation['buckets'].items():
+                cumulative += bucket
+                le = bound if bound == '+Inf' else str(int(bound) / 1000)
+                lines.append(f'taco_operation_duration_seconds_bucket{{operation="{name}",le="{le}"}} {cumulative}')
+            lines.append(f'taco_operation_duration_seconds_sum{{operation="{name}"}} {operation["mean_ms"] * operation["count"] / 1000}')
+            lines.append(f'taco_operation_duration_seconds_count{{operation="{name}"}} {operation["count"]}')
+
+        lines.append('# TYPE taco_events_total counter')
+        for name, value in sorted(snapshot['counters'].items()):
+            lines.append(f'taco_events_total{{event="{name}"}} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+    def export(self, path: str) -> None:
+        """Writes the metrics to the file, in the Prometheus text format for ".prom" files and as JSON otherwise."""
+        with open(path, 'w') as f:
+            f.write(self.to_prometheus() if path.endswith('.prom') else self.to_json())
+
+
+    def reset(self) -> None:
+        with self._lock:
+            self.counters.clear()
+            self.histograms.clear()
+            self.slow_operations.clear()
+
+
+metrics = Metrics()     # Registry shared by all modules of the process
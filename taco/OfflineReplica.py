@@ -0,0 +1,100 @@
+import json
+import sqlite3
+import threading
+from datetime import datetime
+from typing import Dict, List, Tuple
+
+from taco.DatabaseController import DatabaseController
+
+
+LockIntent = Tuple[int, str, Tuple[str], str, float, Dict[str, str]]    # Id, action, hostnames, user, lease, expected holders
+
+
+class OfflineReplica():
+    ACTIONS = ('acquire', 'release', 'unset')   # Lock intents which can be queued while the shared database is unavailable
+
+    def __init__(self, replicaFile: str) -> None:
+        """Local copy of the last lock snapshot of each shared database, and a durable queue of lock intents made while
+        the shared database was unavailable. The replica is stored on the local disk, so it is readable during outages.
+
+        Args:
+            replicaFile (str): Path to the local replica file.
+        """
+        self.replicaFile    = replicaFile
+        self.connection     = sqlite3.connect(replicaFile, check_same_thread=False)     # Shared among threads, serialized by the lock
+        self.cursor         = self.connection.cursor()
+        self._lock          = threading.Lock()
+
+        with self._lock:
+            self.cursor.execute("""CREATE TABLE IF NOT EXISTS Snapshot (
+                Database TEXT NOT NULL,
+                Name VARCHAR(255) NOT NULL,
+                Locked_By CHAR(255),
+                Locked_Since INTEGER,
+                PRIMARY KEY (Database, Name))
+            """)
+            self.cursor.execute("""CREATE TABLE IF NOT EXISTS Intents (
+                Id INTEGER PRIMARY KEY AUTOINCREMENT,
+                Database TEXT NOT NULL,
+                Action CHAR(16) NOT NULL,
+                Names TEXT NOT NULL,
+                User CHAR(255) NOT NULL,
+                Lease REAL,
+                Expected TEXT NOT NULL,
+                Created INTEGER NOT NULL)
+            """)
+            self.connection.commit()
+
+
+    def save_snapshot(self, database: str, lockDict: Dict[str, Tuple[str, datetime]]) -> None:
+        """Stores the lock data read from the shared database."""
+        with self._lock, self.connection:
+            self.cursor.executemany("INSERT OR REPLACE INTO Snapshot (Database, Name, Locked_By, Locked_Since) VALUES (?, ?, ?, ?)",
+                                    ((database, hostname, lock_user, DatabaseController.epoch(lock_time) if lock_time else None)
+                                     for hostname, (lock_user, lock_time) in lockDict.items()))
+
+
+    def load_snapshot(self, database: str) -> Dict[str, Tuple[str, datetime]]:
+        """Returns the last lock data stored for the shared database."""
+        with self._lock:
+            self.cursor.execute("SELECT Name, Locked_By, Locked_Since FROM Snapshot WHERE Database = ?", (database,))
+            return {hostname: (lock_user, DatabaseController.from_epoch(lock_time)) for hostname, lock_user, lock_time in self.cursor.fetchall()}
+
+
+    def add_intent(self, database: str, action: str, hostnames: Tuple[str], lock_user: str, lease: float, expected: Dict[str, str]) -> int:
+        """Queues a lock intent, committed to disk before returning.
+
+        Args:
+            database (str): Path of the shared database the intent is meant for.
+            action (str): One of ACTIONS.
+            hostnames (Tuple[str]): hostnames of the computers
+            lock_user (str): name of the user
+            lease (float): Lease time in seconds of acquired locks, None for locks which never expire.
+            expected (Dict[str, str]): Holders of the locks known when the intent was made, used to detect conflicts.
+
+        Raises:
+            ValueError: Raised for unknown actions.
+
+        Returns:
+            int: Id of the intent.
+        """
+        if action not in self.ACTIONS:
+            raise ValueError(f'Unknown lock intent "{action}", expected one of {self.ACTIONS}.')
+
+        with self._lock, self.connection:
+            self.cursor.execute("INSERT INTO Intents (Database, Action, Names, User, Lease, Expected, Created) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                (database, action, json.dumps(list(hostnames)), lock_user, lease, json.dumps(expected), DatabaseController.epoch()))
+            return self.cursor.lastrowid
+
+
+    def get_intents(self, database: str) -> List[LockIntent]:
+        """Returns the queued intents of the shared database in the order they were made."""
+        with self._lock:
+            self.cursor.execute("SELECT Id, Action, Names, User, Lease, Expected FROM Intents WHERE Database = ? ORDER BY Id", (database,))
+            return [(id, action, tuple(json.loads(names)), lock_user, lease, json.loads(expected))
+                    for id, action, names, lock_user, lease, expected in self.cursor.fetchall()]
+
+
+    def remove_intent(self, id: int) -> None:
+        with self._lock, self.connection:
+            self.cursor.execute("DELETE FROM Intents WHERE Id = ?", (id,))
@@ -0,0 +1,102 @@
+import time
+import socket
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Tuple
+
+from taco.DnsCache import DnsCache
+from taco.Metrics import metrics
+from taco.Testbench import Testbench
+
+
+ProbeResult = Tuple[str, float]     # Status and round trip time in milliseconds (None unless reachable)
+
+
+class ReachabilityProber(threading.Thread):
+    RDP_PORT        = 3389  # Port probed on every testbench
+    CONNECT_TIMEOUT = 2.0   # Time in seconds after which a testbench is considered unreachable
+    MAX_WORKERS     = 16    # Upper bound of concurrent probes
+
+    STATUS_UNKNOWN      = 'unknown'         # Not probed yet
+    STATUS_REACHABLE    = 'reachable'       # RDP port accepts connections
+    STATUS_UNREACHABLE  = 'unreachable'     # Resolved, but the RDP port does not accept connections
+    STATUS_UNRESOLVED   = 'unresolved'      # Hostname cannot be resolved
+
+    def __init__(self, taco, interval: float, dns_cache: DnsCache = None, on_update: Callable[[], None] = None) -> None:
+        """Background worker which periodically checks DNS and the RDP port of all testbenches in parallel
+        using a bounded thread pool, and keeps the status and round trip time per hostname.
+
+        Args:
+            taco (TestbenchAccessController): Controller providing the testbenches.
+            interval (float): Time in seconds between two probing rounds.
+            dns_cache (DnsCache, optional): Cache of resolved addresses. Defaults to the cache shared by all testbenches.
+            on_update (Callable[[], None], optional): Called from the worker thread after a status changed. Defaults to None.
+        """
+        super().__init__(name='ReachabilityProber', daemon=True)
+        self.taco       = taco
+        self.interval   = interval
+        self.dns_cache  = dns_cache if dns_cache is not None else Testbench.dns_cache
+        self.on_update  = on_update
+
+        self.results: Dict[str, ProbeResult] = {}
+        self.executor   = ThreadPoolExecutor(max_workers=self.MAX_WORKERS, thread_name_prefix='Probe')
+
+        self._wakeup    = threading.Event()
+        self._stopped   = threading.Event()
+
+
+    def get_status(self, hostname: str) -> ProbeResult:
+        """Returns the last probe result of the host without blocking."""
+        return self.results.get(hostname, (self.STATUS_UNKNOWN, None))
+
+
+    def request_probe(self) -> None:
+        """Starts the next probing round without waiting for the interval."""
+        self._wakeup.set()
+
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self._wakeup.set()
+
+
+    def probe(self, hostname: str) -> ProbeResult:
+        """Resolves the host using the DNS cache and measures the time to connect to its RDP port."""
+        address = self.dns_cache.resolve(hostname)
+        if not address:
+            return (self.STATUS_UNRESOLVED, None)
+
+        started = time.perf_counter()
+        try:
+            with socket.create_connection((address, self.RDP_PORT), timeout=self.CONNECT_TIMEOUT):
+                pass
+        except OSError:
+            self.dns_cache.invalidate(hostname)     # Address may have changed
+            return (self.STATUS_UNREACHABLE, None)
+        return (self.STATUS_REACHABLE, (time.perf_counter() - started) * 1000)
+
+
+    @metrics.timed('probe.all')
+    def probe_all(self) -> Dict[str, ProbeResult]:
+        """Probes all testbenches in parallel and stores the results.
+
+        Returns:
+            Dict[str, ProbeResult]: Results of the hostnames whose status changed.
+        """
+        hostnames = self.taco.testbenches.hostnames
+        results = dict(zip(hostnames, self.executor.map(self.probe, hostnames)))
+
+        changes = {hostname: result for hostname, result in results.items() if self.get_status(hostname)[0] != result[0]}
+        self.results = results
+        return changes
+
+
+    def run(self) -> None:
+        while not self._stopped.is_set():
+            if self.probe_all() and self.on_update is not None:
+                self.on_update()
+
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+
+        self.executor.shutdown(wait=False)
@@ -0,0 +1,82 @@
+import queue
+import sqlite3
+import threading
+import subprocess as sp
+from typing import Callable, Dict, List
+
+from taco.DatabaseController import DatabaseController
+from taco.Metrics import metrics
+
+
+class SessionMonitor(threading.Thread):
+    def __init__(self, taco, on_release: Callable[[], None] = None) -> None:
+        """Tracks the remote desktop sessions started by this client. Each session is waited on by a lightweight thread,
+        and the locks of all sessions that ended are released in one transaction by the monitor thread.
+
+        Args:
+            taco (TestbenchAccessController): Controller providing the database file and releasing the locks.
+            on_release (Callable[[], None], optional): Called from the monitor thread after locks were released. Defaults to None.
+        """
+        super().__init__(name='SessionMonitor', daemon=True)
+        self.taco       = taco
+        self.on_release = on_release
+
+        self.sessions: Dict[str, sp.Popen] = {}
+        self.finished: queue.Queue[str] = queue.Queue()
+
+        self._database: DatabaseController = None
+
+
+    @property
+    def ids(self) -> List[str]:
+        """Ids of the testbenches with running sessions."""
+        return list(self.sessions)
+
+
+    def add(self, id: str, process: sp.Popen) -> None:
+        """Starts monitoring the session process of the testbench.
+
+        Args:
+            id (str): Id of the testbench.
+            process (sp.Popen): Process of the remote desktop session.
+        """
+        self.sessions[id] = process
+        threading.Thread(target=self.__wait, args=(id, process), name=f'Session {id}', daemon=True).start()
+        if not self.is_alive():
+            self.start()
+
+
+    def __wait(self, id: str, process: sp.Popen) -> None:
+        process.wait()
+        self.finished.put(id)
+
+
+    def run(self) -> None:
+        while True:
+            ids = [self.finished.get()]
+            try:
+                while True:
+                    ids.append(self.finished.get_nowait())  # Release all sessions which ended meanwhile at once
+            except queue.Empty:
+                pass
+
+            # Ignore sessions which were restarted in the meantime
+            ids = [id for id in ids if id in self.sessions and self.sessions[id].poll() is not None]
+            if not ids:
+                continue
+
+            try:
+                database = self.taco.database
+                if database is not None and (self._database is None or self._database.dbFile != database.dbFile):
+                    self._database = database.clone()
+                # While the database is unavailable, the releases are queued as intents and applied once it is back
+                with metrics.time('sessions.release'):
+                    self.taco.release_locks(ids, self._database if database is not None else None)
+            except (sqlite3.Error, ValueError):
+                pass    # Lease of the session lock expires instead
+
+            for id in ids:
+                self.sessions.pop(id, None)
+
+            if self.on_release is not None:
+                self.on_release()
@@ -0,0 +1,155 @@
+import sqlite3
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from typing import Callable, Dict, Tuple, TypeVar
+
+from taco.ConnectionProfile import ConnectionProfile, DEFAULT_PROFILE
+from taco.DatabaseController import DatabaseController
+from taco.Metrics import metrics
+
+
+T = TypeVar('T')
+
+
+class SiteDatabases():
+    def __init__(self) -> None:
+        """Lock databases of further sites, attached next to the main database. Every site is polled by its own worker
+        thread, so a slow or unreachable site only delays its own lock data. Connections are opened on first use
+        and dropped once the database becomes unavailable, to be opened again by the next poll.
+        """
+        self.files: Dict[str, str] = {}                 # Database file per site name
+        self.errors: Dict[str, Exception] = {}          # Last error of sites whose database is unavailable
+        self.polled: Dict[str, Tuple[str]] = {}         # Hostnames read by the last poll per site, managed by the poll function
+
+        self._profiles: Dict[str, str] = {}
+        self._databases: Dict[str, DatabaseController] = {}
+        self._pollers: Dict[str, ThreadPoolExecutor] = {}
+        self._polls: Dict[str, Future] = {}             # Poll in flight per site, at most one
+        self._lock = threading.Lock()                   # Guards the connections
+
+
+    def __len__(self) -> int:
+        return len(self.files)
+
+
+    def __contains__(self, site: str) -> bool:
+        return site in self.files
+
+
+    def attach(self, site: str, databaseFile: str, profile: str = DEFAULT_PROFILE) -> None:
+        """Attaches the database of the site, replacing a database attached before. The database is opened on first use.
+
+        Raises:
+            ValueError: Raised if the site name is empty.
+        """
+        if not site:
+            raise ValueError('Site name must not be empty.')
+        self.detach(site)
+        self.files[site] = databaseFile
+        self._profiles[site] = profile
+
+
+    def detach(self, site: str) -> None:
+        """Detaches the database of the site. A poll in flight is finished in the background and discarded."""
+        self.files.pop(site, None)
+        self._profiles.pop(site, None)
+        self.errors.pop(site, None)
+        self.polled.pop(site, None)
+        self._drop(site)
+        self._polls.pop(site, None)
+        poller = self._pollers.pop(site, None)
+        if poller is not None:
+            poller.shutdown(wait=False)
+
+
+    def run(self, site: str, operation: Callable[[DatabaseController], T]) -> T:
+        """Runs the operation with the database of the site in the calling thread.
+
+        Raises:
+            ValueError: Raised if the site is not attached or its database is unavailable.
+
+        Returns:
+            T: Return value of the operation.
+        """
+        if site not in self.files:
+            raise ValueError(f'Site "{site}" is not attached.')
+        databaseFile = self.files[site]
+        try:
+            result = operation(self._connect(site))
+        except sqlite3.OperationalError as err:
+            if 'locked' in str(err):
+                raise
+            self._failed(site, databaseFile, err)
+            raise ValueError(f'Database of site "{site}" is unavailable: {err}') from err
+        except ValueError as err:
+            self.errors[site] = err
+            raise
+        self.errors.pop(site, None)
+        return result
+
+
+    def submit(self, site: str, operation: Callable[[DatabaseController], T]) -> None:
+        """Runs the operation with the database of the site on the worker thread of the site.
+        Nothing is submitted while the previous operation of the site is still running.
+        """
+        if site in self._polls:
+            return
+        if site not in self._pollers:
+            self._pollers[site] = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f'SitePoll {site}')
+        self._polls[site] = self._pollers[site].submit(self.run, site, operation)
+
+
+    def collect(self, timeout: float) -> Dict[str, T]:
+        """Waits up to the timeout for the submitted operations and returns the results of the finished ones per site.
+        Unfinished operations are collected by a later call, failed ones are reported in the errors.
+        """
+        if self._polls:
+            wait(list(self._polls.values()), timeout)
+
+        results: Dict[str, T] = {}
+        for site, poll in list(self._polls.items()):
+            if not poll.done():
+                metrics.count('sites.poll_pending')
+                continue
+            del self._polls[site]
+            try:
+                results[site] = poll.result()
+            except (sqlite3.Error, ValueError):
+                pass    # Reported in the errors by run()
+        return results
+
+
+    def close(self) -> None:
+        for site in list(self.files):
+            self.detach(site)
+
+
+    def _connect(self, site: str) -> DatabaseController:
+        database = self._databases.get(site)
+        if database is None:
+            # Opened outside of the lock, as opening an unreachable database blocks until it fails
+            opened = DatabaseController(self.files[site], ConnectionProfile.get(self._profiles[site]))
+            with self._lock:
+                database = self._databases.setdefault(site, opened)
+            if database is not opened:
+                opened.close()  # Opened by another thread meanwhile
+        return database
+
+
+    def _failed(self, site: str, databaseFile: str, err: Exception) -> None:
+        """Records the error and drops the connection, unless the site was attached to another file meanwhile."""
+        if self.files.get(site) != databaseFile:
+            return
+        self.errors[site] = err
+        self.polled.pop(site, None)
+        self._drop(site)
+
+
+    def _drop(self, site: str) -> None:
+        with self._lock:
+            database = self._databases.pop(site, None)
+        if database is not None:
+            try:
+                database.close()
+            except sqlite3.Error:
+                pass
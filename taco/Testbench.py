@@ -1,32 +1,33 @@
 import subprocess as sp
 import os
-import socket
 from typing import Dict
 from datetime import datetime
 
+from taco.DnsCache import DnsCache
+
 
 class Testbench():
-    def __init__(self, id: str, hostname: str = '', login_name: str = '') -> None:
+    dns_cache = DnsCache()  # Resolved addresses shared by all testbenches and the reachability prober
+
+    def __init__(self, id: str, hostname: str = '', login_name: str = '', site: str = '') -> None:
         self.id         = id
         self.hostname   = hostname if hostname else id
         self.login_name = login_name
+        self.site       = site      # Site whose database holds the lock, empty for the main database
    
         
     def __repr__(self) -> str:
         return f'{self.id} ({self.hostname})'
     
 
-    def run_rdp(self) -> int:       
+    def run_rdp(self) -> sp.Popen:       
         rdp_file = self.create_rdp_file()   # Create RDP file
         process = sp.Popen(['mstsc.exe', rdp_file])   # Open Remote Desktop Connection without waiting for a return
-        return process.pid
+        return process
     
     
     def get_ip_address(self) -> str:
-        try:
-            return socket.gethostbyname(self.hostname)
-        except socket.gaierror:
-            return ''
+        return self.dns_cache.resolve(self.hostname)
     
     def create_rdp_file(self) -> str:
         rdpSettings = []
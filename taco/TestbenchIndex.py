@@ -0,0 +1,152 @@
+from bisect import bisect_left, insort
+from datetime import datetime
+from typing import Dict, List, Set, Tuple
+
+from taco.Testbench import Testbench
+from taco.TestbenchRegistry import TestbenchRegistry
+
+
+class TestbenchIndex():
+    FIELDS  = ('id', 'host', 'login', 'user')   # Searchable fields, usable as qualifier of a term, e.g. "user:alice"
+    NGRAM   = 3                                 # Length of the n-grams used for substring lookups
+
+    def __init__(self, registry: TestbenchRegistry = None) -> None:
+        """In-memory search index over the id, hostname, login name and lock holder of the testbenches.
+        Prefix lookups use a sorted list of all values, substring lookups an n-gram index verified against the values.
+
+        Args:
+            registry (TestbenchRegistry, optional): Testbenches to index, in the order of the results. Defaults to None.
+        """
+        self._values: Dict[str, Tuple[str, ...]]    = {}    # Lower case values of the FIELDS per id
+        self._order: Dict[str, int]                 = {}    # Insertion position per id, to order results with equal rank
+        self._hostnames: Dict[str, str]             = {}    # Hostname per id, as the lock holders are keyed by hostname
+        self._by_hostname: Dict[str, List[str]]     = {}
+        self._sorted: List[Tuple[str, int, str]]    = []    # Value, field and id of all non-empty values, sorted
+        self._ngrams: Dict[str, Set[str]]           = {}    # Ids per n-gram of any of their values
+
+        # Bulk build, sorting all values once instead of inserting them one by one
+        for testbench in registry or ():
+            self._register(testbench)
+            values = self._values[testbench.id] = self._lower(testbench.id, testbench.hostname, testbench.login_name, '')
+            for gram in self._grams(*values):
+                self._ngrams.setdefault(gram, set()).add(testbench.id)
+        self._sorted = sorted((value, field, id) for id, values in self._values.items() for field, value in enumerate(values) if value)
+
+
+    def __len__(self) -> int:
+        return len(self._values)
+
+
+    def add(self, testbench: Testbench, lock_user: str = '') -> None:
+        """Adds the testbench to the index, replacing an indexed testbench with the same id."""
+        if testbench.id in self._values:
+            self.remove(testbench.id)
+        self._register(testbench)
+        self._update(testbench.id, (testbench.id, testbench.hostname, testbench.login_name, lock_user))
+
+
+    def remove(self, id: str) -> None:
+        self._update(id, None)
+        self._order.pop(id, None)
+        hostname = self._hostnames.pop(id, None)
+        ids = [other for other in self._by_hostname.get(hostname, []) if other != id]
+        if ids:
+            self._by_hostname[hostname] = ids
+        else:
+            self._by_hostname.pop(hostname, None)
+
+
+    def update_holders(self, lockDict: Dict[str, Tuple[str, datetime]]) -> None:
+        """Updates the lock holders of the testbenches, keyed by hostname. Only changed holders are re-indexed."""
+        for hostname, (lock_user, _) in lockDict.items():
+            for id in self._by_hostname.get(hostname, ()):
+                values = self._values[id]
+                if values[3] != lock_user.lower():
+                    self._update(id, values[:3] + (lock_user,))
+
+
+    def search(self, query: str) -> List[str]:
+        """Returns the ids of the testbenches matching all whitespace separated terms of the query, case insensitive.
+        A term matches if it is a substring of any field, or of the given field for qualified terms like "host:lab".
+        Results are ordered by rank (exact before prefix before substring matches), then by insertion order.
+        """
+        terms = query.lower().split()
+        if not terms:
+            return sorted(self._values, key=self._order.get)
+
+        ranks: Dict[str, int] = None
+        for term in terms:
+            field = None
+            qualifier, separator, text = term.partition(':')
+            if separator and qualifier in self.FIELDS:
+                field, term = self.FIELDS.index(qualifier), text
+
+            matches = self._match(term, field)
+            ranks = matches if ranks is None else {id: rank + matches[id] for id, rank in ranks.items() if id in matches}
+            if not ranks:
+                return []
+
+        return sorted(ranks, key=lambda id: (ranks[id], self._order[id]))
+
+
+    def _match(self, text: str, field: int = None) -> Dict[str, int]:
+        """Returns the ids whose values contain the text with their rank, 0 for exact, 1 for prefix and 2 for substring matches."""
+        ranks: Dict[str, int] = {}
+        index = bisect_left(self._sorted, (text,))
+        while index < len(self._sorted) and self._sorted[index][0].startswith(text):
+            value, value_field, id = self._sorted[index]
+            if field is None or value_field == field:
+                ranks[id] = min(ranks.get(id, 1), 0 if value == text else 1)
+            index += 1
+
+        if len(text) >= self.NGRAM:
+            grams = sorted((self._ngrams.get(gram, set()) for gram in self._grams(text)), key=len)
+            candidates = set.intersection(*grams) if grams else set()
+        else:
+            candidates = self._values.keys()
+        for id in candidates:
+            if id not in ranks and any(text in value for value_field, value in enumerate(self._values[id])
+                                       if value and (field is None or value_field == field)):
+                ranks[id] = 2
+        return ranks
+
+
+    def _register(self, testbench: Testbench) -> None:
+        self._order[testbench.id] = len(self._order)
+        self._hostnames[testbench.id] = testbench.hostname
+        self._by_hostname.setdefault(testbench.hostname, []).append(testbench.id)
+
+
+    def _update(self, id: str, values: Tuple[str, ...]) -> None:
+        """Replaces the indexed values of the testbench, None removes it."""
+        values = None if values is None else self._lower(*values)
+        previous = self._values.pop(id, None)
+        for field, value in enumerate(previous or ()):
+            if value:
+                del self._sorted[bisect_left(self._sorted, (value, field, id))]
+
+        previous_grams, grams = self._grams(*(previous or ())), self._grams(*(values or ()))
+        for gram in previous_grams - grams:
+            ids = self._ngrams[gram]
+            ids.discard(id)
+            if not ids:
+                del self._ngrams[gram]
+        for gram in grams - previous_grams:
+            self._ngrams.setdefault(gram, set()).add(id)
+
+        if values is None:
+            return
+        self._values[id] = values
+        for field, value in enumerate(values):
+            if value:
+                insort(self._sorted, (value, field, id))
+
+
+    @staticmethod
+    def _lower(*values: str) -> Tuple[str, ...]:
+        return tuple(value.lower() for value in values)
+
+
+    @classmethod
+    def _grams(cls, *values: str) -> Set[str]:
+        return {value[i:i + cls.NGRAM] for value in values for i in range(len(value) - cls.NGRAM + 1)}
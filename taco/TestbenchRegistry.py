@@ -0,0 +1,140 @@
+from typing import Dict, Iterator, List, Tuple
+
+from taco.Testbench import Testbench
+
+
+class TestbenchRegistry():
+    def __init__(self) -> None:
+        """Indexed collection of testbenches, providing constant time lookups by id and hostname as well as the parent/child relations."""
+        self._by_id: Dict[str, Testbench]           = {}
+        self._by_hostname: Dict[str, List[str]]     = {}
+        self._parents: Dict[str, str]               = {}
+        self._children: Dict[str, List[str]]        = {}
+        self._hostnames: Tuple[str] = None          # Cached tuple of unique hostnames
+
+
+    def __len__(self) -> int:
+        return len(self._by_id)
+
+
+    def __iter__(self) -> Iterator[Testbench]:
+        return iter(list(self._by_id.values()))
+
+
+    def __contains__(self, id: str) -> bool:
+        return id in self._by_id
+
+
+    @property
+    def hostnames(self) -> Tuple[str]:
+        """Unique hostnames of all testbenches in insertion order."""
+        if self._hostnames is None:
+            self._hostnames = tuple(self._by_hostname.keys())
+        return self._hostnames
+
+
+    def add(self, testbench: Testbench, parent: str = None) -> None:
+        """Adds the testbench to the registry.
+
+        Args:
+            testbench (Testbench): Testbench to add.
+            parent (str, optional): Id of the parent testbench. Defaults to None.
+
+        Raises:
+            ValueError: Raised if the id is already registered or the parent is unknown.
+        """
+        if testbench.id in self._by_id:
+            raise ValueError(f'Duplicate testbench "{testbench.id}".')
+        if parent is not None and parent not in self._by_id:
+            raise ValueError(f'Parent "{parent}" of testbench "{testbench.id}" not found.')
+
+        self._by_id[testbench.id] = testbench
+        self._by_hostname.setdefault(testbench.hostname, []).append(testbench.id)
+        self._children[testbench.id] = []
+        if parent is not None:
+            self._parents[testbench.id] = parent
+            self._children[parent].append(testbench.id)
+        self._hostnames = None
+
+
+    def remove(self, id: str) -> Testbench:
+        """Removes the testbench and its children from the registry.
+
+        Raises:
+            ValueError: Raised if the id is not registered.
+
+        Returns:
+            Testbench: The removed testbench.
+        """
+        testbench = self.get(id)
+        for child in list(self._children[id]):
+            self.remove(child)
+
+        parent = self._parents.pop(id, None)
+        if parent is not None:
+            self._children[parent].remove(id)
+        del self._children[id]
+        del self._by_id[id]
+
+        ids = self._by_hostname[testbench.hostname]
+        ids.remove(id)
+        if not ids:
+            del self._by_hostname[testbench.hostname]
+        self._hostnames = None
+        return testbench
+
+
+    def replace(self, testbench: Testbench) -> Testbench:
+        """Replaces the registered testbench with the same id, keeping its parent and children.
+
+        Raises:
+            ValueError: Raised if the id is not registered.
+
+        Returns:
+            Testbench: The replaced testbench.
+        """
+        previous = self.get(testbench.id)
+        self._by_id[testbench.id] = testbench
+        if previous.hostname != testbench.hostname:
+            ids = self._by_hostname[previous.hostname]
+            ids.remove(testbench.id)
+            if not ids:
+                del self._by_hostname[previous.hostname]
+            self._by_hostname.setdefault(testbench.hostname, []).append(testbench.id)
+            self._hostnames = None
+        return previous
+
+
+    def clear(self) -> None:
+        self._by_id.clear()
+        self._by_hostname.clear()
+        self._parents.clear()
+        self._children.clear()
+        self._hostnames = None
+
+
+    def get(self, id: str) -> Testbench:
+        """Returns the testbench with the given id.
+
+        Raises:
+            ValueError: Raised if the id is not registered.
+        """
+        try:
+            return self._by_id[id]
+        except KeyError as err:
+            raise ValueError(err)
+
+
+    def get_by_hostname(self, hostname: str) -> List[Testbench]:
+        """Returns all testbenches sharing the given hostname."""
+        return [self._by_id[id] for id in self._by_hostname.get(hostname, [])]
+
+
+    def get_parent(self, id: str) -> str:
+        """Returns the id of the parent testbench or None for top level testbenches."""
+        return self._parents.get(id)
+
+
+    def get_children(self, id: str) -> List[str]:
+        """Returns the ids of the child testbenches."""
+        return list(self._children.get(id, []))
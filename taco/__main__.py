@@ -0,0 +1,192 @@
+"""Headless command line interface for scripts and CI jobs, printing its results as JSON.
+
+Examples:
+    python -m taco --database locks.db acquire rigA rigB --timeout 600
+    python -m taco --database locks.db renew rigA --lease 600
+    python -m taco --database locks.db release rigA
+    python -m taco --database locks.db status
+    python -m taco --database locks.db run rigA rigB --timeout 600 -- pytest tests/
+    python -m taco --database locks.db reserve rigA --start 2024-05-02T02:00 --hours 4
+    python -m taco --database locks.db utilization --days 30
+    python -m taco --database locks.db migrate
+
+Locks taken by "acquire" expire after their lease unless renewed with "renew", "--lease 0" takes a lock which never expires.
+The "run" command holds the acquired testbench while the command runs, renewing its lease, and passes the hostname
+in the environment variable TACO_HOSTNAME. Exit codes: 0 success, 1 no testbench acquired in time, time slot already reserved
+or lease already expired, 2 error, or the exit code of the command run.
+"""
+import os
+import sys
+import json
+import sqlite3
+import argparse
+import subprocess as sp
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Tuple
+
+from taco.DatabaseController import DatabaseController, Reservation
+from taco.ConnectionProfile import ConnectionProfile, DEFAULT_PROFILE
+from taco.LockClient import LockClient
+
+
+def to_json(value: Any) -> Any:
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, (tuple, list)):
+        return [to_json(item) for item in value]
+    if isinstance(value, dict):
+        return {key: to_json(item) for key, item in value.items()}
+    return value
+
+
+def emit(result: Dict[str, Any]) -> None:
+    print(json.dumps(to_json(result)), flush=True)
+
+
+def format_locks(lockDict: Dict[str, Tuple[str, datetime]]) -> Dict[str, Dict[str, Any]]:
+    return {hostname: {'locked_by': lock_user, 'locked_since': lock_time} for hostname, (lock_user, lock_time) in lockDict.items()}
+
+
+def format_reservation(reservation: Reservation) -> Dict[str, Any]:
+    id, lock_user, start, end = reservation
+    return {'id': id, 'reserved_by': lock_user, 'start': start, 'end': end}
+
+
+def parse_args(argv: List[str] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog='python -m taco', description='Headless access to the TACo lock database.')
+    parser.add_argument('--database', help='Path to the database file, defaults to $TACO_DATABASE')
+    parser.add_argument('--broker', help='Address "host:port" of a lock broker, defaults to $TACO_BROKER')
+    parser.add_argument('--user', help='Lock user, defaults to $TACO_USER or the user running the process')
+    parser.add_argument('--profile', help='Connection profile of the database, defaults to $TACO_PROFILE')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    acquire = commands.add_parser('acquire', help='Lock one free testbench of the pool')
+    acquire.add_argument('pool', nargs='+', help='Hostnames of interchangeable testbenches')
+    acquire.add_argument('--timeout', type=float, help='Time in seconds to wait for a free testbench, waits forever if not set')
+    acquire.add_argument('--lease', type=float, default=LockClient.LEASE_TIME,
+                         help=f'Lease time in seconds, defaults to {LockClient.LEASE_TIME}, 0 for locks which never expire')
+
+    renew = commands.add_parser('renew', help='Extend the leases of testbenches locked by the user')
+    renew.add_argument('hostnames', nargs='+')
+    renew.add_argument('--lease', type=float, default=LockClient.LEASE_TIME, help=f'Lease time in seconds from now, defaults to {LockClient.LEASE_TIME}')
+
+    release = commands.add_parser('release', help='Release testbenches locked by the user')
+    release.add_argument('hostnames', nargs='+')
+
+    status = commands.add_parser('status', help='Show the lock data of testbenches, all if none are given')
+    status.add_argument('hostnames', nargs='*')
+
+    run = commands.add_parser('run', help='Lock one free testbench of the pool while running a command')
+    run.add_argument('pool', nargs='+', help='Hostnames of interchangeable testbenches')
+    run.add_argument('--timeout', type=float, help='Time in seconds to wait for a free testbench, waits forever if not set')
+    run.add_argument('--lease', type=float, default=LockClient.LEASE_TIME, help='Lease time in seconds, renewed while the command runs, 0 for a lock which never expires')
+
+    reserve = commands.add_parser('reserve', help='Book a testbench for a time slot')
+    reserve.add_argument('hostname')
+    reserve.add_argument('--start', type=datetime.fromisoformat, default=datetime.now(), help='Start of the time slot in ISO format, defaults to now')
+    length = reserve.add_mutually_exclusive_group(required=True)
+    length.add_argument('--end', type=datetime.fromisoformat, help='End of the time slot in ISO format')
+    length.add_argument('--hours', type=float, help='Length of the time slot in hours')
+
+    reservations = commands.add_parser('reservations', help='Show the future reservations of a testbench')
+    reservations.add_argument('hostname')
+
+    cancel = commands.add_parser('cancel', help='Cancel a reservation of the user')
+    cancel.add_argument('id', type=int, help='Id of the reservation')
+
+    utilization = commands.add_parser('utilization', help='Show the utilization of the testbenches and users from the lock history')
+    span = utilization.add_mutually_exclusive_group()
+    span.add_argument('--start', type=datetime.fromisoformat, help='Start of the time span in ISO format')
+    span.add_argument('--days', type=float, default=7, help='Length of the time span until the end in days, defaults to 7')
+    utilization.add_argument('--end', type=datetime.fromisoformat, help='End of the time span in ISO format, defaults to now')
+
+    commands.add_parser('migrate', help='Migrate a database of an older version, once all clients sharing it are upgraded')
+
+    # The command run is split off first, as its arguments must not be parsed
+    argv = list(sys.argv[1:] if argv is None else argv)
+    command = []
+    if '--' in argv:
+        argv, command = argv[:argv.index('--')], argv[argv.index('--') + 1:]
+
+    args = parser.parse_args(argv)
+    if args.command == 'run' and not command:
+        parser.error('run requires a command after "--"')
+    args.run = command
+    return args
+
+
+def migrate(args: argparse.Namespace) -> Dict[str, Any]:
+    """Opens the database file directly, as the broker and older clients refuse to migrate it."""
+    database = args.database or os.environ.get('TACO_DATABASE', '')
+    if not database:
+        raise ValueError('No database selected, set TACO_DATABASE or pass the database file.')
+    migrated = DatabaseController.requires_migration(database)
+    controller = DatabaseController(database, ConnectionProfile.get(args.profile or os.environ.get('TACO_PROFILE', DEFAULT_PROFILE)), allow_migration=True)
+    controller.close()
+    return {'database': controller.dbFile, 'migrated': migrated, 'schema_version': DatabaseController.SCHEMA_VERSION}
+
+
+def main(argv: List[str] = None) -> int:
+    args = parse_args(argv)
+    try:
+        if args.command == 'migrate':
+            emit(migrate(args))
+            return 0
+
+        client = LockClient(args.database, args.broker, args.user, args.profile)
+
+        if args.command == 'acquire':
+            hostname = client.acquire(args.pool, args.timeout, args.lease or None)
+            lock_user, lock_time = client.status(hostname)[hostname]
+            emit({'hostname': hostname, 'locked_by': lock_user, 'locked_since': lock_time})
+
+        elif args.command == 'renew':
+            renewed = client.renew(args.hostnames, args.lease)
+            # Locks which never expire are not renewed, but still held
+            unrenewed = [hostname for hostname in dict.fromkeys(args.hostnames) if hostname not in renewed]
+            lost = [hostname for hostname, (lock_user, _) in client.status(unrenewed).items() if lock_user != client.username] if unrenewed else []
+            emit({'renewed': renewed, 'lost': lost})
+            if lost:
+                return 1    # Expired or not locked by the user
+
+        elif args.command == 'release':
+            emit({'locks': format_locks(client.release(args.hostnames))})
+
+        elif args.command == 'status':
+            emit({'locks': format_locks(client.status(args.hostnames))})
+
+        elif args.command == 'run':
+            with client.session(args.pool, args.timeout, args.lease or None) as hostname:
+                emit({'hostname': hostname, 'locked_by': client.username})
+                returncode = sp.call(args.run, env=dict(os.environ, TACO_HOSTNAME=hostname))
+            emit({'hostname': hostname, 'returncode': returncode})
+            return returncode
+
+        elif args.command == 'reserve':
+            end = args.end if args.end is not None else args.start + timedelta(hours=args.hours)
+            success, reservation = client.reserve(args.hostname, args.start, end)
+            emit({'reserved': success, 'reservation': format_reservation(reservation)})
+            if not success:
+                return 1    # The overlapping reservation is reported
+
+        elif args.command == 'reservations':
+            emit({'reservations': [format_reservation(reservation) for reservation in client.reservations(args.hostname)]})
+
+        elif args.command == 'cancel':
+            emit({'cancelled': client.cancel_reservation(args.id)})
+
+        elif args.command == 'utilization':
+            end = args.end or datetime.now()
+            emit(client.utilization(args.start or end - timedelta(days=args.days), end))
+
+    except TimeoutError as err:
+        emit({'error': str(err), 'type': 'TimeoutError'})
+        return 1
+    except (ValueError, sqlite3.Error, OSError) as err:
+        emit({'error': str(err), 'type': type(err).__name__})
+        return 2
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
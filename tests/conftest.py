@@ -0,0 +1,43 @@
+import json
+import os
+import sys
+
+import pytest
+
+# The modules are imported from the repository root, like the GUI and the command line interface do
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from taco.DatabaseController import DatabaseController
+
+
+class Clock():
+    def __init__(self) -> None:
+        """Current time of the database in epoch seconds, advanced by the tests instead of sleeping."""
+        self.now = DatabaseController.epoch()
+
+    def advance(self, seconds: int) -> None:
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(DatabaseController, 'epoch', staticmethod(lambda when=None: clock.now if when is None else int(when.timestamp())))
+    return clock
+
+
+@pytest.fixture
+def database(tmp_path):
+    database = DatabaseController(str(tmp_path / 'locks.db'))
+    database.add_testbenches(('rigA', 'rigB', 'rigC'))
+    yield database
+    database.close()
+
+
+@pytest.fixture
+def taco(tmp_path, monkeypatch):
+    import TACo     # Imported as module, so pytest does not collect TestbenchAccessController as a test class
+    monkeypatch.chdir(tmp_path)     # Settings, testbench file and replica are read from the working directory
+    (tmp_path / 'testbenches.json').write_text(json.dumps([{'rigA': {}}, {'rigB': {}}, {'rigC': {}}]))
+    (tmp_path / '.taco_settings').write_text(json.dumps({'Username': 'alice', 'Database': 'locks.db', 'Testbenchfile': 'testbenches.json'}))
+    return TACo.TestbenchAccessController()
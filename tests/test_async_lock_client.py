@@ -0,0 +1,72 @@
+import time
+import asyncio
+
+import pytest
+
+from taco.AsyncLockClient import AsyncLockClient
+from taco.DatabaseController import DatabaseController
+
+
+@pytest.fixture
+def slow_acquire(monkeypatch):
+    """Delays every attempt to lock a testbench, so the caller times out or is cancelled while the attempt is running."""
+    try_acquire_any = DatabaseController.try_acquire_any
+
+    def slow(self, *args, **kwargs):
+        time.sleep(0.5)
+        return try_acquire_any(self, *args, **kwargs)
+    monkeypatch.setattr(DatabaseController, 'try_acquire_any', slow)
+
+
+def test_session(database):
+    async def main():
+        async with AsyncLockClient(database=database.dbFile, username='ci') as client:
+            async with client.session(('rigA', 'rigB'), lease=None) as hostname:
+                assert database.get_lock(hostname)[0] == 'ci'
+            assert database.get_lock(hostname)[0] == ''
+
+    asyncio.run(main())
+
+
+def test_timeout_releases_late_lock(database, slow_acquire):
+    async def main():
+        async with AsyncLockClient(database=database.dbFile, username='ci') as client:
+            with pytest.raises(TimeoutError):
+                await client.acquire('rigA', timeout=0.2, lease=None)
+
+    asyncio.run(main())
+    assert database.get_lock('rigA')[0] == ''
+
+
+def test_cancel_while_acquiring_releases_lock(database, slow_acquire):
+    async def main():
+        async with AsyncLockClient(database=database.dbFile, username='ci') as client:
+            task = asyncio.ensure_future(client.acquire('rigA', lease=None))
+            await asyncio.sleep(0.1)
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+            assert database.get_lock('rigA')[0] == ''
+
+    asyncio.run(main())
+
+
+def test_cancel_in_session_releases_lock(database):
+    async def main():
+        async with AsyncLockClient(database=database.dbFile, username='ci') as client:
+            entered = asyncio.Event()
+
+            async def session():
+                async with client.session('rigA', lease=60):
+                    entered.set()
+                    await asyncio.sleep(10)
+
+            task = asyncio.ensure_future(session())
+            await asyncio.wait_for(entered.wait(), 5)
+            assert database.get_lock('rigA')[0] == 'ci'
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+            assert database.get_lock('rigA')[0] == ''
+
+    asyncio.run(main())
@@ -0,0 +1,64 @@
+import threading
+
+import pytest
+
+from taco.BrokerClient import BrokerClient
+from taco.DatabaseController import DatabaseController
+from taco.LockBroker import LockBroker
+
+
+@pytest.fixture
+def broker(tmp_path):
+    databaseFile = str(tmp_path / 'locks.db')
+    database = DatabaseController(databaseFile)
+    database.add_testbenches(('rigA', 'rigB'))
+    database.close()
+
+    broker = LockBroker(databaseFile, port=0)     # Ephemeral port
+    threading.Thread(target=broker.run, name='LockBroker', daemon=True).start()
+    assert broker.ready.wait(10)
+    return broker
+
+
+@pytest.fixture
+def client(broker):
+    client = BrokerClient('127.0.0.1', broker.port)
+    yield client
+    client.close()
+
+
+def test_acquire_and_release(broker, client):
+    success, lock_user, _ = client.try_acquire('rigA', 'alice')
+    assert success and lock_user == 'alice'
+
+    other = BrokerClient('127.0.0.1', broker.port)
+    success, lock_user, _ = other.try_acquire('rigA', 'bob')
+    assert not success and lock_user == 'alice'
+    assert other.try_acquire_any(('rigA', 'rigB'), 'bob')[0] == 'rigB'
+
+    success, lock_user, _ = client.release('rigA', 'alice')
+    assert success and lock_user == ''
+    lockDict = other.get_lock_multiple(('rigA', 'rigB'))
+    assert {hostname: lock_user for hostname, (lock_user, _) in lockDict.items()} == {'rigA': '', 'rigB': 'bob'}
+    other.close()
+
+
+def test_changes_are_pushed(broker, client):
+    pushed = threading.Event()
+    client.has_changed()
+    client.subscribe(pushed.set)
+
+    other = BrokerClient('127.0.0.1', broker.port)
+    other.try_acquire('rigA', 'bob')
+    assert pushed.wait(5)
+    assert client.has_changed()
+
+    pushed.clear()
+    other.release('rigA', 'bob')
+    assert pushed.wait(5)
+    other.close()
+
+
+def test_unknown_method_is_refused(client):
+    with pytest.raises(ValueError):
+        client._call('create_testbench_table')
@@ -0,0 +1,154 @@
+import sqlite3
+from datetime import timedelta
+
+import pytest
+
+from taco.DatabaseController import DatabaseController
+
+
+def holders(database, hostnames=('rigA', 'rigB', 'rigC')):
+    return {hostname: lock_user for hostname, (lock_user, _) in database.get_lock_multiple(hostnames).items()}
+
+
+def test_try_acquire(database):
+    success, lock_user, _ = database.try_acquire('rigA', 'alice')
+    assert success and lock_user == 'alice'
+    assert database.try_acquire('rigA', 'alice')[0]     # Held by the same user
+
+    success, lock_user, _ = database.try_acquire('rigA', 'bob')
+    assert not success and lock_user == 'alice'
+
+    with pytest.raises(ValueError):
+        database.try_acquire('unknown', 'alice')
+
+
+def test_try_acquire_multiple_is_all_or_nothing(database):
+    database.try_acquire('rigB', 'bob')
+    success, lockDict = database.try_acquire_multiple(('rigA', 'rigB'), 'alice')
+    assert not success and lockDict['rigB'][0] == 'bob'
+    assert holders(database) == {'rigA': '', 'rigB': 'bob', 'rigC': ''}
+
+    success, lockDict = database.try_acquire_multiple(('rigA', 'rigC'), 'alice')
+    assert success and holders(database) == {'rigA': 'alice', 'rigB': 'bob', 'rigC': 'alice'}
+
+
+def test_try_acquire_any(database):
+    database.try_acquire('rigA', 'bob')
+    assert database.try_acquire_any(('rigA', 'rigB'), 'alice')[0] == 'rigB'
+    assert database.try_acquire_any(('rigA', 'rigB'), 'carol')[0] == ''
+
+
+def test_release(database):
+    database.try_acquire('rigA', 'alice')
+    success, lock_user, _ = database.release('rigA', 'bob')
+    assert not success and lock_user == 'alice'
+
+    success, lock_user, _ = database.release('rigA', 'alice')
+    assert success and lock_user == ''
+
+
+def test_release_multiple_keeps_locks_of_other_users(database):
+    database.try_acquire_multiple(('rigA', 'rigB'), 'alice')
+    database.try_acquire('rigC', 'bob')
+    lockDict = database.release_multiple(('rigA', 'rigB', 'rigC'), 'alice')
+    assert {hostname: lock_user for hostname, (lock_user, _) in lockDict.items()} == {'rigA': '', 'rigB': '', 'rigC': 'bob'}
+
+
+def test_expired_lease_is_free(database, clock):
+    database.try_acquire('rigA', 'alice', lease=60)
+    clock.advance(30)
+    assert not database.try_acquire('rigA', 'bob')[0]
+
+    clock.advance(31)
+    assert holders(database)['rigA'] == ''
+    assert database.try_acquire('rigA', 'bob')[0]
+
+
+def test_renew_leases(database, clock):
+    database.try_acquire('rigA', 'alice', lease=60)
+    database.try_acquire('rigB', 'alice', lease=60)
+    database.try_acquire('rigC', 'alice')
+    clock.advance(50)
+    assert database.renew_leases(('rigA', 'rigC'), 'alice', 60) == ['rigA']    # Locks which never expire have no lease
+
+    clock.advance(20)
+    assert database.renew_leases(('rigA', 'rigB'), 'alice', 60) == ['rigA']    # Expired leases are not renewed
+    assert holders(database)['rigB'] == ''
+
+
+def test_unset_locks_keeps_changed_holders(database):
+    database.try_acquire('rigA', 'alice')
+    database.try_acquire('rigB', 'bob')
+    assert database.unset_locks({'rigA': 'alice', 'rigB': 'alice', 'rigC': ''}) == ['rigB']
+    assert holders(database) == {'rigA': '', 'rigB': 'bob', 'rigC': ''}
+
+    with pytest.raises(ValueError):
+        database.unset_locks({'unknown': 'alice'})
+
+
+def test_hand_over_is_leased(database, clock):
+    database.try_acquire('rigA', 'alice')
+    position, lock_user, _ = database.enqueue('rigA', 'bob')
+    assert position == 1 and lock_user == 'alice'
+
+    database.release('rigA', 'alice')
+    assert holders(database)['rigA'] == 'bob'
+    assert database.get_queue_multiple(('rigA',)).get('rigA', []) == []
+
+    # Not renewed by a client of the new holder
+    clock.advance(DatabaseController.HANDOVER_LEASE + 1)
+    assert holders(database)['rigA'] == ''
+
+    database.try_acquire('rigA', 'alice')
+    database.enqueue('rigA', 'bob')
+    database.release('rigA', 'alice')
+    clock.advance(DatabaseController.HANDOVER_LEASE - 10)
+    assert database.renew_leases(('rigA',), 'bob', 60) == ['rigA']
+
+
+def test_reserve_overlap(database, clock):
+    start = DatabaseController.from_epoch(clock.now) + timedelta(hours=1)
+    success, reservation = database.reserve('rigA', 'alice', start, start + timedelta(hours=2))
+    assert success
+    id = reservation[0]
+
+    success, overlapping = database.reserve('rigA', 'bob', start + timedelta(hours=1), start + timedelta(hours=3))
+    assert not success and overlapping[0] == id and overlapping[1] == 'alice'
+
+    # Time slots touching the reservation and other testbenches do not overlap
+    assert database.reserve('rigA', 'bob', start + timedelta(hours=2), start + timedelta(hours=3))[0]
+    assert database.reserve('rigA', 'bob', start - timedelta(minutes=30), start)[0]
+    assert database.reserve('rigB', 'bob', start, start + timedelta(hours=2))[0]
+
+    with pytest.raises(ValueError):
+        database.reserve('rigA', 'bob', start, start)
+
+
+def test_active_reservation_refuses_other_users(database, clock):
+    start = DatabaseController.from_epoch(clock.now) + timedelta(minutes=1)
+    database.reserve('rigA', 'alice', start, start + timedelta(hours=1))
+    assert database.try_acquire('rigA', 'bob')[0]     # Not started yet
+    database.release('rigA', 'bob')
+
+    clock.advance(120)
+    assert not database.try_acquire('rigA', 'bob')[0]
+    assert database.try_acquire('rigA', 'alice')[0]
+
+
+def test_legacy_database_requires_migration(tmp_path):
+    databaseFile = str(tmp_path / 'legacy.db')
+    connection = sqlite3.connect(databaseFile)
+    connection.execute("CREATE TABLE Testbenches (Name VARCHAR(255) PRIMARY KEY, Locked_By CHAR(255), Locked_Since TIMESTAMP)")
+    connection.execute("INSERT INTO Testbenches VALUES ('rigA', 'alice', '2024-05-02 10:00:00')")
+    connection.commit()
+    connection.close()
+
+    assert DatabaseController.requires_migration(databaseFile)
+    with pytest.raises(ValueError):
+        DatabaseController(databaseFile)
+
+    database = DatabaseController(databaseFile, allow_migration=True)
+    assert database.get_lock('rigA')[0] == 'alice'
+    database.close()
+    assert not DatabaseController.requires_migration(databaseFile)
+    assert not DatabaseController.requires_migration(str(tmp_path / 'missing.db'))
@@ -0,0 +1,26 @@
+from taco import __main__ as cli
+from taco.LockClient import LockClient
+
+
+def test_session_without_lease_never_expires(database, clock):
+    client = LockClient(database.dbFile, username='alice')
+    with client.session('rigA', lease=0):
+        clock.advance(3600)
+        assert database.get_lock('rigA')[0] == 'alice'
+    assert database.get_lock('rigA')[0] == ''
+    client.database.close()
+
+
+def test_run_without_lease(database, clock, monkeypatch):
+    def call(command, env):
+        clock.advance(3600)
+        return 0 if database.get_lock(env['TACO_HOSTNAME'])[0] == 'alice' else 3
+    monkeypatch.setattr(cli.sp, 'call', call)
+
+    assert cli.main(['--database', database.dbFile, '--user', 'alice', 'run', 'rigA', '--lease', '0', '--', 'pytest']) == 0
+    assert database.get_lock('rigA')[0] == ''
+
+
+def test_renew_requires_positive_lease(database):
+    database.try_acquire('rigA', 'alice', lease=60)
+    assert cli.main(['--database', database.dbFile, '--user', 'alice', 'renew', 'rigA', '--lease', '0']) == 2
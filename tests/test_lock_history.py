@@ -0,0 +1,48 @@
+from datetime import timedelta
+
+from taco.DatabaseController import DatabaseController
+from taco.LockHistory import LockHistory
+
+
+def test_utilization(database, clock):
+    start = clock.now
+    database.try_acquire('rigA', 'alice')
+    clock.advance(600)
+    database.release('rigA', 'alice')
+    database.try_acquire('rigB', 'bob')
+    clock.advance(3000)
+
+    utilization = LockHistory(database).get_utilization(DatabaseController.from_epoch(start), DatabaseController.from_epoch(clock.now))
+    assert utilization['testbenches']['rigA']['held_seconds'] == 600
+    assert utilization['testbenches']['rigB']['held_seconds'] == 3000
+    assert utilization['users']['alice']['acquisitions'] == 1
+
+
+def test_expired_lease_is_held_until_its_end(database, clock):
+    start = clock.now
+    database.try_acquire('rigA', 'alice', lease=60)     # Never renewed nor reclaimed
+    clock.advance(3600)
+
+    utilization = LockHistory(database).get_utilization(DatabaseController.from_epoch(start), DatabaseController.from_epoch(clock.now))
+    assert utilization['testbenches']['rigA']['held_seconds'] == 60
+
+
+def test_compact_keeps_utilization(database, clock):
+    clock.advance(-(LockHistory.RETENTION_DAYS + 2) * 86400)    # The cutoff of the compaction is taken from the current time
+    start = clock.now
+    database.try_acquire('rigA', 'alice')
+    clock.advance(600)
+    database.release('rigA', 'alice')
+    database.try_acquire('rigB', 'bob', lease=60)
+    database.try_acquire('rigC', 'carol')
+
+    assert LockHistory(database).compact() > 0
+    assert LockHistory(database).compact() == 0
+    database.cursor.execute("SELECT Name, Event, User FROM LockEvents")
+    assert database.cursor.fetchall() == [('rigC', 'carry', 'carol')]     # Only the lock held across the cutoff
+
+    # Compacted days are reported for ranges covering them
+    day = DatabaseController.from_epoch(start).replace(hour=0, minute=0, second=0)
+    utilization = LockHistory(database).get_utilization(day, day + timedelta(days=2))
+    assert utilization['testbenches']['rigA']['held_seconds'] == 600
+    assert utilization['testbenches']['rigB']['held_seconds'] == 60
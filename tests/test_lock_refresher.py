@@ -0,0 +1,47 @@
+import time
+import threading
+
+from taco.LockRefresher import LockRefresher
+
+
+def test_failing_task_keeps_worker_running(taco):
+    refresher = LockRefresher(taco, interval=60)
+    done = threading.Event()
+    def fail(database):
+        raise FileNotFoundError('mstsc.exe')
+    refresher.submit(fail)
+    refresher.submit(lambda database: done.set())     # Submitted with the failing task, must not be dropped
+    refresher.start()
+    try:
+        assert done.wait(5)
+        assert isinstance(refresher.last_error, FileNotFoundError)
+
+        refresher.submit(lambda database: taco.set_lock('rigA', database))
+        refresher.request_refresh()
+        snapshot = None
+        for _ in range(50):
+            snapshot = refresher.latest_snapshot() or snapshot
+            if snapshot is not None and snapshot[0].get('rigA', ('',))[0] == 'alice':
+                break
+            time.sleep(0.1)
+        assert refresher.is_alive()
+        assert snapshot[0]['rigA'][0] == 'alice'
+    finally:
+        refresher.stop()
+        refresher.join(5)
+
+
+def test_tasks_without_database_are_reported(taco):
+    taco.database = None
+    refresher = LockRefresher(taco, interval=60)
+    done = threading.Event()
+    refresher.submit(lambda database: taco.set_lock('rigA', database))
+    refresher.submit(lambda database: done.set())
+    refresher.start()
+    try:
+        assert done.wait(5)
+        assert isinstance(refresher.last_error, ValueError)
+        assert refresher.is_alive()
+    finally:
+        refresher.stop()
+        refresher.join(5)
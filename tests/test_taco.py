@@ -0,0 +1,135 @@
+import threading
+from datetime import datetime, timedelta
+
+import pytest
+
+from taco.DatabaseController import DatabaseController
+
+
+class FakeSession():
+    """Stands in for the process of a remote desktop session, which ends once finish() is called."""
+    def __init__(self) -> None:
+        self.finished = threading.Event()
+
+    def finish(self) -> None:
+        self.finished.set()
+
+    def wait(self) -> int:
+        self.finished.wait()
+        return 0
+
+    def poll(self) -> int:
+        return 0 if self.finished.is_set() else None
+
+
+@pytest.fixture
+def other(taco):
+    database = DatabaseController(taco.database.dbFile)
+    yield database
+    database.close()
+
+
+def reconnect(taco) -> None:
+    taco.database_available = True
+    assert taco.reconnect()
+
+
+def test_offline_changes_are_reconciled(taco, other):
+    assert taco.set_lock('rigA')
+    taco.go_offline()
+    assert taco.offline
+
+    assert taco.set_lock('rigB')    # Queued, applied to the lock cache right away
+    taco.unset_lock('rigA')
+    assert taco.get_cached_lock('rigB')[0] == 'alice' and taco.get_cached_lock('rigA')[0] == ''
+
+    reconnect(taco)
+    assert not taco.offline
+    assert other.get_lock('rigA')[0] == '' and other.get_lock('rigB')[0] == 'alice'
+    assert taco.pop_conflicts() == []
+
+
+def test_reconcile_keeps_locks_changed_meanwhile(taco, other):
+    taco.set_lock('rigA')
+    taco.go_offline()
+    taco.unset_lock('rigA')
+    taco.set_lock('rigB')
+
+    other.set_lock('rigA', 'bob')
+    other.try_acquire('rigB', 'carol')
+    reconnect(taco)
+
+    assert other.get_lock('rigA')[0] == 'bob' and other.get_lock('rigB')[0] == 'carol'
+    conflicts = taco.pop_conflicts()
+    assert len(conflicts) == 2 and 'carol' in conflicts[1]
+
+
+def test_reconcile_reports_reservations(taco, other):
+    taco.go_offline()
+    taco.set_lock('rigC')
+    start = datetime.now() - timedelta(seconds=1)
+    assert other.reserve('rigC', 'dave', start, start + timedelta(hours=1))[0]
+    reconnect(taco)
+
+    assert other.get_lock('rigC')[0] == ''
+    assert taco.pop_conflicts() == ['Lock of rigC was refused while offline, it is reserved by dave.']
+
+
+def test_sessions_ending_offline_are_released_on_reconnect(taco, other):
+    released = threading.Event()
+    taco.sessions.on_release = released.set
+    assert taco.set_lock('rigA', lease=60)
+    session = FakeSession()
+    taco.sessions.add('rigA', session)
+
+    taco.go_offline()
+    session.finish()
+    assert released.wait(5)
+    assert taco.sessions.ids == []
+    assert taco.get_cached_lock('rigA')[0] == ''
+    assert other.get_lock('rigA')[0] == 'alice'     # Queued until the database is back
+
+    reconnect(taco)
+    assert other.get_lock('rigA')[0] == ''
+
+
+def test_run_rdp_releases_lock_if_launch_fails(taco, monkeypatch):
+    def run_rdp(self):
+        raise FileNotFoundError('mstsc.exe')
+    monkeypatch.setattr('taco.Testbench.Testbench.run_rdp', run_rdp)
+
+    with pytest.raises(FileNotFoundError):
+        taco.run_rdp('rigA')
+    assert taco.database.get_lock('rigA')[0] == ''
+    assert taco.sessions.ids == []
+
+
+def test_run_rdp_keeps_lock_held_before(taco, monkeypatch):
+    def run_rdp(self):
+        raise FileNotFoundError('mstsc.exe')
+    monkeypatch.setattr('taco.Testbench.Testbench.run_rdp', run_rdp)
+
+    assert taco.set_lock('rigA')
+    with pytest.raises(FileNotFoundError):
+        taco.run_rdp('rigA')
+    assert taco.database.get_lock('rigA')[0] == 'alice'
+
+
+def test_poll_reads_expired_leases(taco, other, clock):
+    other.try_acquire('rigA', 'bob', lease=60)
+    taco.apply_locks(*taco.poll_locks(taco.database))
+    assert taco.get_cached_lock('rigA')[0] == 'bob'
+    taco.poll_locks(taco.database)      # Marks the changes as read
+
+    clock.advance(61)
+    assert taco.poll_locks(taco.database) is None   # The expiry does not change the database
+    taco.LOCK_REFRESH_TIMER = 0
+    taco.apply_locks(*taco.poll_locks(taco.database))
+    assert taco.get_cached_lock('rigA')[0] == ''
+
+
+def test_refused_group_is_reported(taco, other):
+    other.try_acquire('rigB', 'bob')
+    assert not taco.set_lock_group(['rigA', 'rigB'])
+    assert other.get_lock('rigA')[0] == ''
+    assert taco.pop_notices() == ['rigA, rigB could not be locked, rigB is used by bob.']